@@ -1,99 +1,196 @@
-#from dotenv import load_dotenv
-import os
-from openai import OpenAI
-#load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import asyncio
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException, Header
+import time
+from typing import Optional, Tuple
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from database import get_db
-from models import HealthData, User
-from utils import decode_access_token
+from database import get_db, get_session_scope, run_db
+from health_summary import build_prompt_body, estimate_tokens, load_readings
+from insights import lookup_insight, store_insight
+from jobs import SUCCEEDED, create_job_queue
+from metrics import record_ai_fallback
+from rule_insights import load_recent_readings, rule_based_insight
+from security import Principal, get_current_user
+import llm
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
+insight_jobs = create_job_queue()
+MAX_JOB_WAIT_SECONDS = 30
+
 logging.basicConfig(level=logging.INFO)
 
+NO_DATA_MESSAGE = "No health data found to generate insights."
+
 class AIRequest(BaseModel):
     # Extend this model if you want to add extra parameters later
     pass
 
-def get_current_user(
-    authorization: str = Header(None),
-    db: Session = Depends(get_db)
-) -> User:
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Token missing")
-    parts = authorization.split()
-    if len(parts) != 2 or parts[0].lower() != "bearer":
-        raise HTTPException(status_code=401, detail="Invalid authorization header")
-    token = parts[1]
-    payload = decode_access_token(token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-    user_id = payload.get("sub")
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    return user
-
-@router.post("/")
-def get_health_insights(
-    request: AIRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    entries = db.query(HealthData).filter(HealthData.patient_id == current_user.id).all()
-    if not entries:
-        return {"insights": "No health data found to generate insights."}
-
-    # Prepare a detailed list of health entries including timestamp
-    formatted_entries = []
-    for entry in entries:
-        # Ensure entry.timestamp exists and convert it to a readable format
-        timestamp_str = entry.timestamp.strftime("%Y-%m-%d %H:%M:%S") if entry.timestamp else "N/A"
-        formatted_entries.append({
-            "timestamp": timestamp_str,
-            "weight": entry.weight,
-            "blood_pressure": entry.bp,
-            "glucose": entry.glucose,
-        })
-
-    # Build a prompt with clear instructions and structured formatting
-    prompt = (
-    "You are a helpful medical assistant. Below is an aggregated list of health data entries for a user, "
-    "each with a timestamp and corresponding measurements. Please analyze the overall progression of the user's health data, "
+PROMPT_INSTRUCTIONS = (
+    "You are a helpful medical assistant. Below is a statistical summary of a user's full health history "
+    "followed by their most recent readings. Please analyze the overall progression of the user's health data, "
     "identifying trends and any significant deviations (e.g., if values are consistently too high or too low). "
     "Provide personalized recommendations based on the overall trend and progression, addressing weight (in lbs), blood pressure (in mmHg), and glucose (in mg/dL). "
     "Return your analysis and recommendations as one well-structured paragraph (2-3 sentences) without listing each individual data point.\n\n"
-    "Health Data Entries:\n\n"
+)
+PROMPT_CLOSING = "\n\nPlease provide one hollistic recommendation with the whole history in mind, aggregated and reasoned as specified."
+
+async def build_prompt(db: Session, patient_id: int) -> str:
+    readings = await run_db(db, load_readings, patient_id)
+    # Fixed-size digest of the whole history plus the newest raw readings, so the
+    # prompt stays within AI_PROMPT_TOKEN_BUDGET however long the history grows
+    body = await run_in_threadpool(
+        build_prompt_body, readings, reserved_tokens=estimate_tokens(PROMPT_INSTRUCTIONS + PROMPT_CLOSING)
     )
+    return PROMPT_INSTRUCTIONS + body + PROMPT_CLOSING
 
-    for entry in formatted_entries:
-        prompt += (
-            f"Timestamp: {entry['timestamp']}\n"
-            f"- Weight (lbs): {entry['weight']}\n"
-            f"- Blood Pressure (mmHg): {entry['blood_pressure']}\n"
-            f"- Glucose (mg/dL): {entry['glucose']}\n\n"
-        )
-    prompt += "Please provide one hollistic recommendation with each entry in mind, aggregated and reasoned as specified."
+async def prepare_insight(db: Session, patient_id: int) -> Tuple[Optional[str], Optional[int], Optional[str], Optional[str]]:
+    """Returns (fingerprint, newest entry id, stored insight, prompt); the prompt is only built on a miss."""
+    fingerprint, latest_id, stored = await run_db(db, lookup_insight, patient_id)
+    if fingerprint is None or stored is not None:
+        return fingerprint, latest_id, stored, None
+    prompt = await build_prompt(db, patient_id)
+    # Never log the prompt itself: it is the user's health history
+    logging.debug("Built AI prompt for user %s (~%d tokens)", patient_id, estimate_tokens(prompt))
+    return fingerprint, latest_id, None, prompt
 
-    logging.info("Sending prompt to OpenAI:\n%s", prompt)
+async def fallback_insight(db: Session, patient_id: int, reason: str) -> dict:
+    # Deterministic and local; not stored, so the next request tries the LLM again
+    record_ai_fallback(reason)
+    readings = await run_db(db, load_recent_readings, patient_id)
+    return {"insights": rule_based_insight(readings), "source": "rule_based", "fallback_reason": reason}
+
+@router.post("/")
+async def get_health_insights(
+    request: AIRequest,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    # The budget covers the whole request, prompt building included
+    deadline = time.monotonic() + llm.AI_LATENCY_BUDGET_SECONDS
+    fingerprint, latest_id, stored, prompt = await prepare_insight(db, current_user.id)
+    if fingerprint is None:
+        return {"insights": NO_DATA_MESSAGE}
+    # Nothing changed since the last generation
+    if stored is not None:
+        return {"insights": stored}
 
     try:
-        response = client.chat.completions.create(model="gpt-3.5-turbo",  # Use "gpt-3.5-turbo" if GPT-4 is unavailable
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful medical assistant who provides personalized health advice in a structured format."
-            },
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=250,
-        temperature=0.7)
-        ai_content = response.choices[0].message.content.strip()
-        return {"insights": ai_content}
+        ai_content = await llm.complete_within(prompt, deadline - time.monotonic())
+    except asyncio.TimeoutError:
+        logging.warning("AI insight for user %s exceeded the %.1fs budget", current_user.id, llm.AI_LATENCY_BUDGET_SECONDS)
+        return await fallback_insight(db, current_user.id, "timeout")
     except Exception as e:
         logging.error("OpenAI API error: %s", str(e))
-        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+        return await fallback_insight(db, current_user.id, "error")
+
+    await run_db(db, store_insight, current_user.id, fingerprint, latest_id, ai_content)
+    return {"insights": ai_content}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/stream")
+async def stream_health_insights(
+    request: AIRequest,
+    db: Session = Depends(get_db),
+    session_scope=Depends(get_session_scope),
+    current_user: Principal = Depends(get_current_user)
+):
+    # Everything that needs the request's session happens before streaming starts;
+    # the session is closed by the time the generator runs.
+    fingerprint, latest_id, stored, prompt = await prepare_insight(db, current_user.id)
+    patient_id = current_user.id
+
+    async def events():
+        if fingerprint is None:
+            yield sse_event("done", {"insights": NO_DATA_MESSAGE})
+            return
+        if stored is not None:
+            yield sse_event("token", {"content": stored})
+            yield sse_event("done", {"insights": stored})
+            return
+
+        pieces = []
+        try:
+            async for piece in llm.stream_completion(prompt):
+                pieces.append(piece)
+                yield sse_event("token", {"content": piece})
+        except asyncio.TimeoutError:
+            logging.warning("AI stream for user %s timed out", patient_id)
+            yield sse_event("error", {"detail": "Insight generation timed out"})
+            return
+        except asyncio.CancelledError:
+            # Client went away; llm.stream_completion has already closed the upstream stream
+            logging.info("AI stream for user %s cancelled by client disconnect", patient_id)
+            raise
+        except Exception as e:
+            logging.error("OpenAI API error: %s", str(e))
+            yield sse_event("error", {"detail": "Insight generation failed"})
+            return
+
+        ai_content = "".join(pieces).strip()
+        async with session_scope() as session:
+            await run_db(session, store_insight, patient_id, fingerprint, latest_id, ai_content)
+        yield sse_event("done", {"insights": ai_content})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def run_insight_job(app: FastAPI, payload: dict) -> dict:
+    patient_id = payload["patient_id"]
+    async with app.state.session_scope() as db:
+        fingerprint, latest_id, stored, prompt = await prepare_insight(db, patient_id)
+        if fingerprint is None:
+            return {"insights": NO_DATA_MESSAGE}
+        if stored is not None:
+            return {"insights": stored}
+        try:
+            ai_content = await llm.complete(prompt)
+        except Exception as e:
+            logging.error("OpenAI API error: %s", str(e))
+            raise RuntimeError("Insight generation failed")
+        await run_db(db, store_insight, patient_id, fingerprint, latest_id, ai_content)
+    return {"insights": ai_content}
+
+async def start_insight_jobs(app: FastAPI) -> None:
+    await insight_jobs.start(lambda payload: run_insight_job(app, payload))
+
+async def stop_insight_jobs() -> None:
+    await insight_jobs.stop()
+
+@router.post("/jobs", status_code=202)
+async def create_insight_job(
+    request: AIRequest,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    fingerprint, _, stored = await run_db(db, lookup_insight, current_user.id)
+    if fingerprint is None or stored is not None:
+        # Nothing to generate: answer straight away instead of allocating a job record
+        response.status_code = 200
+        return {"status": SUCCEEDED, "result": {"insights": NO_DATA_MESSAGE if fingerprint is None else stored}}
+    # Repeated taps for the same data coalesce onto the job already in flight
+    job = await insight_jobs.submit(
+        f"insights:{current_user.id}:{fingerprint}", current_user.id, {"patient_id": current_user.id}
+    )
+    return job.to_dict()
+
+@router.get("/jobs/{job_id}")
+async def get_insight_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=MAX_JOB_WAIT_SECONDS),
+    current_user: Principal = Depends(get_current_user)
+):
+    job = await insight_jobs.wait(job_id, wait)
+    if job is None or job.owner != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
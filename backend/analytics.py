@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+from database import get_read_db, run_db
+from models import HealthMetricStats
+from security import Principal, get_admin_user
+from sketches import merged_digest
+from utils import to_naive_utc
+
+router = APIRouter(prefix="/admin/analytics", tags=["analytics"])
+
+DEFAULT_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+DEFAULT_RANGE_DAYS = 30
+# Stage 1 hypertension and above (ACC/AHA)
+ELEVATED_SYSTOLIC = 130
+ELEVATED_DIASTOLIC = 80
+
+def percentile_summary(db: Session, metric: str, since: datetime, until: datetime, quantiles: List[float]) -> dict:
+    # Merges per-bucket sketches: cost depends on the range's bucket count, not on how many readings it holds
+    digest = merged_digest(db, metric, since, until)
+    return {
+        "metric": metric,
+        "since": since,
+        "until": until,
+        "count": int(digest.count),
+        "min": digest.min,
+        "max": digest.max,
+        "percentiles": {
+            f"p{q * 100:g}": round(value, 2) if (value := digest.quantile(q)) is not None else None for q in quantiles
+        },
+    }
+
+def elevated_bp_share(db: Session, systolic: float, diastolic: float) -> dict:
+    # Each user's recent level (the EWMA from their running stats), so one stale reading doesn't count
+    per_user = db.query(
+        HealthMetricStats.patient_id,
+        func.max(HealthMetricStats.ewma).filter(HealthMetricStats.metric == "systolic").label("systolic"),
+        func.max(HealthMetricStats.ewma).filter(HealthMetricStats.metric == "diastolic").label("diastolic"),
+    ).filter(
+        HealthMetricStats.metric.in_(("systolic", "diastolic")), HealthMetricStats.count > 0
+    ).group_by(HealthMetricStats.patient_id).subquery()
+    users, elevated = db.query(
+        func.count(),
+        func.count().filter(or_(per_user.c.systolic >= systolic, per_user.c.diastolic >= diastolic)),
+    ).select_from(per_user).one()
+    return {
+        "users": users,
+        "elevated": elevated,
+        "share": round(elevated / users, 4) if users else None,
+        "thresholds": {"systolic": systolic, "diastolic": diastolic},
+    }
+
+@router.get("/percentiles", response_model=dict)
+async def get_percentiles(
+    metric: str = Query(..., pattern="^(weight|glucose|systolic|diastolic)$"),
+    q: List[float] = Query(DEFAULT_QUANTILES),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+    admin: Principal = Depends(get_admin_user)
+):
+    """Approximate population percentiles of one metric over [since, until), at day granularity."""
+    if any(not 0 <= value <= 1 for value in q):
+        raise HTTPException(status_code=400, detail="Quantiles must be between 0 and 1")
+    until = to_naive_utc(until) or datetime.utcnow()
+    since = to_naive_utc(since) or until - timedelta(days=DEFAULT_RANGE_DAYS)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    return await run_db(db, percentile_summary, metric, since, until, q)
+
+@router.get("/blood-pressure", response_model=dict)
+async def get_blood_pressure_share(
+    systolic: float = Query(ELEVATED_SYSTOLIC, gt=0),
+    diastolic: float = Query(ELEVATED_DIASTOLIC, gt=0),
+    db: Session = Depends(get_read_db),
+    admin: Principal = Depends(get_admin_user)
+):
+    """Share of users whose recent blood pressure is at or above either threshold."""
+    return await run_db(db, elevated_bp_share, systolic, diastolic)
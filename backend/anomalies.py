@@ -0,0 +1,199 @@
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from models import HealthData, HealthDataAnomaly, HealthDataDailySummary, HealthMetricStats
+from rollups import METRICS, REBUILD_BATCH_SIZE, patients_with_history, reading_values
+
+# Readings further than this many standard deviations from the user's mean are flagged
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.0"))
+# No z-scores until a metric has this many readings; the variance means little before that
+ANOMALY_MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", "5"))
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.2"))
+# Jumps between consecutive readings this close together count as sudden changes
+ANOMALY_RATE_WINDOW_HOURS = float(os.getenv("ANOMALY_RATE_WINDOW_HOURS", "48"))
+# Largest unflagged change from the previous reading (lbs, mg/dL, mmHg)
+MAX_CHANGE = {"weight": 5.0, "glucose": 60.0, "systolic": 30.0, "diastolic": 20.0}
+
+# (entry id, timestamp, {metric: value or None})
+Observation = Tuple[int, datetime, Dict[str, Optional[float]]]
+
+def entry_observation(entry: HealthData) -> Observation:
+    return entry.id, entry.timestamp, reading_values(entry.weight, entry.systolic, entry.diastolic, entry.glucose)
+
+def std_dev(stats: HealthMetricStats) -> Optional[float]:
+    if stats.count < 2:
+        return None
+    return math.sqrt(max(stats.m2, 0.0) / (stats.count - 1))
+
+def _add(stats: HealthMetricStats, value: float, timestamp: datetime) -> None:
+    # Welford's update: mean and M2 in one pass, no history needed
+    stats.count += 1
+    delta = value - stats.mean
+    stats.mean += delta / stats.count
+    stats.m2 += delta * (value - stats.mean)
+    if stats.last_timestamp is None or timestamp >= stats.last_timestamp:
+        # EWMA and the last value follow time order; backfilled older readings only feed the mean
+        stats.ewma = value if stats.ewma is None else ANOMALY_EWMA_ALPHA * value + (1 - ANOMALY_EWMA_ALPHA) * stats.ewma
+        stats.last_value, stats.last_timestamp = value, timestamp
+
+def _remove(stats: HealthMetricStats, value: float) -> None:
+    if stats.count <= 1:
+        stats.count, stats.mean, stats.m2 = 0, 0.0, 0.0
+        return
+    mean = (stats.count * stats.mean - value) / (stats.count - 1)
+    stats.m2 = max(stats.m2 - (value - mean) * (value - stats.mean), 0.0)
+    stats.count -= 1
+    stats.mean = mean
+
+def _check(stats: HealthMetricStats, metric: str, value: float, timestamp: datetime) -> List[dict]:
+    flags = []
+    std = std_dev(stats)
+    if stats.count >= ANOMALY_MIN_SAMPLES and std:
+        z = (value - stats.mean) / std
+        if abs(z) >= ANOMALY_Z_THRESHOLD:
+            flags.append({"metric": metric, "kind": "zscore", "value": value, "expected": round(stats.mean, 2), "score": round(z, 2)})
+    if (
+        stats.last_value is not None
+        and stats.last_timestamp <= timestamp <= stats.last_timestamp + timedelta(hours=ANOMALY_RATE_WINDOW_HOURS)
+    ):
+        change = value - stats.last_value
+        if abs(change) > MAX_CHANGE[metric]:
+            flags.append({
+                "metric": metric, "kind": "rate_of_change", "value": value,
+                "expected": stats.last_value, "score": round(change / MAX_CHANGE[metric], 2),
+            })
+    return flags
+
+def _load(db: Session, patient_id: int) -> Dict[str, HealthMetricStats]:
+    rows = db.query(HealthMetricStats).filter(HealthMetricStats.patient_id == patient_id).all()
+    stats = {row.metric: row for row in rows}
+    missing = [metric for metric in METRICS if metric not in stats]
+    for metric in missing:
+        stats[metric] = HealthMetricStats(patient_id=patient_id, metric=metric, count=0, mean=0.0, m2=0.0)
+        db.add(stats[metric])
+    if missing:
+        # Sessions don't autoflush, and a later _load in the same transaction must find these rows
+        db.flush()
+    return stats
+
+def observe(
+    db: Session,
+    patient_id: int,
+    observations: Sequence[Observation],
+    flag: bool = True,
+    stats: Optional[Dict[str, HealthMetricStats]] = None,
+) -> List[dict]:
+    """Checks new readings against the user's running stats, then folds them in; the caller commits.
+
+    Each reading is compared with the stats as they were before it, so a spike
+    doesn't dilute its own z-score. Callers bump the data version first, which
+    serialises writers per user and keeps the read-modify-write here safe.
+    ``stats`` can be the rows an earlier ``retract`` in the same transaction returned.
+    """
+    stats = stats or _load(db, patient_id)
+    found = []
+    for entry_id, timestamp, values in sorted(observations, key=lambda o: (o[1], o[0])):
+        for metric in METRICS:
+            value = values.get(metric)
+            if value is None:
+                continue
+            if flag:
+                for anomaly in _check(stats[metric], metric, value, timestamp):
+                    db.add(HealthDataAnomaly(patient_id=patient_id, entry_id=entry_id, timestamp=timestamp, **anomaly))
+                    found.append({"entry_id": entry_id, **anomaly})
+            _add(stats[metric], value, timestamp)
+    return found
+
+def retract(db: Session, patient_id: int, observation: Observation) -> Dict[str, HealthMetricStats]:
+    """Takes an edited or deleted reading back out of the stats and drops its flags; returns the stats rows."""
+    entry_id, timestamp, values = observation
+    stats = _load(db, patient_id)
+    db.query(HealthDataAnomaly).filter(HealthDataAnomaly.entry_id == entry_id).delete(synchronize_session=False)
+    previous = None
+    for metric in METRICS:
+        value = values.get(metric)
+        if value is None:
+            continue
+        _remove(stats[metric], value)
+        if stats[metric].last_timestamp == timestamp:
+            # The latest reading went away: the one before it becomes the baseline for jumps,
+            # and reseeds the EWMA so repeated corrections don't pile up in it.
+            if previous is None:
+                previous = db.query(HealthData).filter(
+                    HealthData.patient_id == patient_id, HealthData.id != entry_id
+                ).order_by(HealthData.timestamp.desc(), HealthData.id.desc()).first() or False
+            _, last_timestamp, last_values = entry_observation(previous) if previous else (None, None, {})
+            last_value = last_values.get(metric)
+            stats[metric].last_value = stats[metric].ewma = last_value
+            stats[metric].last_timestamp = last_timestamp if last_value is not None else None
+    return stats
+
+def _seed_from_summaries(db: Session, patient_id: int) -> None:
+    # Readings retention moved out count towards the mean and variance through their
+    # day's sums; the EWMA and the last value follow the live readings replayed next.
+    table = HealthDataDailySummary
+    columns = []
+    for metric in METRICS:
+        columns += [
+            func.sum(getattr(table, f"{metric}_count")),
+            func.sum(getattr(table, f"{metric}_sum")),
+            func.sum(getattr(table, f"{metric}_sumsq")),
+        ]
+    totals = db.query(*columns).filter(table.patient_id == patient_id).one()
+    stats = _load(db, patient_id)
+    for i, metric in enumerate(METRICS):
+        count, total, sumsq = totals[3 * i:3 * i + 3]
+        if not count:
+            continue
+        stats[metric].count = count
+        stats[metric].mean = total / count
+        stats[metric].m2 = max((sumsq or 0.0) - total * total / count, 0.0)
+
+def rebuild_patient_stats(db: Session, patient_id: int) -> None:
+    db.query(HealthMetricStats).filter(HealthMetricStats.patient_id == patient_id).delete(synchronize_session=False)
+    _seed_from_summaries(db, patient_id)
+    stats = _load(db, patient_id)
+    rows = db.execute(
+        select(HealthData.id, HealthData.timestamp, HealthData.weight, HealthData.systolic, HealthData.diastolic, HealthData.glucose)
+        .where(HealthData.patient_id == patient_id, HealthData.timestamp.isnot(None))
+        .order_by(HealthData.timestamp, HealthData.id)
+        .execution_options(yield_per=REBUILD_BATCH_SIZE)
+    )
+    # observe sorts only within a call, so partitions arrive in replay order and share one set of stats rows
+    for partition in rows.partitions():
+        observe(db, patient_id, [(i, ts, reading_values(w, s, d, g)) for i, ts, w, s, d, g in partition], flag=False, stats=stats)
+
+def rebuild_all_stats(db: Session) -> None:
+    """Replays every user's history into the running stats; used to backfill existing databases."""
+    patient_ids = patients_with_history(db)
+    for patient_id in patient_ids:
+        rebuild_patient_stats(db, patient_id)
+        db.commit()
+
+def baselines(db: Session, patient_id: int) -> Dict[str, dict]:
+    rows = db.query(HealthMetricStats).filter(HealthMetricStats.patient_id == patient_id).all()
+    return {
+        row.metric: {
+            "count": row.count,
+            "mean": round(row.mean, 2) if row.count else None,
+            "std": round(std_dev(row), 2) if std_dev(row) is not None else None,
+            "ewma": round(row.ewma, 2) if row.ewma is not None else None,
+            "last_value": row.last_value,
+            "last_timestamp": row.last_timestamp,
+        }
+        for row in rows
+    }
+
+def load_anomalies(db: Session, patient_id: int, since: Optional[datetime], limit: int) -> dict:
+    query = db.query(
+        HealthDataAnomaly.id, HealthDataAnomaly.entry_id, HealthDataAnomaly.metric, HealthDataAnomaly.kind,
+        HealthDataAnomaly.value, HealthDataAnomaly.expected, HealthDataAnomaly.score,
+        HealthDataAnomaly.timestamp, HealthDataAnomaly.detected_at,
+    ).filter(HealthDataAnomaly.patient_id == patient_id)
+    if since:
+        query = query.filter(HealthDataAnomaly.timestamp >= since)
+    rows = query.order_by(HealthDataAnomaly.timestamp.desc(), HealthDataAnomaly.id.desc()).limit(limit).all()
+    return {"anomalies": [dict(row._mapping) for row in rows], "baselines": baselines(db, patient_id)}
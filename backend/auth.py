@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr
-from database import get_db
+from database import get_db, run_db
+from hashing import password_hasher, HashingPoolFull, PASSWORD_HASH_RETRY_AFTER
 from models import User
-from utils import hash_password, verify_password, create_access_token
+from utils import create_access_token, password_needs_update
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -17,36 +18,63 @@ class LoginRequest(BaseModel):
     email: EmailStr
     password: str
 
+def find_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+def hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication is busy, please retry shortly",
+        headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+    )
+
+def update_password_hash(db: Session, user_id: int, hashed_password: str) -> None:
+    user = db.get(User, user_id)
+    user.password = hashed_password
+    db.commit()
+
 @router.post("/register")
-def register_user(request: RegisterRequest, db: Session = Depends(get_db)):
+async def register_user(request: RegisterRequest, db: Session = Depends(get_db)):
     # Check if user already exists
-    existing_user = db.query(User).filter(User.email == request.email).first()
+    existing_user = await run_db(db, find_user_by_email, request.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    # Hash the password and save the user
-    hashed_password = hash_password(request.password)
-    new_user = User(
-        email=request.email, 
-        password=hashed_password,
-        first_name=request.firstName,
-        last_name=request.lastName
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    # Hash the password in the worker pool and save the user
+    try:
+        hashed_password = await password_hasher.hash(request.password)
+    except HashingPoolFull:
+        raise hashing_busy()
+
+    def _create(session: Session) -> None:
+        new_user = User(
+            email=request.email, 
+            password=hashed_password,
+            first_name=request.firstName,
+            last_name=request.lastName
+        )
+        session.add(new_user)
+        session.commit()
+
+    await run_db(db, _create)
     return {"message": "User registered successfully"}
 
 @router.post("/login")
-def login_user(request: LoginRequest, db: Session = Depends(get_db)):
+async def login_user(request: LoginRequest, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.email == request.email).first()
+    user = await run_db(db, find_user_by_email, request.email)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
     # Verify password
-    if not verify_password(request.password, user.password):
-        raise HTTPException(status_code=401, detail="Invalid email or password")
+    try:
+        if not await password_hasher.verify(request.password, user.password):
+            raise HTTPException(status_code=401, detail="Invalid email or password")
+        # Transparently move old hashes onto the current cost factor
+        if password_needs_update(user.password):
+            await run_db(db, update_password_hash, user.id, await password_hasher.hash(request.password))
+    except HashingPoolFull:
+        raise hashing_busy()
 
     # Create JWT
     access_token = create_access_token({"sub": str(user.id)})
@@ -0,0 +1,240 @@
+"""Nightly batch generation of AI insights.
+
+    python batch_insights.py --checkpoint insights-checkpoint.json
+    python batch_insights.py --checkpoint insights-checkpoint.json --resume
+
+Walks every user whose data changed since their last stored insight, building
+prompts a page of users at a time, and calls the model concurrently within
+request- and token-per-minute budgets. Failed calls are retried with jittered
+exponential backoff. Progress is checkpointed, so an interrupted run picks up
+where it stopped with --resume. Results land in ai_insights, where POST /ai/
+serves them without an LLM call.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Set
+
+if __name__ == "__main__":
+    # Modules below read their settings on import, so .env must be loaded first
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from database import run_db, session_scope as default_session_scope
+from health_summary import estimate_tokens
+from insights import pending_patients, store_insight
+import llm
+
+logger = logging.getLogger(__name__)
+
+INSIGHT_BATCH_CONCURRENCY = int(os.getenv("INSIGHT_BATCH_CONCURRENCY", "8"))
+# Provider quotas; 0 disables a limit
+INSIGHT_BATCH_REQUESTS_PER_MINUTE = float(os.getenv("INSIGHT_BATCH_REQUESTS_PER_MINUTE", "300"))
+INSIGHT_BATCH_TOKENS_PER_MINUTE = float(os.getenv("INSIGHT_BATCH_TOKENS_PER_MINUTE", "150000"))
+INSIGHT_BATCH_MAX_RETRIES = int(os.getenv("INSIGHT_BATCH_MAX_RETRIES", "5"))
+INSIGHT_BATCH_BACKOFF_SECONDS = float(os.getenv("INSIGHT_BATCH_BACKOFF_SECONDS", "1"))
+INSIGHT_BATCH_MAX_BACKOFF_SECONDS = float(os.getenv("INSIGHT_BATCH_MAX_BACKOFF_SECONDS", "60"))
+# Users fetched per candidate query; prompts are built one user at a time from these pages
+INSIGHT_BATCH_PAGE_SIZE = int(os.getenv("INSIGHT_BATCH_PAGE_SIZE", "500"))
+CHECKPOINT_EVERY = 50
+
+class TokenBucket:
+    """Refills at ``rate`` per second up to ``capacity``; ``acquire`` waits until enough is available.
+
+    Waiters are served in arrival order, so one large request can't be starved by small ones.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+def per_minute_bucket(limit: float) -> TokenBucket:
+    # A full minute's budget may be spent in a burst, then it refills steadily
+    return TokenBucket(limit / 60, limit)
+
+def backoff_delay(attempt: int, base: float = INSIGHT_BATCH_BACKOFF_SECONDS, cap: float = INSIGHT_BATCH_MAX_BACKOFF_SECONDS) -> float:
+    # "Full jitter": spreads retries out so concurrent workers don't hit the provider in lockstep
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class Checkpoint:
+    """Tracks the highest patient id below which every user is finished.
+
+    Workers finish out of order, so the cursor only moves past an id once all
+    smaller in-flight ids are done; resuming from it never skips a user.
+    """
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self.cursor = 0
+        self.failed: List[int] = []
+        self._in_flight: Set[int] = set()
+        self._dispatched = 0
+
+    def load(self) -> None:
+        if self.path and self.path.exists():
+            state = json.loads(self.path.read_text())
+            self.cursor, self.failed = state["cursor"], state["failed"]
+            self._dispatched = self.cursor
+
+    def start(self, patient_id: int) -> None:
+        self._in_flight.add(patient_id)
+        self._dispatched = max(self._dispatched, patient_id)
+
+    def finish(self, patient_id: int, ok: bool) -> None:
+        self._in_flight.discard(patient_id)
+        if not ok:
+            self.failed.append(patient_id)
+        self.cursor = min(self._in_flight) - 1 if self._in_flight else self._dispatched
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"cursor": self.cursor, "failed": sorted(self.failed)}))
+        tmp.replace(self.path)
+
+async def complete_with_retries(
+    prompt: str, retries: int, throttle: Optional[Callable[[str], Awaitable[None]]] = None
+) -> str:
+    for attempt in range(retries + 1):
+        # Every attempt, retries included, spends from the rate limits
+        if throttle is not None:
+            await throttle(prompt)
+        try:
+            return await llm.complete(prompt)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("LLM call failed (%s), retry %d/%d in %.1fs", type(e).__name__, attempt + 1, retries, delay)
+            await asyncio.sleep(delay)
+
+async def run_batch(
+    session_scope=default_session_scope,
+    concurrency: int = INSIGHT_BATCH_CONCURRENCY,
+    requests_per_minute: float = INSIGHT_BATCH_REQUESTS_PER_MINUTE,
+    tokens_per_minute: float = INSIGHT_BATCH_TOKENS_PER_MINUTE,
+    retries: int = INSIGHT_BATCH_MAX_RETRIES,
+    checkpoint: Optional[Checkpoint] = None,
+    limit: Optional[int] = None,
+) -> dict:
+    """Generates and stores insights for every user with new data; returns run counts."""
+    # Imported here so the command doesn't pull in the API module until it runs
+    from ai import prepare_insight
+
+    concurrency = max(1, concurrency)
+    checkpoint = checkpoint or Checkpoint(None)
+    request_bucket = per_minute_bucket(requests_per_minute)
+    token_bucket = per_minute_bucket(tokens_per_minute)
+    # Bounded, so prompts are built only slightly ahead of the workers consuming them
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"generated": 0, "failed": 0, "skipped": 0}
+    skip = set(checkpoint.failed)
+
+    async def throttle(prompt: str) -> None:
+        await request_bucket.acquire()
+        await token_bucket.acquire(estimate_tokens(prompt) + llm.OPENAI_MAX_TOKENS)
+
+    async def produce():
+        after, queued = checkpoint.cursor, 0
+        async with session_scope() as db:
+            while limit is None or queued < limit:
+                page = await run_db(db, pending_patients, after, INSIGHT_BATCH_PAGE_SIZE)
+                if not page:
+                    break
+                after = page[-1]
+                for patient_id in page:
+                    if patient_id in skip:
+                        continue
+                    if limit is not None and queued >= limit:
+                        break
+                    fingerprint, latest_id, stored, prompt = await prepare_insight(db, patient_id)
+                    if prompt is None:
+                        counts["skipped"] += 1
+                        continue
+                    checkpoint.start(patient_id)
+                    await queue.put((patient_id, fingerprint, latest_id, prompt))
+                    queued += 1
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            patient_id, fingerprint, latest_id, prompt = item
+            ok = False
+            try:
+                insight = await complete_with_retries(prompt, retries, throttle)
+                async with session_scope() as db:
+                    await run_db(db, store_insight, patient_id, fingerprint, latest_id, insight)
+                ok = True
+            except Exception as e:
+                logger.error("Insight generation failed for user %s: %s", patient_id, type(e).__name__)
+            counts["generated" if ok else "failed"] += 1
+            checkpoint.finish(patient_id, ok)
+            if (counts["generated"] + counts["failed"]) % CHECKPOINT_EVERY == 0:
+                checkpoint.save()
+
+    workers = [asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(produce(), *workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        # Also on interruption: the cursor only covers finished users, so this is always safe
+        checkpoint.save()
+    return {**counts, "cursor": checkpoint.cursor}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=INSIGHT_BATCH_CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=INSIGHT_BATCH_REQUESTS_PER_MINUTE, help="requests per minute, 0 for no limit")
+    parser.add_argument("--tpm", type=float, default=INSIGHT_BATCH_TOKENS_PER_MINUTE, help="tokens per minute, 0 for no limit")
+    parser.add_argument("--retries", type=int, default=INSIGHT_BATCH_MAX_RETRIES)
+    parser.add_argument("--limit", type=int, help="stop after this many users")
+    parser.add_argument("--checkpoint", help="file recording progress")
+    parser.add_argument("--resume", action="store_true", help="continue from --checkpoint instead of starting over")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    checkpoint = Checkpoint(Path(args.checkpoint) if args.checkpoint else None)
+    if args.resume:
+        checkpoint.load()
+    result = asyncio.run(run_batch(
+        concurrency=args.concurrency, requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+        retries=args.retries, checkpoint=checkpoint, limit=args.limit,
+    ))
+    print(json.dumps(result), file=sys.stderr)
+    if result["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
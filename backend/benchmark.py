@@ -0,0 +1,329 @@
+"""Load-test harness: seeds a synthetic database and drives the app in-process.
+
+    python benchmark.py --users 10000 --readings 1000 --concurrency 32 --output bench.json
+    python benchmark.py --compare bench-before.json --output bench-after.json
+
+The seeded database is cached (in --cache-dir) per (users, readings, seed) and copied before
+every run, so results from different commits start from identical data.
+Requests go through httpx.AsyncClient over ASGI, so the numbers measure the
+app, routing and database, not the network. The LLM is always the local stub.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SCENARIOS = ("register", "login", "ingest", "list", "stats", "update", "delete", "ai")
+SEED_PASSWORD = "bench-password"
+SEED_START = datetime(2024, 1, 1)
+SEED_BATCH_USERS = 100
+# Part of the cached seed's file name; bump when seed_database changes what it writes
+SEED_FORMAT = 2
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--readings", type=int, default=1000, help="readings per seeded user")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="simulated LLM latency in seconds")
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "nexus-bench"))
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--compare", help="earlier JSON report to diff against")
+    return parser.parse_args(argv)
+
+def seed_database(path: Path, users: int, readings: int, seed: int) -> None:
+    from sqlalchemy import insert
+    from sqlalchemy.orm import Session
+    from database import create_db_engine
+    from migrations import migrate
+    from models import Base, HealthData, User, UserDataVersion
+    from utils import hash_password
+
+    tmp = path.with_suffix(".tmp")
+    tmp.unlink(missing_ok=True)
+    engine = create_db_engine(f"sqlite:///{tmp}")
+    # Schema only: the data migrations run once the rows exist, as they would on a production upgrade
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    # One hash for everyone: hashing 10k passwords would dominate the seed time
+    hashed = hash_password(SEED_PASSWORD)
+    step = timedelta(hours=8)
+
+    with Session(bind=engine) as session:
+        for first in range(1, users + 1, SEED_BATCH_USERS):
+            ids = range(first, min(first + SEED_BATCH_USERS, users + 1))
+            session.execute(insert(User), [
+                {"id": uid, "email": f"bench{uid}@example.com", "password": hashed, "first_name": "Bench", "last_name": str(uid)}
+                for uid in ids
+            ])
+            # Each user's history as if written by one batch upload: version 1, change_seq 1
+            session.execute(insert(UserDataVersion), [{"patient_id": uid, "version": 1} for uid in ids])
+            for uid in ids:
+                weight, systolic, diastolic, glucose = rng.uniform(120, 260), rng.randint(100, 150), rng.randint(60, 95), rng.uniform(70, 160)
+                rows = []
+                for i in range(readings):
+                    s, d = systolic + rng.randint(-8, 8), diastolic + rng.randint(-6, 6)
+                    timestamp = SEED_START + i * step
+                    rows.append({
+                        "patient_id": uid,
+                        "weight": round(weight + rng.gauss(0, 2), 2),
+                        "bp": f"{s}/{d}",
+                        "systolic": s,
+                        "diastolic": d,
+                        "glucose": round(glucose + rng.gauss(0, 10), 2),
+                        "timestamp": timestamp,
+                        "updated_at": timestamp,
+                        "change_seq": 1,
+                    })
+                session.execute(insert(HealthData), rows)
+            session.commit()
+            print(f"seeded {ids[-1]}/{users} users", file=sys.stderr)
+    # Backfills rollups, running stats and sketches from the seeded rows
+    migrate(engine)
+    engine.dispose()
+    tmp.replace(path)
+
+def migrate_database(path: Path) -> None:
+    from database import create_db_engine
+    from migrations import migrate
+
+    engine = create_db_engine(f"sqlite:///{path}")
+    migrate(engine)
+    engine.dispose()
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(latencies, errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+
+class Context:
+    """Picks users and entries for requests; deterministic for a given seed."""
+
+    def __init__(self, args, engine):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.run_id = uuid.UUID(int=self.rng.getrandbits(128)).hex[:8]
+        # A plain sync engine whatever DB_ASYNC says: the picks happen outside the timed path
+        self.engine = engine
+        self.counter = 0
+        self._tokens = {}
+        self._entries = None
+
+    def user(self) -> int:
+        return self.rng.randint(1, self.args.users)
+
+    def headers(self, uid: int) -> dict:
+        # Tokens are minted outside the timed path, once per user
+        if uid not in self._tokens:
+            from utils import create_access_token
+            self._tokens[uid] = f"Bearer {create_access_token({'sub': str(uid)})}"
+        return {"Authorization": self._tokens[uid]}
+
+    def next_id(self) -> int:
+        self.counter += 1
+        return self.counter
+
+    def entry(self):
+        # Distinct seeded entries, so deletes never collide with each other or with updates
+        if self._entries is None:
+            from sqlalchemy.orm import Session
+            from models import HealthData
+            # Enough for the update and delete scenarios, drawn once
+            wanted = 2 * (self.args.requests + self.args.warmup)
+            with Session(bind=self.engine) as session:
+                max_id = session.query(HealthData.id).order_by(HealthData.id.desc()).limit(1).scalar() or 0
+                ids = self.rng.sample(range(1, max_id + 1), min(max_id, wanted))
+                self._entries = [tuple(row) for row in session.query(HealthData.id, HealthData.patient_id).filter(HealthData.id.in_(ids))]
+            self._entries.sort()
+            self.rng.shuffle(self._entries)
+        if not self._entries:
+            raise RuntimeError("Ran out of seeded entries; seed more readings")
+        return self._entries.pop()
+
+def reading(rng) -> dict:
+    return {"weight": round(rng.uniform(120, 260), 1), "bp": f"{rng.randint(100, 150)}/{rng.randint(60, 95)}", "glucose": round(rng.uniform(70, 160), 1)}
+
+async def run_scenario(client, ctx, name: str):
+    rng = ctx.rng
+    if name == "register":
+        n = ctx.next_id()
+        return await client.post("/auth/register", json={
+            "email": f"new-{ctx.run_id}-{n}@example.com", "password": SEED_PASSWORD, "firstName": "New", "lastName": str(n),
+        })
+    if name == "login":
+        return await client.post("/auth/login", json={"email": f"bench{ctx.user()}@example.com", "password": SEED_PASSWORD})
+    if name == "ingest":
+        return await client.post("/healthdata/", headers=ctx.headers(ctx.user()), json=reading(rng))
+    if name == "list":
+        return await client.get("/healthdata/", headers=ctx.headers(ctx.user()), params={"limit": 100})
+    if name == "stats":
+        return await client.get("/healthdata/stats", headers=ctx.headers(ctx.user()), params={"bucket": "week"})
+    if name == "update":
+        entry_id, uid = ctx.entry()
+        return await client.put(f"/healthdata/{entry_id}", headers=ctx.headers(uid), json=reading(rng))
+    if name == "delete":
+        entry_id, uid = ctx.entry()
+        return await client.delete(f"/healthdata/{entry_id}", headers=ctx.headers(uid))
+    if name == "ai":
+        return await client.post("/ai/", headers=ctx.headers(ctx.user()), json={})
+    raise ValueError(f"Unknown scenario {name}")
+
+async def measure(client, ctx, name: str, total: int, concurrency: int):
+    latencies, errors = [], 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await run_scenario(client, ctx, name)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, total)))))
+    return latencies, errors, time.perf_counter() - started
+
+async def run(args, scenarios) -> dict:
+    import httpx
+    import llm
+    from database import DATABASE_URL, create_db_engine
+    from fake_llm import FakeLLM
+    from main import app
+
+    llm._client = FakeLLM(delay=args.llm_delay)
+    # Per-request logging would be measured along with the app
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    engine = create_db_engine(DATABASE_URL)
+    ctx = Context(args, engine)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for name in scenarios:
+                    if args.warmup:
+                        await measure(client, ctx, name, args.warmup, args.concurrency)
+                    latencies, errors, elapsed = await measure(client, ctx, name, args.requests, args.concurrency)
+                    results[name] = summarize(latencies, errors, elapsed)
+                    print(f"{name:>8}: {json.dumps(results[name])}", file=sys.stderr)
+    finally:
+        engine.dispose()
+    return results
+
+def database_meta() -> dict:
+    # Sync and async runs of one commit must be told apart when reports are compared
+    from sqlalchemy.engine import make_url
+    from database import ASYNC_DATABASE_URL, DATABASE_URL, DB_ASYNC, profile_for
+
+    url = make_url(ASYNC_DATABASE_URL if DB_ASYNC else DATABASE_URL)
+    return {"db_async": DB_ASYNC, "db_backend": url.get_backend_name(), "db_driver": url.get_driver_name(), "db_profile": profile_for(str(url))}
+
+def describe_database(meta: dict) -> str:
+    if "db_async" not in meta:
+        return "db unknown"
+    return f"{meta['db_backend']}+{meta['db_driver']} ({'async' if meta['db_async'] else 'sync'}, {meta['db_profile']} profile)"
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(report: dict, baseline: dict) -> None:
+    print(f"baseline: {baseline['meta']['revision']}, {describe_database(baseline['meta'])}")
+    print(f"current:  {report['meta']['revision']}, {describe_database(report['meta'])}")
+    print(f"{'scenario':>8} {'p50':>10} {'p95':>10} {'p99':>10} {'rps':>10}   (change vs {baseline['meta']['revision']})")
+    for name, now in report["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        cells = [
+            f"{(now[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else "n/a"
+            for key in ("p50_ms", "p95_ms", "p99_ms", "rps")
+        ]
+        print(f"{name:>8} " + " ".join(f"{cell:>10}" for cell in cells))
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    cache = Path(args.cache_dir)
+    cache.mkdir(parents=True, exist_ok=True)
+    seeded = cache / f"seed-v{SEED_FORMAT}-{args.users}x{args.readings}-{args.seed}.db"
+    working = cache / "run.db"
+    # Configure the app before anything imports it
+    os.environ["DB_URL"] = f"sqlite:///{working}"
+    os.environ["LLM_BACKEND"] = "fake"
+    # Every simulated user shares one client IP, which the /auth limits would throttle
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ.pop("TESTING", None)
+
+    if not seeded.exists():
+        seed_database(seeded, args.users, args.readings, args.seed)
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{working}{suffix}").unlink(missing_ok=True)
+    shutil.copyfile(seeded, working)
+    # The app no longer migrates on startup; cached seeds may predate newer migrations
+    migrate_database(working)
+
+    results = asyncio.run(run(args, scenarios))
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "users": args.users,
+            "readings_per_user": args.readings,
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "llm_delay": args.llm_delay,
+            **database_meta(),
+        },
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()))
+
+if __name__ == "__main__":
+    main()
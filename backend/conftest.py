@@ -1,12 +1,22 @@
+import os
+import itertools
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool  # force the same connection to be reused
 
-from .models import Base, User
-from .database import get_db
+# Cheapest bcrypt cost so the auth tests don't spend seconds hashing
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Every test client shares one IP; test_ratelimit covers the limiter on its own app
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+from .models import Base, User, HealthData
 from .main import app
-from .healthdata import get_current_user  # import the function you're overriding
+# The app imports its modules top-level (``from database import get_db``), so the
+# overrides have to target those objects rather than the ``backend.``-prefixed copies.
+from contextlib import asynccontextmanager
+from database import get_db
+from security import get_current_user, get_read_user  # import the functions you're overriding
 
 TEST_DATABASE_URL = "sqlite:///:memory:"
 engine = create_engine(
@@ -39,12 +49,36 @@ def override_db(db_session):
             yield db_session
         finally:
             pass
+    @asynccontextmanager
+    async def _session_scope():
+        yield db_session
+
     app.dependency_overrides[get_db] = _override_get_db
+    app.state.session_scope = _session_scope
     yield
     #app.dependency_overrides.clear()
 
 
+_patient_ids = itertools.count(1000)
+
+@pytest.fixture
+def patient_id(db_session):
+    """Authenticates requests as a fresh patient and removes their readings afterwards."""
+    user_id = next(_patient_ids)
+
+    def _override(authorization: str = None, db=None) -> User:
+        return User(id=user_id, email=f"patient{user_id}@example.com", password="hashed")
+
+    previous = {dep: app.dependency_overrides.get(dep) for dep in (get_current_user, get_read_user)}
+    app.dependency_overrides.update({dep: _override for dep in previous})
+    yield user_id
+    app.dependency_overrides.update(previous)
+    db_session.query(HealthData).filter(HealthData.patient_id == user_id).delete()
+    db_session.commit()
+
+
 def override_get_current_user(authorization: str = None, db=None) -> User:
     return User(id=1, email="test@example.com", password="hashed", first_name="Test", last_name="User")
 
 app.dependency_overrides[get_current_user] = override_get_current_user
+app.dependency_overrides[get_read_user] = override_get_current_user
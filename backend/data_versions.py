@@ -0,0 +1,42 @@
+import hashlib
+from typing import Optional
+from sqlalchemy.orm import Session
+from models import UserDataVersion
+
+# Part of every ETag; bump when the JSON shape of a cached response changes
+ETAG_FORMAT = "1"
+
+def get_data_version(db: Session, patient_id: int) -> int:
+    # Primary-key lookup; users who never wrote anything are at version 0
+    version = db.query(UserDataVersion.version).filter(UserDataVersion.patient_id == patient_id).scalar()
+    return version or 0
+
+def bump_data_version(db: Session, patient_id: int) -> int:
+    """Increments the user's version inside the caller's transaction and returns it; the caller commits.
+
+    The upsert locks the user's row until commit, so concurrent writers get
+    increasing versions in the order they commit. Rows written in the same
+    transaction take the new version as their change_seq.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    table = UserDataVersion.__table__
+    stmt = insert(table).values(patient_id=patient_id, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=["patient_id"], set_={"version": table.c.version + 1})
+    return db.execute(stmt.returning(table.c.version)).scalar_one()
+
+def etag_for(patient_id: int, version: int, variant: str = "") -> str:
+    # Strong validator: one version renders the same bytes for the same variant (path and query)
+    digest = hashlib.sha1(f"{ETAG_FORMAT}|{variant}".encode()).hexdigest()[:12]
+    return f'"{patient_id}-{version}-{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so a W/ prefix still matches
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
@@ -1,20 +1,253 @@
+import asyncio
+import logging
 import os
-from sqlalchemy import create_engine
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
+# Configuration comes from the process environment; entry points (uvicorn
+# --env-file, `python migrations.py`) load .env themselves, never on import.
 DATABASE_URL = os.getenv("DB_URL", "sqlite:///./nexus_lite.db")
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-def get_db():
-    db = SessionLocal()
+# Optional read replica; GET routes read from it when set
+READ_DATABASE_URL = os.getenv("DB_READ_URL")
+# DB_ASYNC=true serves requests through an AsyncSession on an async driver;
+# false keeps the original sync engine (run on the threadpool) for comparison.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+# "auto" picks the profile from the URL's dialect; "default" leaves SQLAlchemy's defaults
+DB_PROFILE = os.getenv("DB_PROFILE", "auto")
+
+# SQLite profile
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Postgres profile
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle before typical server/proxy idle timeouts drop the connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    return ASYNC_DRIVERS.get(dialect, scheme) + sep + rest
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DB_URL", to_async_url(DATABASE_URL))
+ASYNC_READ_DATABASE_URL = os.getenv("ASYNC_DB_READ_URL", to_async_url(READ_DATABASE_URL) if READ_DATABASE_URL else None)
+
+def profile_for(url: str, profile: str = DB_PROFILE) -> str:
+    if profile != "auto":
+        return profile
+    backend = make_url(url).get_backend_name()
+    return "postgres" if backend in ("postgresql", "postgres") else backend
+
+def sqlite_pragmas() -> list:
+    return [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+    ]
+
+def engine_options(url: str, profile: str = DB_PROFILE) -> dict:
+    if profile_for(url, profile) == "postgres":
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True,
+        }
+    if make_url(url).drivername == "sqlite":
+        # Sessions are handed between threadpool threads
+        return {"connect_args": {"check_same_thread": False}}
+    return {}
+
+def apply_profile(engine: Engine, url: str, profile: str = DB_PROFILE) -> Engine:
+    if profile_for(url, profile) == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in sqlite_pragmas():
+                cursor.execute(pragma)
+            cursor.close()
+    return engine
+
+def create_db_engine(url: str, profile: str = DB_PROFILE) -> Engine:
+    return apply_profile(create_engine(url, **engine_options(url, profile)), url, profile)
+
+def create_async_db_engine(url: str, profile: str = DB_PROFILE):
+    async_engine = create_async_engine(url, **engine_options(url, profile))
+    # Pool events live on the sync facade of the async engine
+    apply_profile(async_engine.sync_engine, url, profile)
+    return async_engine
+
+# Engines and session factories are built on first use (normally by the app's
+# lifespan), so importing this module never touches the database.
+_engines = {}
+_sessionmakers = {}
+_lock = threading.Lock()
+
+def get_engine(read_only: bool = False) -> Engine:
+    url = READ_DATABASE_URL if read_only and READ_DATABASE_URL else DATABASE_URL
+    with _lock:
+        if url not in _engines:
+            _engines[url] = create_db_engine(url)
+        return _engines[url]
+
+def get_async_engine(read_only: bool = False):
+    url = ASYNC_READ_DATABASE_URL if read_only and ASYNC_READ_DATABASE_URL else ASYNC_DATABASE_URL
+    with _lock:
+        if url not in _engines:
+            _engines[url] = create_async_db_engine(url)
+        return _engines[url]
+
+def get_sessionmaker(read_only: bool = False):
+    key = (DB_ASYNC, read_only)
+    factory = _sessionmakers.get(key)
+    if factory is None:
+        if DB_ASYNC:
+            factory = async_sessionmaker(get_async_engine(read_only), autoflush=False, expire_on_commit=False)
+        else:
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=get_engine(read_only))
+        _sessionmakers.setdefault(key, factory)
+    return _sessionmakers[key]
+
+def init_database() -> None:
+    # Engine creation doesn't connect; the pools fill on the first queries
+    get_sessionmaker()
+    get_sessionmaker(read_only=True)
+
+async def dispose_database() -> None:
+    with _lock:
+        engines = list(_engines.values())
+        _engines.clear()
+        _sessionmakers.clear()
+    for engine in engines:
+        if isinstance(engine, Engine):
+            engine.dispose()
+        else:
+            await engine.dispose()
+
+@asynccontextmanager
+async def session_scope(read_only: bool = False):
+    factory = get_sessionmaker(read_only)
+    if DB_ASYNC:
+        async with factory() as session:
+            yield session
+        return
+    db = factory()
     try:
         yield db
     finally:
-        db.close()
+        await run_in_threadpool(db.close)
+
+async def get_db():
+    async with session_scope() as session:
+        yield session
+
+async def get_replica_db():
+    async with session_scope(read_only=True) as session:
+        yield session
+
+# Read-only GET routes depend on this. Without a replica it is get_db itself, so
+# overriding get_db (as the tests do) covers reads too. Replica reads may lag
+# the primary slightly; routes that read their own writes must use get_db.
+get_read_db = get_replica_db if READ_DATABASE_URL else get_db
+
+def get_session_scope(request: Request):
+    # For work that outlives the request (streamed responses): request-scoped
+    # sessions are closed before the response body is sent. Background work reads
+    # app.state.session_scope directly; create_app sets it and tests replace it.
+    return request.app.state.session_scope
+
+async def run_db(db, fn, *args, **kwargs):
+    """Runs ``fn(session, *args, **kwargs)`` without blocking the event loop.
+
+    With an AsyncSession the function runs through ``run_sync`` so its queries go
+    over the async driver; a plain Session is handed to the threadpool instead.
+    Either way route code is written once against the regular Session API.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+async def stream_partitions(db, statement, size: int) -> AsyncIterator[list]:
+    """Yields the statement's rows ``size`` at a time over a server-side cursor.
+
+    Only one partition is in memory at once. With a plain Session each fetch
+    runs on the threadpool, like run_db.
+    """
+    statement = statement.execution_options(yield_per=size)
+    if isinstance(db, AsyncSession):
+        result = await db.stream(statement)
+        try:
+            async for partition in result.partitions():
+                yield partition
+        finally:
+            await result.close()
+        return
+    result = await run_in_threadpool(db.execute, statement)
+    partitions = result.partitions()
+    try:
+        while True:
+            partition = await run_in_threadpool(next, partitions, None)
+            if partition is None:
+                return
+            yield partition
+    finally:
+        await run_in_threadpool(result.close)
+
+class PeriodicTask:
+    """Runs ``fn(session)`` in a background task every ``interval`` seconds while the app is up.
+
+    Each run gets its own session from app.state.session_scope. Failures are
+    logged and the next run goes ahead as planned.
+    """
+
+    def __init__(self, name: str, fn: Callable, interval: float, done_message: Optional[str] = None):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        # Logged with the run's result when it is truthy, e.g. "Removed %d rows"
+        self.done_message = done_message
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self, app: FastAPI):
+        async with app.state.session_scope() as db:
+            return await run_db(db, self.fn)
+
+    async def _run_periodically(self, app: FastAPI) -> None:
+        while True:
+            try:
+                result = await self.run_once(app)
+                if result and self.done_message:
+                    logger.info(self.done_message, result)
+            except Exception as e:
+                logger.error("%s failed: %s", self.name, e)
+            await asyncio.sleep(self.interval)
+
+    def start(self, app: FastAPI) -> None:
+        self._task = asyncio.create_task(self._run_periodically(app))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+DEFAULT_REPLY = (
+    "Your recent readings look stable overall. Keep monitoring your blood pressure and glucose, "
+    "and maintain regular activity and a balanced diet to support your current weight trend."
+)
+
+class FakeStream:
+    def __init__(self, pieces, delay: float):
+        self._pieces = list(pieces)
+        self._delay = delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._pieces or self.closed:
+            raise StopAsyncIteration
+        if self._delay:
+            await asyncio.sleep(self._delay)
+        piece = self._pieces.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    async def close(self):
+        self.closed = True
+
+class FakeCompletions:
+    def __init__(self, reply: str, delay: float, chunk_delay: float, failures: int = 0):
+        self.reply = reply
+        self.delay = delay
+        self.chunk_delay = chunk_delay
+        self.failures = failures
+        self.calls = 0
+        self.streams = []
+
+    async def create(self, *, messages, stream: bool = False, **kwargs):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures:
+            # Simulates transient upstream errors (rate limits, 5xx) for retry paths
+            self.failures -= 1
+            raise RuntimeError("Simulated LLM failure")
+        if stream:
+            words = self.reply.split(" ")
+            fake = FakeStream([w if i == 0 else " " + w for i, w in enumerate(words)], self.chunk_delay)
+            self.streams.append(fake)
+            return fake
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        completion_tokens = len(self.reply) // 4
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+        )
+
+class FakeLLM:
+    """Stand-in for AsyncOpenAI's chat.completions surface; no network access."""
+
+    def __init__(self, reply: str = DEFAULT_REPLY, delay: float = 0.0, chunk_delay: float = 0.0, failures: int = 0):
+        self.chat = SimpleNamespace(completions=FakeCompletions(reply, delay, chunk_delay, failures))
+
+    @property
+    def calls(self) -> int:
+        return self.chat.completions.calls
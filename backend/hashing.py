@@ -0,0 +1,86 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from metrics import record_password_hash, watch_password_hasher
+from utils import hash_password, verify_password
+
+# bcrypt is pure CPU; running it in worker processes keeps it from stalling the
+# event loop (and the GIL) for every other request on this worker.
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "process")  # "process" or "thread"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Jobs allowed to wait for a free worker before new ones are turned away with a 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+class HashingPoolFull(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_queue: int, executor: str = "process"):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.executor_kind = executor
+        self._executor: Optional[Executor] = None
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            else:
+                # spawn rather than fork: the parent already runs an event loop and threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+        return self._executor
+
+    async def run(self, fn, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            record_password_hash("rejected")
+            raise HashingPoolFull()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), fn, *args)
+        except Exception:
+            self.failed += 1
+            record_password_hash("failed")
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        record_password_hash("completed")
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self.pending, self.workers),
+            "queue_depth": max(0, self.pending - self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE, PASSWORD_HASH_EXECUTOR)
+watch_password_hasher(password_hasher)
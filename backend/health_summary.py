@@ -0,0 +1,153 @@
+import heapq
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from sqlalchemy.orm import Session
+from models import HealthData
+from retention import load_summary_entries
+
+# Raw readings quoted verbatim after the digest
+AI_RECENT_READINGS = int(os.getenv("AI_RECENT_READINGS", "10"))
+# Weekly means included per metric, newest first
+AI_SUMMARY_WEEKS = int(os.getenv("AI_SUMMARY_WEEKS", "8"))
+# Upper bound on prompt size, whatever the length of the history
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "1200"))
+# Rough token estimate for English/numeric text; avoids a tokenizer dependency
+CHARS_PER_TOKEN = 4
+
+METRICS = (
+    ("weight", "Weight", "lbs"),
+    ("glucose", "Glucose", "mg/dL"),
+    ("systolic", "Systolic BP", "mmHg"),
+    ("diastolic", "Diastolic BP", "mmHg"),
+)
+
+def load_readings(db: Session, patient_id: int) -> List[tuple]:
+    # Plain (timestamp, weight, systolic, diastolic, glucose) tuples, oldest first;
+    # no ORM objects for the whole history
+    rows = db.query(
+        HealthData.timestamp, HealthData.weight, HealthData.systolic, HealthData.diastolic, HealthData.glucose
+    ).filter(HealthData.patient_id == patient_id).order_by(HealthData.timestamp, HealthData.id).all()
+    # Days past the retention window count as one reading at that day's means
+    archived = [
+        (timestamp, weight, systolic, diastolic, glucose)
+        for _, weight, _, systolic, diastolic, glucose, timestamp in load_summary_entries(db, patient_id, newest_first=False)
+    ]
+    if not archived:
+        return rows
+    return list(heapq.merge(archived, [tuple(row) for row in rows], key=lambda reading: reading[0] or datetime.min))
+
+def column_values(readings: Sequence[tuple], index: int) -> np.ndarray:
+    return np.array([np.nan if r[index] is None else r[index] for r in readings], dtype=float)
+
+def to_arrays(readings: Sequence[tuple]) -> Dict[str, np.ndarray]:
+    timestamps = np.array([r[0] or datetime.utcnow() for r in readings], dtype="datetime64[s]")
+    return {
+        "timestamp": timestamps,
+        "weight": column_values(readings, 1),
+        "systolic": column_values(readings, 2),
+        "diastolic": column_values(readings, 3),
+        "glucose": column_values(readings, 4),
+    }
+
+def summarize_metric(days: np.ndarray, values: np.ndarray, weeks: int = AI_SUMMARY_WEEKS) -> Optional[dict]:
+    mask = ~np.isnan(values)
+    if not mask.any():
+        return None
+    days, values = days[mask], values[mask]
+    # Interquartile-range fences: robust to the very outliers being counted
+    q1, q3 = np.percentile(values, [25, 75])
+    spread = 1.5 * (q3 - q1)
+    outliers = int(np.count_nonzero((values < q1 - spread) | (values > q3 + spread)))
+    slope = float(np.polyfit(days, values, 1)[0] * 7) if np.ptp(days) > 0 else 0.0
+
+    week_index = ((days.max() - days) // 7).astype(int)
+    counts = np.bincount(week_index)
+    sums = np.bincount(week_index, weights=values)
+    weekly = [
+        (int(w), float(sums[w] / counts[w]))
+        for w in np.flatnonzero(counts)[:weeks]
+    ]
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "slope_per_week": slope,
+        "outliers": outliers,
+        "weekly_means": weekly,
+    }
+
+def summarize(readings: Sequence[tuple], weeks: int = AI_SUMMARY_WEEKS) -> dict:
+    """Per-metric aggregates over the whole history, computed column-wise with NumPy."""
+    arrays = to_arrays(readings)
+    timestamps = arrays["timestamp"]
+    days = (timestamps - timestamps.min()).astype("timedelta64[s]").astype(float) / 86400.0
+    return {
+        "count": len(readings),
+        "first": timestamps.min().astype(datetime),
+        "last": timestamps.max().astype(datetime),
+        "metrics": {name: summarize_metric(days, arrays[name], weeks) for name, _, _ in METRICS},
+    }
+
+def format_digest(summary: dict, weeks: int = AI_SUMMARY_WEEKS) -> str:
+    lines = [
+        f"Readings: {summary['count']} between {summary['first']:%Y-%m-%d} and {summary['last']:%Y-%m-%d}",
+    ]
+    for name, label, unit in METRICS:
+        stats = summary["metrics"][name]
+        if stats is None:
+            continue
+        weekly = ", ".join(
+            f"{'this week' if w == 0 else f'{w}w ago'} {mean:.1f}" for w, mean in stats["weekly_means"][:weeks]
+        ) or "n/a"
+        lines.append(
+            f"- {label} ({unit}): mean {stats['mean']:.1f}, min {stats['min']:.1f}, max {stats['max']:.1f}, "
+            f"trend {stats['slope_per_week']:+.2f}/week, outliers {stats['outliers']} of {stats['count']}; "
+            f"weekly means: {weekly}"
+        )
+    return "\n".join(lines)
+
+def format_reading(reading: tuple) -> str:
+    timestamp, weight, systolic, diastolic, glucose = reading
+    timestamp_str = timestamp.strftime("%Y-%m-%d %H:%M:%S") if timestamp else "N/A"
+    bp = f"{systolic}/{diastolic}" if systolic is not None else "N/A"
+    return f"{timestamp_str}: weight {weight} lbs, blood pressure {bp} mmHg, glucose {glucose} mg/dL"
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def build_prompt_body(
+    readings: Sequence[tuple],
+    recent: int = AI_RECENT_READINGS,
+    token_budget: int = AI_PROMPT_TOKEN_BUDGET,
+    reserved_tokens: int = 0,
+) -> str:
+    """Digest of the whole history plus the newest raw readings, within the token budget.
+
+    ``reserved_tokens`` is what the caller's fixed instructions already use.
+    Recent readings are dropped first, then weekly means, so the digest's
+    headline statistics always survive.
+    """
+    summary = summarize(readings)
+    budget = token_budget - reserved_tokens
+    weeks = AI_SUMMARY_WEEKS
+    digest = format_digest(summary, weeks)
+    while estimate_tokens(digest) > budget and weeks > 0:
+        weeks -= 1
+        digest = format_digest(summary, weeks)
+
+    body = "Summary of the full history:\n" + digest
+    heading = "\n\nMost recent readings:\n"
+    used = estimate_tokens(body + heading)
+    lines = []
+    for reading in reversed(readings[-recent:] if recent > 0 else []):
+        line = f"- {format_reading(reading)}"
+        used += estimate_tokens(line + "\n")
+        if used > budget:
+            break
+        lines.append(line)
+    if lines:
+        body += heading + "\n".join(reversed(lines))
+    return body
@@ -1,15 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import and_, or_, insert, select
 from sqlalchemy.orm import Session
-from typing import List
-from pydantic import BaseModel, validator
-from database import get_db
-from datetime import datetime
-from models import HealthData, User
-from utils import decode_access_token
+from typing import Any, List, Optional, Tuple
+from pydantic import BaseModel, ValidationError, validator
+from anomalies import entry_observation, load_anomalies, observe, retract
+from data_versions import bump_data_version, etag_for, etag_matches, get_data_version
+from database import get_db, get_read_db, get_session_scope, run_db, stream_partitions
+from datetime import datetime, timedelta
+from insights import invalidate_insights
+from models import HealthData
+from retention import load_summary_entries
+from rollups import entry_reading, load_stats, reading_values, record_changes
+from security import Principal, get_current_user, get_read_user
+from sketches import record_values
+from sync import CHANGES_GZIP_MIN_BYTES, decode_change_cursor, encode_change_cursor, load_changes, record_tombstone
+from utils import to_naive_utc
+import base64
+import csv
+import gzip
+import io
+import json
+import orjson
+import os
 import re
+import zlib
 
 router = APIRouter(prefix="/healthdata", tags=["healthdata"])
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_BATCH_SIZE = int(os.getenv("HEALTHDATA_MAX_BATCH_SIZE", "1000"))
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+# Rows per server-side cursor fetch; bounds export memory whatever the history size
+EXPORT_BATCH_SIZE = int(os.getenv("HEALTHDATA_EXPORT_BATCH_SIZE", "1000"))
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+DEFAULT_STATS_BUCKETS = 90
+MAX_STATS_BUCKETS = 1000
+
 class HealthDataRequest(BaseModel):
     weight: float
     bp: str
@@ -39,98 +68,454 @@ class HealthDataRequest(BaseModel):
             raise ValueError('Diastolic pressure must be between 40 and 150')
         return v
 
+    def bp_values(self) -> Tuple[int, int]:
+        # bp is already validated, so this split can't fail
+        systolic, diastolic = self.bp.split('/')
+        return int(systolic), int(diastolic)
+
+class HealthDataBatchItem(HealthDataRequest):
+    # Backfilled readings keep the time they were measured, not the upload time
+    timestamp: Optional[datetime] = None
+
+    @validator('timestamp')
+    def validate_timestamp(cls, v):
+        if v is None:
+            return v
+        v = to_naive_utc(v)
+        if v > datetime.utcnow() + timedelta(minutes=5):
+            raise ValueError('Timestamp cannot be in the future')
+        return v
+
 class HealthDataResponse(BaseModel):
     id: int
-    weight: float
-    bp: str
-    glucose: float
+    # Daily summaries (negative ids) leave out what none of the day's readings
+    # recorded, e.g. bp when every legacy value failed to parse
+    weight: Optional[float] = None
+    bp: Optional[str] = None
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
+    glucose: Optional[float] = None
     timestamp: datetime
 
     class Config:
         orm_mode = True
 
-def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)) -> User:
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Token missing")
-    
-    parts = authorization.split()
-    if len(parts) != 2 or parts[0].lower() != "bearer":
-        raise HTTPException(status_code=401, detail="Invalid authorization header")
-    
-    token = parts[1]
-    payload = decode_access_token(token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    user_id = payload.get("sub")
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    
-    return user
+class HealthDataUpdateResponse(HealthDataResponse):
+    # Flags raised by the corrected reading, as POST /healthdata/ reports them
+    anomalies: List[dict] = []
+
+# HealthDataResponse's fields, in order: list rows are built straight from these
+# columns so large pages skip ORM objects and per-row validation
+ENTRY_FIELDS = tuple(HealthDataResponse.model_fields)
+ENTRY_COLUMNS = tuple(getattr(HealthData, field) for field in ENTRY_FIELDS)
+
+TIMESTAMP_INDEX = ENTRY_FIELDS.index("timestamp")
+
+CHANGE_FIELDS = ENTRY_FIELDS + ("updated_at",)
+CHANGE_COLUMNS = ENTRY_COLUMNS + (HealthData.updated_at,)
+
+def entry_dicts(rows) -> List[dict]:
+    return [dict(zip(ENTRY_FIELDS, row)) for row in rows]
+
+def cache_headers(etag: str) -> dict:
+    # Clients may keep the body but must revalidate it on every use
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+async def check_not_modified(
+    request: Request, db: Session, patient_id: int, encoding: str = ""
+) -> Tuple[str, Optional[Response]]:
+    """Returns the current ETag, and a 304 response when the client already has it.
+
+    The version is read before the data, so a concurrent write can at worst pair
+    newer data with an older ETag, which only costs the client one extra fetch.
+    Routes that compress their body pass the ``encoding`` they may use, so each
+    encoding of a version gets its own strong tag.
+    """
+    version = await run_db(db, get_data_version, patient_id)
+    etag = etag_for(patient_id, version, f"{request.url.path}?{request.url.query}|{encoding}")
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return etag, Response(status_code=304, headers=cache_headers(etag))
+    return etag, None
+
+def encode_csv(rows, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(ENTRY_FIELDS)
+    writer.writerows(
+        [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows
+    )
+    return buffer.getvalue().encode()
+
+def encode_ndjson(rows) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(ENTRY_FIELDS, row))) + b"\n" for row in rows)
+
+def encode_cursor(timestamp: datetime, entry_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{entry_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, entry_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(entry_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @router.post("/", response_model=dict)
-def log_health_data(
+async def log_health_data(
     data: HealthDataRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
-    new_entry = HealthData(
-        patient_id=current_user.id,
-        weight=data.weight,
-        bp=data.bp,
-        glucose=data.glucose
-    )
-    db.add(new_entry)
+    systolic, diastolic = data.bp_values()
+
+    def _create(session: Session) -> Tuple[int, List[dict]]:
+        change_seq = bump_data_version(session, current_user.id)
+        new_entry = HealthData(
+            patient_id=current_user.id,
+            weight=data.weight,
+            bp=data.bp,
+            systolic=systolic,
+            diastolic=diastolic,
+            glucose=data.glucose,
+            timestamp=datetime.utcnow(),
+            change_seq=change_seq
+        )
+        session.add(new_entry)
+        session.flush()
+        record_changes(session, current_user.id, added=[entry_reading(new_entry)])
+        record_values(session, current_user.id, [entry_reading(new_entry)])
+        anomalies = observe(session, current_user.id, [entry_observation(new_entry)])
+        invalidate_insights(session, current_user.id)
+        session.commit()
+        return new_entry.id, anomalies
+
+    data_id, anomalies = await run_db(db, _create)
+    return {"message": "Health data recorded", "data_id": data_id, "anomalies": anomalies}
+
+def parse_batch_body(body: bytes, content_type: str) -> List[Any]:
+    if content_type.split(";")[0].strip().lower() in NDJSON_CONTENT_TYPES:
+        try:
+            text = body.decode("utf-8")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+        items = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                # Keep the slot so the per-item results still line up with the input
+                items.append(line)
+        return items
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+    return items
+
+def validate_batch_item(item: Any) -> Tuple[Optional[HealthDataBatchItem], Optional[List[dict]]]:
+    if not isinstance(item, dict):
+        return None, [{"field": "", "message": "Item must be a JSON object"}]
+    try:
+        return HealthDataBatchItem(**item), None
+    except ValidationError as e:
+        return None, [
+            {"field": ".".join(str(part) for part in err["loc"]), "message": err["msg"]}
+            for err in e.errors()
+        ]
+
+def insert_batch(db: Session, patient_id: int, readings: List[HealthDataBatchItem]) -> Tuple[List[int], List[dict]]:
+    if not readings:
+        return [], []
+    now = datetime.utcnow()
+    change_seq = bump_data_version(db, patient_id)
+    rows = []
+    for reading in readings:
+        systolic, diastolic = reading.bp_values()
+        rows.append({
+            "patient_id": patient_id,
+            "weight": reading.weight,
+            "bp": reading.bp,
+            "systolic": systolic,
+            "diastolic": diastolic,
+            "glucose": reading.glucose,
+            "timestamp": reading.timestamp or now,
+            "change_seq": change_seq,
+        })
+    # A single executemany INSERT ... RETURNING in one transaction
+    result = db.execute(insert(HealthData).returning(HealthData.id, sort_by_parameter_order=True), rows)
+    ids = list(result.scalars())
+    values = [reading_values(row["weight"], row["systolic"], row["diastolic"], row["glucose"]) for row in rows]
+    readings = [(row["timestamp"], reading) for row, reading in zip(rows, values)]
+    record_changes(db, patient_id, added=readings)
+    record_values(db, patient_id, readings)
+    anomalies = observe(db, patient_id, [
+        (data_id, row["timestamp"], reading) for data_id, row, reading in zip(ids, rows, values)
+    ])
+    invalidate_insights(db, patient_id)
     db.commit()
-    db.refresh(new_entry)
-    return {"message": "Health data recorded", "data_id": new_entry.id}
+    return ids, anomalies
 
-@router.get("/", response_model=List[HealthDataResponse])
-def get_health_data(
+@router.post("/batch", response_model=dict)
+async def log_health_data_batch(
+    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
+):
+    items = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds the maximum of {MAX_BATCH_SIZE} readings")
+
+    results = []
+    valid = []
+    for index, item in enumerate(items):
+        reading, errors = validate_batch_item(item)
+        if errors:
+            results.append({"index": index, "status": "error", "errors": errors})
+        else:
+            results.append({"index": index, "status": "created"})
+            valid.append((index, reading))
+
+    ids, anomalies = await run_db(db, insert_batch, current_user.id, [reading for _, reading in valid])
+    for (index, _), data_id in zip(valid, ids):
+        results[index]["data_id"] = data_id
+
+    return {
+        "message": "Health data batch processed",
+        "created": len(ids),
+        "failed": len(items) - len(ids),
+        "results": results,
+        "anomalies": anomalies,
+    }
+
+@router.get("/", response_model=List[HealthDataResponse])
+async def get_health_data(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_read_user)
 ):
-    entries = db.query(HealthData).filter(HealthData.patient_id == current_user.id).order_by(HealthData.timestamp.desc()).all()
-    return entries
+    after = decode_cursor(cursor) if cursor else None
+    since, until = to_naive_utc(since), to_naive_utc(until)
+    etag, not_modified = await check_not_modified(request, db, current_user.id)
+    if not_modified:
+        return not_modified
+
+    def _fetch(session: Session) -> list:
+        # Newest first, keyed on (timestamp, id) so every page is an index range scan
+        # on (patient_id, timestamp) no matter how deep into the history it is.
+        query = select(*ENTRY_COLUMNS).where(HealthData.patient_id == current_user.id)
+        if since:
+            query = query.where(HealthData.timestamp >= since)
+        if until:
+            query = query.where(HealthData.timestamp < until)
+        if after:
+            last_timestamp, last_id = after
+            query = query.where(or_(
+                HealthData.timestamp < last_timestamp,
+                and_(HealthData.timestamp == last_timestamp, HealthData.id < last_id)
+            ))
+        query = query.order_by(HealthData.timestamp.desc(), HealthData.id.desc()).limit(limit + 1)
+        rows = [tuple(row) for row in session.execute(query)]
+        # Days past the retention window continue the listing as one summary entry per day
+        archived = load_summary_entries(session, current_user.id, since, until, after, limit + 1)
+        if not archived:
+            return rows
+        return sorted(rows + archived, key=lambda row: (row[TIMESTAMP_INDEX], row[0]), reverse=True)[:limit + 1]
+
+    rows = await run_db(db, _fetch)
+
+    headers = cache_headers(etag)
+    # One extra row tells us whether another page exists without a COUNT(*)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(last[TIMESTAMP_INDEX], last[0])
+    # Returning the response directly skips response_model validation; live rows
+    # and retention.summary_entry tuples both fit HealthDataResponse field for field
+    return ORJSONResponse(entry_dicts(rows), headers=headers)
+
+@router.get("/stats", response_model=List[dict])
+async def get_health_stats(
+    request: Request,
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_STATS_BUCKETS, ge=1, le=MAX_STATS_BUCKETS),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_read_user)
+):
+    etag, not_modified = await check_not_modified(request, db, current_user.id)
+    if not_modified:
+        return not_modified
+    # Served from the rollup table: cost grows with the number of buckets, not readings
+    stats = await run_db(db, load_stats, current_user.id, bucket, to_naive_utc(since), to_naive_utc(until), limit)
+    return ORJSONResponse(stats, headers=cache_headers(etag))
+
+@router.get("/anomalies", response_model=dict)
+async def get_health_anomalies(
+    request: Request,
+    since: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_read_user)
+):
+    """Readings flagged when they were written, newest first, plus the running baselines they were judged by."""
+    etag, not_modified = await check_not_modified(request, db, current_user.id)
+    if not_modified:
+        return not_modified
+    anomalies = await run_db(db, load_anomalies, current_user.id, to_naive_utc(since), limit)
+    return ORJSONResponse(anomalies, headers=cache_headers(etag))
+
+@router.get("/changes", response_model=dict)
+async def get_health_data_changes(
+    request: Request,
+    since: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_read_user)
+):
+    """Entries written and ids deleted after the ``since`` cursor, plus the next cursor.
+
+    ``since=0`` returns every live entry. Large change sets are paged like the
+    listing: follow X-Next-Cursor, keeping ``since``, until it's absent; only the
+    last page's ``cursor`` is the one to sync from next. A 410 means the cursor
+    predates compacted deletions and the client must start over from 0.
+    """
+    after = decode_change_cursor(cursor) if cursor else None
+    accepts_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag, not_modified = await check_not_modified(request, db, current_user.id, "gzip" if accepts_gzip else "")
+    if not_modified:
+        return not_modified
+    changes, next_position = await run_db(
+        db, load_changes, current_user.id, since, CHANGE_COLUMNS, CHANGE_FIELDS, limit, after
+    )
+
+    headers = cache_headers(etag)
+    headers["Vary"] = "Accept-Encoding"
+    if next_position:
+        headers[NEXT_CURSOR_HEADER] = encode_change_cursor(next_position)
+    body = orjson.dumps(changes)
+    if len(body) >= CHANGES_GZIP_MIN_BYTES and accepts_gzip:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
+
+@router.get("/export")
+async def export_health_data(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = Query(False, alias="gzip"),
+    session_scope=Depends(get_session_scope),
+    current_user: Principal = Depends(get_read_user)
+):
+    """Streams the caller's history, oldest first, one cursor batch at a time.
+
+    Daily summaries of readings past the retention window come first, with negative ids.
+    """
+    patient_id = current_user.id
+    since, until = to_naive_utc(since), to_naive_utc(until)
+    query = select(*ENTRY_COLUMNS).where(HealthData.patient_id == patient_id)
+    if since:
+        query = query.where(HealthData.timestamp >= since)
+    if until:
+        query = query.where(HealthData.timestamp < until)
+    query = query.order_by(HealthData.timestamp, HealthData.id)
+
+    async def body():
+        # wbits=31 writes a gzip container, so the download is a plain .gz file
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+        def encode(chunk: bytes) -> bytes:
+            return compressor.compress(chunk) if compressor else chunk
+
+        if format == "csv":
+            yield encode(encode_csv([], header=True))
+        # The request's own session is closed before streaming starts
+        async with session_scope() as db:
+            archived = await run_db(db, load_summary_entries, patient_id, since, until, None, None, False)
+            if archived:
+                yield encode(encode_csv(archived) if format == "csv" else encode_ndjson(archived))
+            async for rows in stream_partitions(db, query, EXPORT_BATCH_SIZE):
+                yield encode(encode_csv(rows) if format == "csv" else encode_ndjson(rows))
+        if compressor:
+            yield compressor.flush()
+
+    filename = f"health-data-{patient_id}.{format}" + (".gz" if compress else "")
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip" if compress else EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 @router.delete("/{entry_id}", response_model=dict)
-def delete_health_entry(
+async def delete_health_entry(
     entry_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
-    print("🗑️ DELETE: current_user.id =", current_user.id)  # 👈 Add this line
-
-    entry = db.query(HealthData).filter(
-        HealthData.id == entry_id,
-        HealthData.patient_id == current_user.id
-    ).first()
-    if not entry:
-        raise HTTPException(status_code=404, detail="Entry not found")
-    db.delete(entry)
-    db.commit()
+    def _delete(session: Session) -> None:
+        # Bumping first takes the per-user write lock before anything is read
+        change_seq = bump_data_version(session, current_user.id)
+        entry = session.query(HealthData).filter(
+            HealthData.id == entry_id,
+            HealthData.patient_id == current_user.id
+        ).first()
+        if not entry:
+            raise HTTPException(status_code=404, detail="Entry not found")
+        removed = entry_reading(entry)
+        invalidate_insights(session, current_user.id)
+        retract(session, current_user.id, entry_observation(entry))
+        session.delete(entry)
+        record_tombstone(session, current_user.id, entry.id, change_seq)
+        record_changes(session, current_user.id, removed=[removed])
+        session.commit()
+
+    await run_db(db, _delete)
     return {"message": "Entry deleted successfully"}
 
-@router.put("/{entry_id}", response_model=HealthDataResponse)
-def update_health_entry(
+@router.put("/{entry_id}", response_model=HealthDataUpdateResponse)
+async def update_health_entry(
     entry_id: int,
     data: HealthDataRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
-    print("⚠️ UPDATE: current_user.id =", current_user.id)  # 👈 Add this line
-
-    entry = db.query(HealthData).filter(
-        HealthData.id == entry_id,
-        HealthData.patient_id == current_user.id
-    ).first()
-    if not entry:
-        raise HTTPException(status_code=404, detail="Entry not found")
-    
-    entry.weight = data.weight
-    entry.bp = data.bp
-    entry.glucose = data.glucose
-    db.commit()
-    db.refresh(entry)
-    return entry
\ No newline at end of file
+    def _update(session: Session) -> dict:
+        # Bumping first takes the per-user write lock before anything is read
+        change_seq = bump_data_version(session, current_user.id)
+        entry = session.query(HealthData).filter(
+            HealthData.id == entry_id,
+            HealthData.patient_id == current_user.id
+        ).first()
+        if not entry:
+            raise HTTPException(status_code=404, detail="Entry not found")
+
+        removed = entry_reading(entry)
+        stats = retract(session, current_user.id, entry_observation(entry))
+        entry.weight = data.weight
+        entry.bp = data.bp
+        entry.systolic, entry.diastolic = data.bp_values()
+        entry.glucose = data.glucose
+        entry.change_seq = change_seq
+        record_changes(session, current_user.id, removed=[removed], added=[entry_reading(entry)])
+        # The old value stays in the sketches until the next rebuild
+        record_values(session, current_user.id, [entry_reading(entry)])
+        anomalies = observe(session, current_user.id, [entry_observation(entry)], stats=stats)
+        invalidate_insights(session, current_user.id)
+        # Every response field was set above, so there's no need to reload the row after commit
+        result = {field: getattr(entry, field) for field in ENTRY_FIELDS}
+        session.commit()
+        return {**result, "anomalies": anomalies}
+
+    return await run_db(db, _update)
\ No newline at end of file
@@ -0,0 +1,68 @@
+import hashlib
+from typing import List, Optional, Tuple
+from sqlalchemy import exists, func
+from sqlalchemy.orm import Session
+from data_versions import get_data_version
+from models import AIInsight, HealthData, HealthDataDailySummary
+
+# Bump whenever the prompt or model in ai.py changes so stored insights are regenerated
+PROMPT_VERSION = "2"
+
+def data_fingerprint(db: Session, patient_id: int) -> Tuple[Optional[str], Optional[int]]:
+    # Every write path bumps the data version, so any insert, edit or delete
+    # (blood-pressure-only edits included) gives a new fingerprint. The count and
+    # newest id also cover rows inserted without going through the API.
+    count, max_id = db.query(func.count(HealthData.id), func.max(HealthData.id)).filter(
+        HealthData.patient_id == patient_id
+    ).one()
+    if not count and not db.query(
+        exists().where(HealthDataDailySummary.patient_id == patient_id)
+    ).scalar():
+        return None, None
+    # Retention bumps the version too; a user it left with only daily summaries has no newest id
+    raw = f"{PROMPT_VERSION}|{get_data_version(db, patient_id)}|{count}|{max_id}"
+    return hashlib.sha256(raw.encode()).hexdigest(), max_id
+
+def lookup_insight(db: Session, patient_id: int) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+    """Returns (fingerprint, newest entry id, stored insight or None)."""
+    fingerprint, latest_id = data_fingerprint(db, patient_id)
+    if fingerprint is None:
+        return None, None, None
+    stored = db.query(AIInsight.insight).filter(
+        AIInsight.patient_id == patient_id,
+        AIInsight.fingerprint == fingerprint,
+        AIInsight.prompt_version == PROMPT_VERSION,
+    ).first()
+    return fingerprint, latest_id, stored.insight if stored else None
+
+def store_insight(db: Session, patient_id: int, fingerprint: str, health_data_id: Optional[int], insight: str) -> None:
+    invalidate_insights(db, patient_id)
+    if health_data_id is None:
+        # Stored insights hang off a live reading; with only daily summaries left there is none
+        db.commit()
+        return
+    db.add(AIInsight(
+        patient_id=patient_id,
+        health_data_id=health_data_id,
+        fingerprint=fingerprint,
+        prompt_version=PROMPT_VERSION,
+        insight=insight,
+    ))
+    db.commit()
+
+def invalidate_insights(db: Session, patient_id: int) -> None:
+    # Runs inside the caller's transaction; the caller commits
+    db.query(AIInsight).filter(AIInsight.patient_id == patient_id).delete(synchronize_session=False)
+
+def pending_patients(db: Session, after: int, limit: int) -> List[int]:
+    """Users with readings but no insight for the current prompt, in id order after ``after``.
+
+    Every write deletes the user's insights, so this is exactly the set with new
+    data since their last insight. Users left with only daily summaries are
+    skipped: their insight can't be stored, so POST /ai/ generates it on demand.
+    """
+    current = exists().where(AIInsight.patient_id == HealthData.patient_id, AIInsight.prompt_version == PROMPT_VERSION)
+    rows = db.query(HealthData.patient_id).filter(HealthData.patient_id > after, ~current).distinct().order_by(
+        HealthData.patient_id
+    ).limit(limit)
+    return [patient_id for (patient_id,) in rows]
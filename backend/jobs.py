@@ -0,0 +1,174 @@
+import asyncio
+import importlib
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Jobs processed concurrently per app process
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", "4"))
+# How long finished jobs stay available to GET /ai/jobs/{id}
+AI_JOB_TTL_SECONDS = float(os.getenv("AI_JOB_TTL_SECONDS", "3600"))
+# "memory", or "package.module:ClassName" for a shared backend in multi-worker deployments
+AI_JOB_BACKEND = os.getenv("AI_JOB_BACKEND", "memory")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+Handler = Callable[[dict], Awaitable[Any]]
+
+@dataclass
+class Job:
+    id: str
+    key: str
+    owner: Any
+    payload: dict
+    status: str = QUEUED
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    def to_dict(self) -> dict:
+        data = {"job_id": self.id, "status": self.status}
+        if self.status == SUCCEEDED:
+            data["result"] = self.result
+        if self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+class JobQueue(ABC):
+    """Interface for job backends.
+
+    ``submit`` must coalesce onto the unfinished job with the same key, if any,
+    and return that job instead of queueing a duplicate. Payloads are plain
+    JSON-compatible dicts so shared backends can serialize them.
+    """
+
+    @abstractmethod
+    async def start(self, handler: Handler) -> None:
+        ...
+
+    @abstractmethod
+    async def stop(self) -> None:
+        ...
+
+    @abstractmethod
+    async def submit(self, key: str, owner: Any, payload: dict) -> Job:
+        ...
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        ...
+
+class InMemoryJobQueue(JobQueue):
+    def __init__(self, workers: int = AI_JOB_WORKERS, ttl: float = AI_JOB_TTL_SECONDS):
+        self.workers = max(1, workers)
+        self.ttl = ttl
+        self.jobs: Dict[str, Job] = {}
+        self.inflight: Dict[str, str] = {}
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler) -> None:
+        self._handler = handler
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        # Jobs accepted before a restart of the loop (e.g. app reload) are re-queued
+        for job in self.jobs.values():
+            if not job.done:
+                job.status = QUEUED
+                self._queue.put_nowait(job.id)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def submit(self, key: str, owner: Any, payload: dict) -> Job:
+        self._prune()
+        existing = self.inflight.get(key)
+        if existing is not None:
+            return self.jobs[existing]
+        if self._queue is None:
+            raise RuntimeError("Job queue is not running")
+        job = self._add(Job(id=uuid.uuid4().hex, key=key, owner=owner, payload=payload))
+        self.inflight[key] = job.id
+        self._queue.put_nowait(job.id)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        self._prune()
+        return self.jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is None or job.done or timeout <= 0:
+            return job
+        try:
+            await asyncio.wait_for(self._finished[job_id].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    def _add(self, job: Job) -> Job:
+        self.jobs[job.id] = job
+        self._finished[job.id] = asyncio.Event()
+        return job
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        job.status, job.result, job.error = status, result, error
+        job.finished_at = time.time()
+        if self.inflight.get(job.key) == job.id:
+            del self.inflight[job.key]
+        self._finished[job.id].set()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self.jobs.items() if job.done and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+            del self._finished[job_id]
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job.done:
+                continue
+            job.status = RUNNING
+            try:
+                result = await self._handler(job.payload)
+            except asyncio.CancelledError:
+                job.status = QUEUED
+                raise
+            except Exception as e:
+                logger.error("Job %s failed: %s", job.id, e)
+                self._finish(job, FAILED, error=str(e))
+            else:
+                self._finish(job, SUCCEEDED, result=result)
+
+def create_job_queue(backend: str = AI_JOB_BACKEND) -> JobQueue:
+    if backend == "memory":
+        return InMemoryJobQueue()
+    module_name, _, class_name = backend.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, List, Optional
+from metrics import record_llm_call
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")  # Use "gpt-3.5-turbo" if GPT-4 is unavailable
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "250"))
+OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.7"))
+# Hard cap on a whole streamed completion, first token to last
+AI_STREAM_TIMEOUT_SECONDS = float(os.getenv("AI_STREAM_TIMEOUT_SECONDS", "30"))
+# End-to-end budget for a blocking completion, hedge included; callers fall back past it
+AI_LATENCY_BUDGET_SECONDS = float(os.getenv("AI_LATENCY_BUDGET_SECONDS", "8"))
+# Send a second, identical request once the first has run longer than this
+# percentile of recent completions; 0 disables hedging
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "0"))
+# Recent completion times kept for the percentile, and how many are needed before hedging
+AI_HEDGE_WINDOW = int(os.getenv("AI_HEDGE_WINDOW", "200"))
+AI_HEDGE_MIN_SAMPLES = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))
+# "openai" or "fake" (local canned responses, for offline development and benchmarks)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+
+SYSTEM_MESSAGE = "You are a helpful medical assistant who provides personalized health advice in a structured format."
+
+_client = None
+_recent_latencies: Deque[float] = deque(maxlen=AI_HEDGE_WINDOW)
+
+def get_llm_client():
+    global _client
+    if _client is None:
+        if LLM_BACKEND == "fake":
+            from fake_llm import FakeLLM
+            _client = FakeLLM()
+        else:
+            # Imported here: the SDK alone adds about half a second to cold starts
+            from openai import AsyncOpenAI
+            _client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+async def close_llm_client() -> None:
+    global _client
+    client, _client = _client, None
+    close = getattr(client, "close", None)
+    if close is not None:
+        await close()
+
+def chat_messages(prompt: str) -> List[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt},
+    ]
+
+async def complete(prompt: str) -> str:
+    start = time.perf_counter()
+    try:
+        response = await get_llm_client().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=chat_messages(prompt),
+            max_tokens=OPENAI_MAX_TOKENS,
+            temperature=OPENAI_TEMPERATURE,
+        )
+    except asyncio.CancelledError:
+        # Lost a hedge race or ran past the caller's budget
+        record_llm_call("complete", "cancelled", time.perf_counter() - start)
+        raise
+    except Exception:
+        record_llm_call("complete", "error", time.perf_counter() - start)
+        raise
+    elapsed = time.perf_counter() - start
+    _recent_latencies.append(elapsed)
+    record_llm_call("complete", "ok", elapsed, getattr(response, "usage", None))
+    return response.choices[0].message.content.strip()
+
+def hedge_delay() -> Optional[float]:
+    if AI_HEDGE_PERCENTILE <= 0 or len(_recent_latencies) < AI_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(_recent_latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * AI_HEDGE_PERCENTILE / 100))]
+
+async def _hedged_complete(prompt: str) -> str:
+    delay = hedge_delay()
+    tasks = {asyncio.ensure_future(complete(prompt))}
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks.add(asyncio.ensure_future(complete(prompt)))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def complete_within(prompt: str, budget: Optional[float] = None) -> str:
+    """Like ``complete``, but raises asyncio.TimeoutError once ``budget`` seconds have passed.
+
+    With hedging enabled, a slow first request is raced against a second one
+    and whichever answers first wins; the loser is cancelled.
+    """
+    budget = AI_LATENCY_BUDGET_SECONDS if budget is None else budget
+    return await asyncio.wait_for(_hedged_complete(prompt), max(budget, 0))
+
+async def stream_completion(prompt: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """Yields content deltas as they arrive; raises asyncio.TimeoutError past the deadline."""
+    start = time.perf_counter()
+    deadline = time.monotonic() + (AI_STREAM_TIMEOUT_SECONDS if timeout is None else timeout)
+    try:
+        stream = await asyncio.wait_for(
+            get_llm_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=chat_messages(prompt),
+                max_tokens=OPENAI_MAX_TOKENS,
+                temperature=OPENAI_TEMPERATURE,
+                stream=True,
+                # Token usage arrives on a final chunk with no choices
+                stream_options={"include_usage": True},
+            ),
+            max(deadline - time.monotonic(), 0),
+        )
+    except asyncio.TimeoutError:
+        record_llm_call("stream", "timeout", time.perf_counter() - start)
+        raise
+    except Exception:
+        record_llm_call("stream", "error", time.perf_counter() - start)
+        raise
+    chunks = stream.__aiter__()
+    outcome, usage = "error", None
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - time.monotonic(), 0))
+            except StopAsyncIteration:
+                outcome = "ok"
+                return
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    finally:
+        record_llm_call("stream", outcome, time.perf_counter() - start, usage)
+        # Runs on completion, timeout and client disconnect (task cancellation) alike,
+        # so the upstream HTTP stream is never left open
+        close = getattr(stream, "close", None)
+        if close is not None:
+            await close()
@@ -1,37 +1,85 @@
 import uvicorn
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from database import engine
-from models import Base
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from database import dispose_database, get_engine, init_database, session_scope
+from migrations import migrate
+from analytics import router as analytics_router
 from auth import router as auth_router
-from healthdata import router as healthdata_router
+from hashing import password_hasher
+from metrics import METRICS_ENABLED, MetricsMiddleware, metrics_endpoint
+from healthdata import router as healthdata_router, NEXT_CURSOR_HEADER
+from ratelimit import RATE_LIMIT_ENABLED, RATE_LIMIT_HEADERS, RateLimitMiddleware
+from retention import RETENTION_RAW_DAYS, retention_passes
+from sync import tombstone_compaction
 # if os.getenv("TESTING") != "true":
 # from ai import router as ai_router
 from fastapi.middleware.cors import CORSMiddleware
 
+# Schema changes normally run once per deploy via `python migrations.py`; this
+# is a convenience for single-process development setups.
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "false").lower() == "true"
+
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Nexus-Lite API", version="1.0.0")
-    
+    ai_enabled = os.getenv("TESTING") != "true"
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if DB_MIGRATE_ON_STARTUP:
+            await run_in_threadpool(migrate, get_engine())
+        init_database()
+        tombstone_compaction.start(app)
+        if RETENTION_RAW_DAYS > 0:
+            retention_passes.start(app)
+        if ai_enabled:
+            from ai import start_insight_jobs
+            await start_insight_jobs(app)
+        try:
+            yield
+        finally:
+            if ai_enabled:
+                import llm
+                from ai import stop_insight_jobs
+                await stop_insight_jobs()
+                await llm.close_llm_client()
+            await retention_passes.stop()
+            await tombstone_compaction.stop()
+            password_hasher.shutdown()
+            await dispose_database()
+
+    app = FastAPI(title="Nexus-Lite API", version="1.0.0", default_response_class=ORJSONResponse, lifespan=lifespan)
+    # Sessions for work outside a request's own session (streamed bodies, jobs, periodic tasks)
+    app.state.session_scope = session_scope
+
+    # Added before CORS so that 429s and 503s still carry the CORS headers
+    if RATE_LIMIT_ENABLED:
+        app.add_middleware(RateLimitMiddleware)
+
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],  # or specify allowed origins
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "Retry-After", "ETag", *RATE_LIMIT_HEADERS],
     )
     
-    # Create the database tables
-    Base.metadata.create_all(bind=engine)
-    
+    if METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+        app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
     @app.get("/connection")
-    def find_connection():
+    async def find_connection():
         return {"message": "Database connected successfully!"}
     
     # Register routers
     app.include_router(auth_router)
     app.include_router(healthdata_router)
-    if os.getenv("TESTING") != "true":
+    app.include_router(analytics_router)
+    if ai_enabled:
         from ai import router as ai_router
         app.include_router(ai_router)
     
@@ -40,4 +88,4 @@ def create_app() -> FastAPI:
 app = create_app()
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, env_file=".env" if os.path.exists(".env") else None)
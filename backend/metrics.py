@@ -0,0 +1,158 @@
+import logging
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Requests running more queries than this are logged as likely N+1 patterns. Reads run 2-4
+# queries and writes 11-19 (an edit that forces rollup rebuilds); a per-row loop goes far past it.
+SQL_QUERY_WARN_THRESHOLD = int(os.getenv("SQL_QUERY_WARN_THRESHOLD", "30"))
+
+registry = CollectorRegistry()
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"], registry=registry
+)
+http_latency = Histogram(
+    "http_request_duration_seconds", "Time to the end of the response body", ["method", "route"], registry=registry
+)
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served", registry=registry)
+
+db_queries = Counter("db_queries_total", "SQL statements executed", registry=registry)
+db_query_latency = Histogram(
+    "db_query_duration_seconds", "Time per SQL statement", registry=registry,
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+db_request_queries = Histogram(
+    "db_queries_per_request", "SQL statements per HTTP request", ["route"], registry=registry,
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+db_request_time = Histogram(
+    "db_query_seconds_per_request", "Total SQL time per HTTP request", ["route"], registry=registry
+)
+db_n_plus_one = Counter(
+    "db_query_threshold_exceeded_total", "Requests over SQL_QUERY_WARN_THRESHOLD queries", ["route"], registry=registry
+)
+
+llm_latency = Histogram(
+    "llm_request_duration_seconds", "LLM call time", ["operation", "outcome"], registry=registry,
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+llm_tokens = Counter("llm_tokens_total", "LLM token usage", ["kind"], registry=registry)
+ai_fallbacks = Counter(
+    "ai_insight_fallbacks_total", "Insights answered by the local rules instead of the LLM", ["reason"], registry=registry
+)
+rate_limit_rejections = Counter(
+    "rate_limit_rejections_total", "Requests turned away by rate limits (429) or admission control (503)",
+    ["group", "reason"], registry=registry,
+)
+password_hash_jobs = Counter(
+    "password_hash_jobs_total", "Password hashing jobs by outcome", ["outcome"], registry=registry
+)
+password_hash_workers = Gauge("password_hash_workers", "Workers in the password hashing pool", registry=registry)
+password_hash_in_flight = Gauge("password_hash_in_flight", "Password hashing jobs running on a worker", registry=registry)
+password_hash_queue_depth = Gauge(
+    "password_hash_queue_depth", "Password hashing jobs waiting for a free worker", registry=registry
+)
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+
+# Set per request by the middleware; the threadpool and run_sync both carry it along
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    db_queries.inc()
+    db_query_latency.observe(elapsed)
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+
+@event.listens_for(Engine, "handle_error")
+def _query_failed(context):
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+def route_label(scope) -> str:
+    # The route template, never the raw path, to keep label cardinality bounded
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+class MetricsMiddleware:
+    """Plain ASGI middleware: unlike BaseHTTPMiddleware it doesn't buffer streamed responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        stats = QueryStats()
+        token = _query_stats.set(stats)
+        start = time.perf_counter()
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            http_in_flight.dec()
+            _query_stats.reset(token)
+            method, route = scope["method"], route_label(scope)
+            http_latency.labels(method, route).observe(time.perf_counter() - start)
+            http_requests.labels(method, route, str(status)).inc()
+            db_request_queries.labels(route).observe(stats.count)
+            db_request_time.labels(route).observe(stats.seconds)
+            if stats.count > SQL_QUERY_WARN_THRESHOLD:
+                db_n_plus_one.labels(route).inc()
+                logger.warning("%s %s ran %d SQL queries (threshold %d)", method, route, stats.count, SQL_QUERY_WARN_THRESHOLD)
+
+def record_llm_call(operation: str, outcome: str, seconds: float, usage=None) -> None:
+    llm_latency.labels(operation, outcome).observe(seconds)
+    if usage is not None:
+        llm_tokens.labels("prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+        llm_tokens.labels("completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+def record_ai_fallback(reason: str) -> None:
+    ai_fallbacks.labels(reason).inc()
+
+def record_rate_limited(group: str, reason: str) -> None:
+    rate_limit_rejections.labels(group, reason).inc()
+
+def record_password_hash(outcome: str) -> None:
+    password_hash_jobs.labels(outcome).inc()
+
+def watch_password_hasher(hasher) -> None:
+    # Read at scrape time, so the gauges never drift from the pool's own counts
+    password_hash_workers.set_function(lambda: hasher.workers)
+    password_hash_in_flight.set_function(lambda: hasher.stats()["in_flight"])
+    password_hash_queue_depth.set_function(lambda: hasher.stats()["queue_depth"])
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime
+import re
+from typing import Optional, Tuple
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from models import Base, HealthData
+import anomalies
+import rollups
+import sketches
+
+logger = logging.getLogger(__name__)
+
+# Bookkeeping for one-off data migrations; kept off Base so it isn't part of the app schema
+migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("name", String, primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+def add_missing_columns(engine: Engine) -> None:
+    # create_all only creates missing tables, so columns added to an existing
+    # model have to be ALTERed in. Only nullable/defaulted columns are added here.
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                logger.info("Adding column %s.%s", table.name, column.name)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def create_missing_indexes(engine: Engine) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+BACKFILL_BATCH_SIZE = 1000
+BP_PATTERN = re.compile(r"^\s*(\d{2,3})\s*/\s*(\d{2,3})\s*$")
+
+def parse_bp(bp: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    match = BP_PATTERN.match(bp or "")
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
+def backfill_blood_pressure(db: Session) -> None:
+    """Fills systolic/diastolic from the legacy bp string, in id-ordered batches."""
+    last_id = 0
+    patient_ids = set()
+    while True:
+        rows = db.query(HealthData.id, HealthData.patient_id, HealthData.bp).filter(
+            HealthData.id > last_id, HealthData.systolic.is_(None), HealthData.bp.isnot(None)
+        ).order_by(HealthData.id).limit(BACKFILL_BATCH_SIZE).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        values = []
+        for row in rows:
+            systolic, diastolic = parse_bp(row.bp)
+            if systolic is not None:
+                values.append({"id": row.id, "systolic": systolic, "diastolic": diastolic})
+                patient_ids.add(row.patient_id)
+        if values:
+            db.execute(update(HealthData), values)
+        db.commit()
+    # Rollups built before the backfill saw no blood pressure for these rows
+    for patient_id in patient_ids:
+        rollups.rebuild_patient(db, patient_id)
+    db.commit()
+
+def backfill_change_tracking(db: Session) -> None:
+    # Rows from before delta sync only appear in full (since=0) syncs
+    db.query(HealthData).filter(HealthData.change_seq.is_(None)).update(
+        {HealthData.change_seq: 0}, synchronize_session=False
+    )
+    db.query(HealthData).filter(HealthData.updated_at.is_(None)).update(
+        {HealthData.updated_at: HealthData.timestamp}, synchronize_session=False
+    )
+    db.commit()
+
+# Ordered (name, fn(session)) data migrations; each runs once per database
+DATA_MIGRATIONS = [
+    ("0001_backfill_rollups", rollups.rebuild_all),
+    ("0002_backfill_blood_pressure", backfill_blood_pressure),
+    ("0003_backfill_change_tracking", backfill_change_tracking),
+    ("0004_backfill_metric_stats", anomalies.rebuild_all_stats),
+    ("0005_backfill_metric_sketches", sketches.rebuild_sketches),
+]
+
+def run_data_migrations(engine: Engine) -> None:
+    migration_metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(schema_migrations.c.name)).scalars())
+    for name, fn in DATA_MIGRATIONS:
+        if name in applied:
+            continue
+        logger.info("Running data migration %s", name)
+        with Session(bind=engine) as session:
+            fn(session)
+            session.execute(schema_migrations.insert().values(name=name, applied_at=datetime.utcnow()))
+            session.commit()
+
+def migrate(engine: Engine) -> None:
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    create_missing_indexes(engine)
+    run_data_migrations(engine)
+
+if __name__ == "__main__":
+    # The deploy step: run once before starting (or scaling) the app's workers
+    from dotenv import load_dotenv
+    load_dotenv()
+    from database import get_engine
+    logging.basicConfig(level=logging.INFO)
+    migrate(get_engine())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 
@@ -19,17 +19,179 @@ class HealthData(Base):
     id = Column(Integer, primary_key=True, index=True)
     patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     weight = Column(Float, nullable=True)
+    # "120/80" as submitted; systolic/diastolic hold the same values for SQL aggregation
     bp = Column(String, nullable=True)
+    systolic = Column(Integer, nullable=True)
+    diastolic = Column(Integer, nullable=True)
     glucose = Column(Float, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # The user's data version (see UserDataVersion) as of the last write to this row
+    change_seq = Column(Integer, nullable=True)
     # Relationship back to user and AI insights
     user = relationship("User", back_populates="health_entries")
     ai_insights = relationship("AIInsight", back_populates="health_data")
 
+    __table_args__ = (
+        # Serves the per-user, time-ordered listing and range filters
+        Index("ix_health_data_patient_timestamp", "patient_id", "timestamp"),
+        # Serves the delta sync query
+        Index("ix_health_data_patient_change_seq", "patient_id", "change_seq"),
+    )
+
 class AIInsight(Base):
     __tablename__ = "ai_insights"
     id = Column(Integer, primary_key=True, index=True)
+    # Newest reading the insight covers
     health_data_id = Column(Integer, ForeignKey("health_data.id"), nullable=False)
     insight = Column(Text, nullable=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    # Hash of the input data and prompt version the insight was generated from
+    fingerprint = Column(String, nullable=True)
+    prompt_version = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
     # Relationship back to health data
     health_data = relationship("HealthData", back_populates="ai_insights")
+
+class HealthDataRollup(Base):
+    # Per-user aggregates per day/week/month bucket, maintained on every write
+    __tablename__ = "health_data_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    bucket = Column(String, nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    weight_count = Column(Integer, nullable=False, default=0)
+    weight_sum = Column(Float, nullable=True)
+    weight_min = Column(Float, nullable=True)
+    weight_max = Column(Float, nullable=True)
+    glucose_count = Column(Integer, nullable=False, default=0)
+    glucose_sum = Column(Float, nullable=True)
+    glucose_min = Column(Float, nullable=True)
+    glucose_max = Column(Float, nullable=True)
+    systolic_count = Column(Integer, nullable=False, default=0)
+    systolic_sum = Column(Float, nullable=True)
+    systolic_min = Column(Float, nullable=True)
+    systolic_max = Column(Float, nullable=True)
+    diastolic_count = Column(Integer, nullable=False, default=0)
+    diastolic_sum = Column(Float, nullable=True)
+    diastolic_min = Column(Float, nullable=True)
+    diastolic_max = Column(Float, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("patient_id", "bucket", "bucket_start", name="uq_health_data_rollups_bucket"),
+    )
+
+class UserDataVersion(Base):
+    # Bumped on every change to a user's health data; GET responses derive their ETag from it
+    __tablename__ = "user_data_versions"
+    patient_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    # Highest change_seq whose tombstones were compacted away; older sync cursors must resync
+    compacted_seq = Column(Integer, nullable=True)
+
+class HealthDataTombstone(Base):
+    # Deleted readings, kept for delta sync clients until compacted after the retention window
+    __tablename__ = "health_data_tombstones"
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    entry_id = Column(Integer, nullable=False)
+    change_seq = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        Index("ix_health_data_tombstones_patient_change_seq", "patient_id", "change_seq"),
+    )
+
+class HealthMetricStats(Base):
+    # Running per-user, per-metric statistics, updated in O(1) on every write
+    __tablename__ = "health_metric_stats"
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    metric = Column(String, nullable=False)
+    # Welford's running mean and sum of squared deviations
+    count = Column(Integer, nullable=False, default=0)
+    mean = Column(Float, nullable=False, default=0.0)
+    m2 = Column(Float, nullable=False, default=0.0)
+    ewma = Column(Float, nullable=True)
+    last_value = Column(Float, nullable=True)
+    last_timestamp = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("patient_id", "metric", name="uq_health_metric_stats_metric"),
+    )
+
+class HealthDataAnomaly(Base):
+    # A reading flagged on write, either far from the user's mean or a sudden jump
+    __tablename__ = "health_data_anomalies"
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    entry_id = Column(Integer, ForeignKey("health_data.id"), nullable=False, index=True)
+    metric = Column(String, nullable=False)
+    # "zscore" or "rate_of_change"
+    kind = Column(String, nullable=False)
+    value = Column(Float, nullable=False)
+    # The mean (zscore) or previous reading (rate_of_change) the value was compared with
+    expected = Column(Float, nullable=True)
+    score = Column(Float, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    detected_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_health_data_anomalies_patient_timestamp", "patient_id", "timestamp"),
+    )
+
+class MetricSketch(Base):
+    # Population-wide t-digest of one metric over one day or month. Each bucket is
+    # split into shards by patient so concurrent writers rarely contend for a row;
+    # queries merge the shards (and buckets) they need.
+    __tablename__ = "metric_sketches"
+    id = Column(Integer, primary_key=True, index=True)
+    metric = Column(String, nullable=False)
+    bucket = Column(String, nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    shard = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    # JSON-serialized centroids, see sketches.TDigest
+    digest = Column(Text, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("metric", "bucket", "bucket_start", "shard", name="uq_metric_sketches_bucket"),
+    )
+
+class HealthDataDailySummary(Base):
+    # Per-user, per-day aggregates of raw readings removed by retention (see retention.py)
+    __tablename__ = "health_data_daily_summaries"
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(DateTime, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    weight_count = Column(Integer, nullable=False, default=0)
+    weight_sum = Column(Float, nullable=True)
+    weight_min = Column(Float, nullable=True)
+    weight_max = Column(Float, nullable=True)
+    glucose_count = Column(Integer, nullable=False, default=0)
+    glucose_sum = Column(Float, nullable=True)
+    glucose_min = Column(Float, nullable=True)
+    glucose_max = Column(Float, nullable=True)
+    systolic_count = Column(Integer, nullable=False, default=0)
+    systolic_sum = Column(Float, nullable=True)
+    systolic_min = Column(Float, nullable=True)
+    systolic_max = Column(Float, nullable=True)
+    diastolic_count = Column(Integer, nullable=False, default=0)
+    diastolic_sum = Column(Float, nullable=True)
+    diastolic_min = Column(Float, nullable=True)
+    diastolic_max = Column(Float, nullable=True)
+    # Sums of squares, so rebuilt running stats keep the archived readings' variance
+    weight_sumsq = Column(Float, nullable=True)
+    glucose_sumsq = Column(Float, nullable=True)
+    systolic_sumsq = Column(Float, nullable=True)
+    diastolic_sumsq = Column(Float, nullable=True)
+    # Delta sync sends the summary again whenever retention folds more readings into it
+    change_seq = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Also serves the per-user, time-ordered reads that merge summaries with live rows
+        UniqueConstraint("patient_id", "day", name="uq_health_data_daily_summaries_day"),
+    )
@@ -0,0 +1,227 @@
+"""Per-caller rate limiting and admission control.
+
+Every request in a limited route group spends a token from a bucket keyed by
+the group and the caller. The caller is the JWT ``sub`` when the request has
+a valid token, and the client IP otherwise. /auth always uses the IP, since
+those requests don't have a token yet. Buckets refill at the group's
+per-minute rate and hold at most one minute's worth. Short bursts pass;
+sustained floods get a 429.
+
+The expensive routes also share a concurrency cap in each process. Requests
+beyond the cap wait in a bounded queue. They get a 503 when the queue is full
+or the wait runs out.
+"""
+import asyncio
+import importlib
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from metrics import record_rate_limited
+from security import decode_token_cached
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# "memory", or "package.module:ClassName" for a store shared by all workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Requests per minute per caller, by route group; 0 turns a group's limit off
+RATE_LIMITS = {
+    "auth": float(os.getenv("RATE_LIMIT_AUTH_PER_MINUTE", "20")),
+    "ai": float(os.getenv("RATE_LIMIT_AI_PER_MINUTE", "10")),
+    "write": float(os.getenv("RATE_LIMIT_WRITE_PER_MINUTE", "120")),
+    "read": float(os.getenv("RATE_LIMIT_READ_PER_MINUTE", "600")),
+}
+# Buckets the in-memory backend keeps; the least recently used go first
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Requests running at once on the expensive routes, per process; 0 turns a cap off
+ADMISSION_LIMITS = {
+    "ai": int(os.getenv("ADMISSION_AI_CONCURRENCY", "8")),
+    "login": int(os.getenv("ADMISSION_LOGIN_CONCURRENCY", "16")),
+}
+# Requests allowed to wait for a slot, and for how long, before they are turned away with a 503
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+RATE_LIMIT_HEADERS = ["RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy"]
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+def _under(path: str, prefix: str) -> bool:
+    return path == prefix or path.startswith(prefix + "/")
+
+def route_group(method: str, path: str) -> Optional[str]:
+    if _under(path, "/auth"):
+        return "auth"
+    if _under(path, "/ai") and method not in SAFE_METHODS:
+        return "ai"
+    if _under(path, "/healthdata") or _under(path, "/ai") or _under(path, "/admin"):
+        return "read" if method in SAFE_METHODS else "write"
+    # Health checks, /metrics and the docs stay unlimited
+    return None
+
+def admission_group(method: str, path: str) -> Optional[str]:
+    # Job polling isn't gated: it only waits and would hold a slot while doing so
+    path = path.rstrip("/")
+    if method == "POST" and path in ("/ai", "/ai/stream"):
+        return "ai"
+    if method == "POST" and path == "/auth/login":
+        return "login"
+    return None
+
+def client_key(scope, group: str) -> str:
+    if group != "auth":
+        authorization = Headers(scope=scope).get("authorization", "")
+        parts = authorization.split()
+        payload = decode_token_cached(parts[1]) if len(parts) == 2 and parts[0].lower() == "bearer" else None
+        if payload and payload.get("sub") is not None:
+            return f"user:{payload['sub']}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+@dataclass
+class Decision:
+    allowed: bool
+    limit: float
+    remaining: float
+    # Seconds until the bucket is full again
+    reset: float
+    # Seconds until the next request would pass; 0 when this one did
+    retry_after: float
+
+    def headers(self) -> List[Tuple[str, str]]:
+        limit = int(self.limit)
+        return [
+            ("RateLimit-Limit", str(limit)),
+            ("RateLimit-Remaining", str(math.floor(self.remaining))),
+            ("RateLimit-Reset", str(math.ceil(self.reset))),
+            ("RateLimit-Policy", f"{limit};w=60"),
+        ]
+
+class RateLimitBackend(ABC):
+    """Interface for bucket stores.
+
+    ``take`` must refill and spend in one atomic step, so concurrent requests
+    (from any worker, for shared stores) can't both spend the last token.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, capacity: float) -> Decision:
+        ...
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, capacity: float) -> Decision:
+        # Nothing here awaits, so each call is atomic on the event loop
+        now = self.clock()
+        tokens, updated = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        # An evicted caller starts over with a full bucket, which an idle one would have anyway
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return Decision(allowed, capacity, tokens, (capacity - tokens) / rate, 0.0 if allowed else (1 - tokens) / rate)
+
+def create_rate_limit_backend(backend: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if backend == "memory":
+        return InMemoryRateLimitBackend()
+    module_name, _, class_name = backend.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+class AdmissionRejected(Exception):
+    pass
+
+class AdmissionGate:
+    """Lets ``limit`` requests run at once; up to ``max_queue`` more wait their turn in arrival order."""
+
+    def __init__(self, limit: int, max_queue: int = ADMISSION_MAX_QUEUE, timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        self.limit = limit
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> None:
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            raise AdmissionRejected()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise AdmissionRejected()
+        finally:
+            self.waiting -= 1
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+def _error(status: int, detail: str, retry_after: float, headers: List[Tuple[str, str]]) -> JSONResponse:
+    # Same body shape as HTTPException responses
+    return JSONResponse(
+        {"detail": detail}, status_code=status,
+        headers={**dict(headers), "Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+class RateLimitMiddleware:
+    """Plain ASGI middleware, so a streamed response keeps its admission slot until the body is sent."""
+
+    def __init__(
+        self,
+        app,
+        backend: Optional[RateLimitBackend] = None,
+        limits: Dict[str, float] = RATE_LIMITS,
+        admission: Dict[str, int] = ADMISSION_LIMITS,
+    ):
+        self.app = app
+        self.backend = backend or create_rate_limit_backend()
+        self.limits = limits
+        self.gates = {group: AdmissionGate(limit) for group, limit in admission.items() if limit > 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method, path = scope["method"], scope["path"]
+        group = route_group(method, path)
+        headers: List[Tuple[str, str]] = []
+        if group and self.limits.get(group, 0) > 0:
+            limit = self.limits[group]
+            decision = await self.backend.take(f"{group}:{client_key(scope, group)}", limit / 60, limit)
+            headers = decision.headers()
+            if not decision.allowed:
+                record_rate_limited(group, "rate")
+                await _error(429, "Too many requests", decision.retry_after, headers)(scope, receive, send)
+                return
+
+        async def _send(message):
+            if message["type"] == "http.response.start" and headers:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (name.lower().encode(), value.encode()) for name, value in headers
+                ]
+            await send(message)
+
+        gate_group = admission_group(method, path)
+        gate = self.gates.get(gate_group)
+        if gate is None:
+            await self.app(scope, receive, _send)
+            return
+        try:
+            await gate.acquire()
+        except AdmissionRejected:
+            record_rate_limited(gate_group, "busy")
+            await _error(503, "Server is busy, please retry shortly", ADMISSION_RETRY_AFTER, headers)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            gate.release()
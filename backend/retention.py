@@ -0,0 +1,228 @@
+"""Tiered retention for raw readings.
+
+    python retention.py            # one pass over everything past the window
+    python retention.py --dry-run  # count what a pass would move
+
+Raw readings older than RETENTION_RAW_DAYS are folded into per-user daily
+summaries (health_data_daily_summaries) and removed from health_data. With
+RETENTION_ARCHIVE_DIR set, the raw rows are also written to gzipped NDJSON
+files first. Rollups, running stats and population sketches already count
+these readings and are left as they are; their rebuilds read the summaries
+(or, for sketches, keep the days before the cutoff). Read endpoints, delta
+sync and the AI paths merge the summaries back in. Each moved row gets a
+tombstone, so sync clients replace it with its day's summary.
+"""
+import argparse
+import gzip
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+if __name__ == "__main__":
+    # Modules below read their settings on import, so .env must be loaded first
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import orjson
+from sqlalchemy import and_, func, insert, or_, select
+from sqlalchemy.orm import Session
+from data_versions import bump_data_version
+from database import PeriodicTask
+from models import AIInsight, HealthData, HealthDataAnomaly, HealthDataDailySummary, HealthDataTombstone
+from rollups import METRICS, aggregate, bucket_start, upsert_stats, reading_values
+
+logger = logging.getLogger(__name__)
+
+# Raw readings are kept this long; 0 keeps them forever
+RETENTION_RAW_DAYS = float(os.getenv("RETENTION_RAW_DAYS", "0"))
+# When set, raw rows are also written here (gzipped NDJSON, one directory per user) before removal
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR")
+# Rows moved per transaction; keeps each write lock short
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+
+SUMSQ_COLUMNS = tuple(f"{metric}_sumsq" for metric in METRICS)
+
+RAW_COLUMNS = (
+    HealthData.id, HealthData.patient_id, HealthData.weight, HealthData.bp, HealthData.systolic,
+    HealthData.diastolic, HealthData.glucose, HealthData.timestamp,
+)
+
+def retention_cutoff(now: Optional[datetime] = None, raw_days: float = RETENTION_RAW_DAYS) -> datetime:
+    # Whole days only, so a summary never covers part of a day that still has raw rows
+    cutoff = (now or datetime.utcnow()) - timedelta(days=raw_days)
+    return datetime(cutoff.year, cutoff.month, cutoff.day)
+
+def write_archive(archive_dir: Path, patient_id: int, rows: Sequence) -> None:
+    # Named after the batch's id range, so re-running a batch that failed to commit overwrites its own file
+    directory = archive_dir / str(patient_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{rows[0].id}-{rows[-1].id}.ndjson.gz"
+    tmp = path.with_suffix(".tmp")
+    with gzip.open(tmp, "wb") as f:
+        for row in rows:
+            f.write(orjson.dumps(dict(row._mapping)) + b"\n")
+    tmp.replace(path)
+
+def archive_patient(db: Session, patient_id: int, rows: Sequence) -> None:
+    # Bumping first takes the per-user write lock; the new version tags the summaries and tombstones
+    change_seq = bump_data_version(db, patient_id)
+    readings = [(row.timestamp, reading_values(row.weight, row.systolic, row.diastolic, row.glucose)) for row in rows]
+    day_stats = aggregate(readings, buckets=("day",))
+    for timestamp, values in readings:
+        stats = day_stats[("day", bucket_start(timestamp, "day"))]
+        for metric in METRICS:
+            if values[metric] is not None:
+                stats[f"{metric}_sumsq"] = stats.get(f"{metric}_sumsq", 0) + values[metric] ** 2
+    now = datetime.utcnow()
+    summaries = [
+        {
+            "patient_id": patient_id, "day": start, "change_seq": change_seq, "updated_at": now,
+            **{f"{metric}_sumsq": None for metric in METRICS}, **stats,
+        }
+        for (_, start), stats in day_stats.items()
+    ]
+    db.execute(upsert_stats(
+        db.get_bind().dialect.name, HealthDataDailySummary.__table__, index_elements=("patient_id", "day"),
+        sums=SUMSQ_COLUMNS, latest=("change_seq", "updated_at"),
+    ), summaries)
+    ids = [row.id for row in rows]
+    # Rows referencing the readings go first; their foreign keys would block the delete
+    db.query(HealthDataAnomaly).filter(HealthDataAnomaly.entry_id.in_(ids)).delete(synchronize_session=False)
+    db.query(AIInsight).filter(AIInsight.health_data_id.in_(ids)).delete(synchronize_session=False)
+    db.query(HealthData).filter(HealthData.id.in_(ids)).delete(synchronize_session=False)
+    # Delta sync clients drop the raw rows and pick up the summaries in the same change set
+    db.execute(insert(HealthDataTombstone), [
+        {"patient_id": patient_id, "entry_id": entry_id, "change_seq": change_seq} for entry_id in ids
+    ])
+
+def run_retention(
+    db: Session,
+    now: Optional[datetime] = None,
+    raw_days: float = RETENTION_RAW_DAYS,
+    archive_dir: Optional[str] = RETENTION_ARCHIVE_DIR,
+    batch_size: int = RETENTION_BATCH_SIZE,
+) -> int:
+    """Moves raw readings past the window into daily summaries, one committed batch at a time."""
+    if raw_days <= 0:
+        return 0
+    cutoff = retention_cutoff(now, raw_days)
+    moved = 0
+    while True:
+        rows = db.execute(
+            select(*RAW_COLUMNS).where(HealthData.timestamp < cutoff).order_by(HealthData.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return moved
+        by_patient: Dict[int, List] = defaultdict(list)
+        for row in rows:
+            by_patient[row.patient_id].append(row)
+        for patient_id, patient_rows in by_patient.items():
+            if archive_dir:
+                write_archive(Path(archive_dir), patient_id, patient_rows)
+            archive_patient(db, patient_id, patient_rows)
+        db.commit()
+        moved += len(rows)
+
+def count_expired(db: Session, now: Optional[datetime] = None, raw_days: float = RETENTION_RAW_DAYS) -> int:
+    if raw_days <= 0:
+        return 0
+    return db.query(HealthData.id).filter(HealthData.timestamp < retention_cutoff(now, raw_days)).count()
+
+def load_summary_changes(
+    db: Session,
+    patient_id: int,
+    since: int,
+    after: Optional[Tuple[int, Optional[int]]] = None,
+    limit: Optional[int] = None,
+) -> List[Tuple]:
+    """Summaries written after the ``since`` sync cursor, in (change_seq, id) order.
+
+    Each is a listing tuple followed by updated_at and change_seq. ``after`` is
+    the (change_seq, summary id) a previous page ended on; no id means every
+    summary at that change_seq was already sent.
+    """
+    seq = func.coalesce(HealthDataDailySummary.change_seq, 0)
+    query = db.query(HealthDataDailySummary, seq).filter(HealthDataDailySummary.patient_id == patient_id)
+    if since:
+        query = query.filter(HealthDataDailySummary.change_seq > since)
+    if after:
+        last_seq, last_id = after
+        query = query.filter(
+            seq > last_seq if last_id is None
+            else or_(seq > last_seq, and_(seq == last_seq, HealthDataDailySummary.id > last_id))
+        )
+    query = query.order_by(seq, HealthDataDailySummary.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [summary_entry(summary) + (summary.updated_at, change_seq) for summary, change_seq in query]
+
+def summary_entry(summary: HealthDataDailySummary) -> Tuple:
+    """A day's summary shaped like a listing row: negative id, the day's means, the day as timestamp."""
+    means = {
+        metric: getattr(summary, f"{metric}_sum") / getattr(summary, f"{metric}_count")
+        if getattr(summary, f"{metric}_count") else None
+        for metric in METRICS
+    }
+    systolic = round(means["systolic"]) if means["systolic"] is not None else None
+    diastolic = round(means["diastolic"]) if means["diastolic"] is not None else None
+    return (
+        -summary.id,
+        round(means["weight"], 2) if means["weight"] is not None else None,
+        f"{systolic}/{diastolic}" if systolic is not None and diastolic is not None else None,
+        systolic,
+        diastolic,
+        round(means["glucose"], 2) if means["glucose"] is not None else None,
+        summary.day,
+    )
+
+def load_summary_entries(
+    db: Session,
+    patient_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    limit: Optional[int] = None,
+    newest_first: bool = True,
+) -> List[Tuple]:
+    """Summary rows as listing tuples, filtered and keyset-paged like the raw listing."""
+    table = HealthDataDailySummary
+    query = db.query(table).filter(table.patient_id == patient_id)
+    if since:
+        query = query.filter(table.day >= since)
+    if until:
+        query = query.filter(table.day < until)
+    if after:
+        # The cursor holds the listing id, which is -summary.id for summaries
+        last_timestamp, last_id = after
+        query = query.filter(or_(table.day < last_timestamp, and_(table.day == last_timestamp, -table.id < last_id)))
+    # One row per user and day, so the id only breaks ties against raw rows at midnight
+    query = query.order_by(table.day.desc() if newest_first else table.day, table.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [summary_entry(summary) for summary in query]
+
+retention_passes = PeriodicTask(
+    "Retention pass", run_retention, RETENTION_INTERVAL_SECONDS, "Moved %d raw readings into daily summaries"
+)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--raw-days", type=float, default=RETENTION_RAW_DAYS)
+    parser.add_argument("--archive-dir", default=RETENTION_ARCHIVE_DIR)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    from database import get_engine
+    with Session(bind=get_engine()) as db:
+        if args.dry_run:
+            logger.info("%d raw readings are past the retention window", count_expired(db, raw_days=args.raw_days))
+            return
+        moved = run_retention(db, raw_days=args.raw_days, archive_dir=args.archive_dir)
+    logger.info("Moved %d raw readings into daily summaries", moved)
+
+if __name__ == "__main__":
+    main()
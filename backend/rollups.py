@@ -0,0 +1,295 @@
+from calendar import monthrange
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import Session
+from models import HealthData, HealthDataDailySummary, HealthDataRollup
+
+BUCKETS = ("day", "week", "month")
+METRICS = ("weight", "glucose", "systolic", "diastolic")
+# Raw rows fetched per round trip when a user's rollups or stats are rebuilt from scratch
+REBUILD_BATCH_SIZE = 1000
+
+# (timestamp, {metric: value or None})
+Reading = Tuple[datetime, Dict[str, Optional[float]]]
+BucketKey = Tuple[str, datetime]
+
+def bucket_start(timestamp: datetime, bucket: str) -> datetime:
+    day = datetime(timestamp.year, timestamp.month, timestamp.day)
+    if bucket == "day":
+        return day
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def bucket_end(start: datetime, bucket: str) -> datetime:
+    if bucket == "day":
+        return start + timedelta(days=1)
+    if bucket == "week":
+        return start + timedelta(days=7)
+    return start + timedelta(days=monthrange(start.year, start.month)[1])
+
+def reading_values(
+    weight: Optional[float], systolic: Optional[int], diastolic: Optional[int], glucose: Optional[float]
+) -> Dict[str, Optional[float]]:
+    return {"weight": weight, "glucose": glucose, "systolic": systolic, "diastolic": diastolic}
+
+def entry_reading(entry: HealthData) -> Reading:
+    return entry.timestamp, reading_values(entry.weight, entry.systolic, entry.diastolic, entry.glucose)
+
+def empty_stats() -> dict:
+    stats = {"count": 0}
+    for metric in METRICS:
+        stats.update({f"{metric}_count": 0, f"{metric}_sum": None, f"{metric}_min": None, f"{metric}_max": None})
+    return stats
+
+def aggregate(readings: Iterable[Reading], buckets: Sequence[str] = BUCKETS) -> Dict[BucketKey, dict]:
+    result: Dict[BucketKey, dict] = {}
+    for timestamp, values in readings:
+        for bucket in buckets:
+            stats = result.setdefault((bucket, bucket_start(timestamp, bucket)), empty_stats())
+            stats["count"] += 1
+            for metric in METRICS:
+                value = values.get(metric)
+                if value is None:
+                    continue
+                stats[f"{metric}_count"] += 1
+                stats[f"{metric}_sum"] = (stats[f"{metric}_sum"] or 0) + value
+                if stats[f"{metric}_min"] is None or value < stats[f"{metric}_min"]:
+                    stats[f"{metric}_min"] = value
+                if stats[f"{metric}_max"] is None or value > stats[f"{metric}_max"]:
+                    stats[f"{metric}_max"] = value
+    return result
+
+def upsert_stats(
+    dialect_name: str,
+    table=HealthDataRollup.__table__,
+    index_elements=("patient_id", "bucket", "bucket_start"),
+    sums: Sequence[str] = (),
+    latest: Sequence[str] = (),
+):
+    """INSERT ... ON CONFLICT that folds the new stats into an existing row of ``table``.
+
+    Columns in ``sums`` are added up as well; columns in ``latest`` take the new value.
+    """
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    new = stmt.excluded
+    values = {"count": table.c.count + new["count"]}
+    for metric in METRICS:
+        count, total, low, high = (f"{metric}_count", f"{metric}_sum", f"{metric}_min", f"{metric}_max")
+        values[count] = table.c[count] + new[count]
+        values[total] = case((new[total].is_(None), table.c[total]), else_=func.coalesce(table.c[total], 0) + new[total])
+        values[low] = case(
+            (new[low].is_(None), table.c[low]),
+            (table.c[low].is_(None) | (new[low] < table.c[low]), new[low]),
+            else_=table.c[low],
+        )
+        values[high] = case(
+            (new[high].is_(None), table.c[high]),
+            (table.c[high].is_(None) | (new[high] > table.c[high]), new[high]),
+            else_=table.c[high],
+        )
+    for column in sums:
+        values[column] = case((new[column].is_(None), table.c[column]), else_=func.coalesce(table.c[column], 0) + new[column])
+    for column in latest:
+        values[column] = new[column]
+    return stmt.on_conflict_do_update(index_elements=list(index_elements), set_=values)
+
+def add_readings(db: Session, patient_id: int, readings: Sequence[Reading]) -> None:
+    """Folds new readings into their buckets with one upsert; the caller commits."""
+    rows = [
+        {"patient_id": patient_id, "bucket": bucket, "bucket_start": start, **stats}
+        for (bucket, start), stats in aggregate(readings).items()
+    ]
+    if rows:
+        db.execute(upsert_stats(db.get_bind().dialect.name), rows)
+
+def _touches_extreme(row: HealthDataRollup, removed: dict) -> bool:
+    for metric in METRICS:
+        if not removed[f"{metric}_count"]:
+            continue
+        if getattr(row, f"{metric}_min") is None or getattr(row, f"{metric}_max") is None:
+            return True
+        if removed[f"{metric}_min"] <= getattr(row, f"{metric}_min") or removed[f"{metric}_max"] >= getattr(row, f"{metric}_max"):
+            return True
+    return False
+
+def _apply(row: HealthDataRollup, stats: dict, sign: int) -> None:
+    row.count += sign * stats["count"]
+    for metric in METRICS:
+        count = getattr(row, f"{metric}_count") + sign * stats[f"{metric}_count"]
+        setattr(row, f"{metric}_count", count)
+        if not stats[f"{metric}_count"]:
+            continue
+        if count <= 0:
+            for suffix in ("sum", "min", "max"):
+                setattr(row, f"{metric}_{suffix}", None)
+            continue
+        setattr(row, f"{metric}_sum", (getattr(row, f"{metric}_sum") or 0) + sign * stats[f"{metric}_sum"])
+        if sign > 0:
+            low, high = getattr(row, f"{metric}_min"), getattr(row, f"{metric}_max")
+            setattr(row, f"{metric}_min", stats[f"{metric}_min"] if low is None else min(low, stats[f"{metric}_min"]))
+            setattr(row, f"{metric}_max", stats[f"{metric}_max"] if high is None else max(high, stats[f"{metric}_max"]))
+
+def combine(stats: dict, other: dict) -> dict:
+    combined = {"count": stats["count"] + other["count"]}
+    for metric in METRICS:
+        count, total, low, high = (f"{metric}_count", f"{metric}_sum", f"{metric}_min", f"{metric}_max")
+        combined[count] = stats[count] + other[count]
+        combined[total] = None if combined[count] == 0 else (stats[total] or 0) + (other[total] or 0)
+        lows = [v for v in (stats[low], other[low]) if v is not None]
+        highs = [v for v in (stats[high], other[high]) if v is not None]
+        combined[low] = min(lows) if lows else None
+        combined[high] = max(highs) if highs else None
+    return combined
+
+def rebuild_buckets(
+    db: Session, patient_id: int, keys: Iterable[BucketKey], rows: Dict[BucketKey, HealthDataRollup]
+) -> None:
+    """Recomputes the given buckets from their raw readings and daily summaries.
+
+    An edit touches at most one day, week and month, so one range read of the
+    user's readings (served by the (patient_id, timestamp) index) and one of
+    the summaries cover every bucket. ``rows`` holds the buckets' current rows.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    start = min(key_start for _, key_start in keys)
+    end = max(bucket_end(key_start, bucket) for bucket, key_start in keys)
+    readings = db.query(
+        HealthData.timestamp, HealthData.weight, HealthData.systolic, HealthData.diastolic, HealthData.glucose
+    ).filter(HealthData.patient_id == patient_id, HealthData.timestamp >= start, HealthData.timestamp < end)
+    fresh = aggregate(
+        [(ts, reading_values(w, s, d, g)) for ts, w, s, d, g in readings], buckets={bucket for bucket, _ in keys}
+    )
+    # Readings moved out by retention still belong to their buckets
+    summaries = db.query(HealthDataDailySummary).filter(
+        HealthDataDailySummary.patient_id == patient_id,
+        HealthDataDailySummary.day >= start,
+        HealthDataDailySummary.day < end,
+    )
+    for summary in summaries:
+        for bucket in BUCKETS:
+            key = (bucket, bucket_start(summary.day, bucket))
+            if key in keys:
+                fresh[key] = combine(fresh[key], summary_stats(summary)) if key in fresh else summary_stats(summary)
+    for bucket, key_start in keys:
+        stats, row = fresh.get((bucket, key_start)), rows.get((bucket, key_start))
+        if stats is None:
+            if row is not None:
+                db.delete(row)
+            continue
+        if row is None:
+            row = HealthDataRollup(patient_id=patient_id, bucket=bucket, bucket_start=key_start)
+            db.add(row)
+        for name, value in stats.items():
+            setattr(row, name, value)
+
+def record_changes(db: Session, patient_id: int, removed: Sequence[Reading] = (), added: Sequence[Reading] = ()) -> None:
+    """Keeps the rollups in step with an insert, update or delete, inside the caller's transaction.
+
+    Removing a value can't lower a max (or raise a min) incrementally, so a bucket
+    whose extreme was removed is recomputed from its raw rows instead.
+    """
+    if not removed:
+        add_readings(db, patient_id, added)
+        return
+    # Raw rows must reflect the change before any bucket is recomputed
+    db.flush()
+    gone, new = aggregate(removed), aggregate(added)
+    keys = gone.keys() | new.keys()
+    rows = {
+        (row.bucket, row.bucket_start): row
+        for row in db.query(HealthDataRollup).filter(
+            HealthDataRollup.patient_id == patient_id,
+            or_(*(and_(HealthDataRollup.bucket == bucket, HealthDataRollup.bucket_start == start) for bucket, start in keys)),
+        ).with_for_update()
+    }
+    stale = []
+    for key in keys:
+        row, removed_stats = rows.get(key), gone.get(key)
+        if row is None or (removed_stats and _touches_extreme(row, removed_stats)):
+            stale.append(key)
+            continue
+        if removed_stats:
+            _apply(row, removed_stats, -1)
+        if key in new:
+            _apply(row, new[key], 1)
+        if row.count <= 0:
+            db.delete(row)
+    rebuild_buckets(db, patient_id, stale, rows)
+
+def rebuild_patient(db: Session, patient_id: int) -> None:
+    db.query(HealthDataRollup).filter(HealthDataRollup.patient_id == patient_id).delete(synchronize_session=False)
+    rows = db.execute(
+        select(HealthData.timestamp, HealthData.weight, HealthData.systolic, HealthData.diastolic, HealthData.glucose)
+        .where(HealthData.patient_id == patient_id, HealthData.timestamp.isnot(None))
+        .execution_options(yield_per=REBUILD_BATCH_SIZE)
+    )
+    # add_readings upserts sums, so folding one partition at a time keeps memory flat
+    for partition in rows.partitions():
+        add_readings(db, patient_id, [(ts, reading_values(w, s, d, g)) for ts, w, s, d, g in partition])
+    add_archived(db, patient_id, db.query(HealthDataDailySummary).filter(HealthDataDailySummary.patient_id == patient_id))
+
+def summary_stats(summary: HealthDataDailySummary) -> dict:
+    stats = {"count": summary.count}
+    for metric in METRICS:
+        for suffix in ("count", "sum", "min", "max"):
+            stats[f"{metric}_{suffix}"] = getattr(summary, f"{metric}_{suffix}")
+    return stats
+
+def add_archived(db: Session, patient_id: int, summaries: Iterable[HealthDataDailySummary]) -> None:
+    # Each daily summary counts towards its day, week and month rollups like the readings it replaced
+    merged: Dict[BucketKey, dict] = {}
+    for summary in summaries:
+        for bucket in BUCKETS:
+            key = (bucket, bucket_start(summary.day, bucket))
+            merged[key] = combine(merged[key], summary_stats(summary)) if key in merged else summary_stats(summary)
+    rows = [{"patient_id": patient_id, "bucket": b, "bucket_start": start, **stats} for (b, start), stats in merged.items()]
+    if rows:
+        db.execute(upsert_stats(db.get_bind().dialect.name), rows)
+
+def patients_with_history(db: Session) -> List[int]:
+    # Users with live readings or daily summaries; retention can leave a user with only the latter
+    live = db.query(HealthData.patient_id)
+    archived = db.query(HealthDataDailySummary.patient_id)
+    return sorted(pid for (pid,) in live.union(archived))
+
+def rebuild_all(db: Session) -> None:
+    """Recomputes every rollup from the raw table and the daily summaries; used to backfill existing databases."""
+    db.query(HealthDataRollup).delete(synchronize_session=False)
+    patient_ids = patients_with_history(db)
+    for patient_id in patient_ids:
+        rebuild_patient(db, patient_id)
+    db.commit()
+
+def bucket_stats(row: HealthDataRollup) -> dict:
+    data = {"bucket_start": row.bucket_start, "count": row.count}
+    for metric in METRICS:
+        count = getattr(row, f"{metric}_count")
+        data[metric] = {
+            "count": count,
+            "mean": round(getattr(row, f"{metric}_sum") / count, 2) if count else None,
+            "min": getattr(row, f"{metric}_min"),
+            "max": getattr(row, f"{metric}_max"),
+        }
+    return data
+
+def load_stats(
+    db: Session, patient_id: int, bucket: str, since: Optional[datetime], until: Optional[datetime], limit: int
+) -> List[dict]:
+    query = db.query(HealthDataRollup).filter(
+        HealthDataRollup.patient_id == patient_id, HealthDataRollup.bucket == bucket
+    )
+    if since:
+        query = query.filter(HealthDataRollup.bucket_start >= bucket_start(since, bucket))
+    if until:
+        query = query.filter(HealthDataRollup.bucket_start < until)
+    # Newest `limit` buckets, returned oldest first for charting
+    rows = query.order_by(HealthDataRollup.bucket_start.desc()).limit(limit).all()
+    return [bucket_stats(row) for row in reversed(rows)]
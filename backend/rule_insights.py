@@ -0,0 +1,86 @@
+import os
+from datetime import datetime
+from statistics import mean
+from typing import List, Optional, Sequence
+from sqlalchemy.orm import Session
+from models import HealthData
+from retention import load_summary_entries
+
+# Newest readings the local fallback looks at
+AI_FALLBACK_READINGS = int(os.getenv("AI_FALLBACK_READINGS", "30"))
+# Relative weight change across those readings that counts as a trend
+WEIGHT_TREND_THRESHOLD = 0.02
+
+def load_recent_readings(db: Session, patient_id: int, limit: int = AI_FALLBACK_READINGS) -> List[tuple]:
+    # (timestamp, weight, systolic, diastolic, glucose), oldest first, like health_summary.load_readings
+    rows = db.query(
+        HealthData.timestamp, HealthData.weight, HealthData.systolic, HealthData.diastolic, HealthData.glucose
+    ).filter(HealthData.patient_id == patient_id).order_by(
+        HealthData.timestamp.desc(), HealthData.id.desc()
+    ).limit(limit).all()
+    readings = [tuple(row) for row in rows]
+    if len(readings) < limit:
+        # Older history may only survive as daily summaries after retention
+        readings += [
+            (timestamp, weight, systolic, diastolic, glucose)
+            for _, weight, _, systolic, diastolic, glucose, timestamp in load_summary_entries(db, patient_id, limit=limit - len(readings))
+        ]
+    return sorted(readings, key=lambda reading: reading[0] or datetime.min)
+
+def _average(readings: Sequence[tuple], index: int) -> Optional[float]:
+    values = [r[index] for r in readings if r[index] is not None]
+    return mean(values) if values else None
+
+def blood_pressure_sentence(systolic: Optional[float], diastolic: Optional[float]) -> Optional[str]:
+    # ACC/AHA categories, applied to the recent average rather than a single reading
+    if systolic is None or diastolic is None:
+        return None
+    bp = f"{systolic:.0f}/{diastolic:.0f} mmHg"
+    if systolic >= 180 or diastolic >= 120:
+        return f"Your recent blood pressure averages {bp}, which is in the hypertensive crisis range; seek medical care promptly."
+    if systolic >= 140 or diastolic >= 90:
+        return f"Your recent blood pressure averages {bp}, in the stage 2 hypertension range; please discuss it with your doctor."
+    if systolic >= 130 or diastolic >= 80:
+        return f"Your recent blood pressure averages {bp}, in the stage 1 hypertension range; reducing salt and staying active can help."
+    if systolic >= 120:
+        return f"Your recent blood pressure averages {bp}, which is elevated; keep monitoring it regularly."
+    if systolic < 90 or diastolic < 60:
+        return f"Your recent blood pressure averages {bp}, which is low; mention it to your doctor if you feel dizzy."
+    return f"Your recent blood pressure averages {bp}, within the normal range."
+
+def glucose_sentence(glucose: Optional[float]) -> Optional[str]:
+    if glucose is None:
+        return None
+    level = f"{glucose:.0f} mg/dL"
+    if glucose >= 126:
+        return f"Your glucose averages {level}, in the diabetes range; please follow up with your doctor."
+    if glucose >= 100:
+        return f"Your glucose averages {level}, slightly above normal; watch refined carbohydrates and keep active."
+    if glucose < 70:
+        return f"Your glucose averages {level}, which is low; make sure you eat regularly."
+    return f"Your glucose averages {level}, within the normal range."
+
+def weight_sentence(readings: Sequence[tuple]) -> Optional[str]:
+    weights = [r[1] for r in readings if r[1] is not None]
+    if len(weights) < 2:
+        return None
+    # Halves rather than endpoints, so one odd reading doesn't decide the trend
+    half = len(weights) // 2
+    earlier, later = mean(weights[:half]), mean(weights[half:])
+    change = (later - earlier) / earlier
+    if change >= WEIGHT_TREND_THRESHOLD:
+        return f"Your weight has been trending up (about {later - earlier:+.1f} lbs); balanced meals and regular activity can help."
+    if change <= -WEIGHT_TREND_THRESHOLD:
+        return f"Your weight has been trending down (about {later - earlier:+.1f} lbs); make sure the change is intended."
+    return "Your weight has been stable."
+
+def rule_based_insight(readings: Sequence[tuple]) -> str:
+    """A deterministic summary from fixed clinical thresholds, used when the LLM is unavailable."""
+    if not readings:
+        return "No health data found to generate insights."
+    sentences = [
+        blood_pressure_sentence(_average(readings, 2), _average(readings, 3)),
+        glucose_sentence(_average(readings, 4)),
+        weight_sentence(readings),
+    ]
+    return " ".join(sentence for sentence in sentences if sentence)
@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+from fastapi import Depends, Header, HTTPException
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database import get_db, get_read_db, run_db
+from models import User
+from utils import decode_access_token
+
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Read-only routes may trust the signed token's `sub` without looking the user up
+AUTH_TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() == "true"
+# Comma-separated emails of the accounts allowed on /admin routes
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, email=user.email, first_name=user.first_name, last_name=user.last_name)
+
+class TTLCache:
+    """Small thread-safe LRU whose entries also expire after a TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+token_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS)
+principal_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS)
+
+def decode_token_cached(token: str) -> Optional[dict]:
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = decode_access_token(token)
+        if not payload:
+            return None
+        # Never keep a token around past its own expiry
+        exp = payload.get("exp")
+        token_cache.set(token, payload, ttl=exp - time.time() if exp else None)
+    return payload
+
+def token_claims(authorization: Optional[str]) -> dict:
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Token missing")
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Invalid authorization header")
+    payload = decode_token_cached(parts[1])
+    if not payload:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    try:
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return {**payload, "sub": user_id}
+
+def load_user(db: Session, user_id: int) -> Optional[User]:
+    return db.query(User).filter(User.id == user_id).first()
+
+def invalidate_user(user_id: int) -> None:
+    principal_cache.pop(user_id)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target: User) -> None:
+    invalidate_user(target.id)
+
+async def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)) -> Principal:
+    user_id = token_claims(authorization)["sub"]
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        user = await run_db(db, load_user, user_id)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        principal = Principal.from_user(user)
+        principal_cache.set(user_id, principal)
+    return principal
+
+async def get_read_user(authorization: str = Header(None), db: Session = Depends(get_read_db)) -> Principal:
+    """Like get_current_user, but skips the user lookup when AUTH_TRUST_TOKEN_CLAIMS is on.
+
+    Only for routes that read the caller's own rows: a deleted user's token keeps
+    working here until it expires, which at worst returns an empty result.
+    """
+    if AUTH_TRUST_TOKEN_CLAIMS:
+        return Principal(id=token_claims(authorization)["sub"])
+    return await get_current_user(authorization, db)
+
+async def get_admin_user(current_user: Principal = Depends(get_current_user)) -> Principal:
+    if not current_user.email or current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
@@ -0,0 +1,298 @@
+"""Population sketches: mergeable t-digests per metric, day or month, and shard.
+
+    python sketches.py                     # rebuild from the retention cutoff on (everything without retention)
+    python sketches.py --since 2025-01-01  # rebuild the days from this one on
+
+Writes add their values as they happen, but edits and deletes can't be taken
+back out, so a rebuild from the raw table is run from cron (once, not per API
+worker). It replaces one day at a time, all users together, and commits after
+each day and each month, so writers are only ever held up for one bucket.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+if __name__ == "__main__":
+    # Modules below read their settings on import, so .env must be loaded first
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Session
+from models import HealthData, MetricSketch
+from retention import RETENTION_RAW_DAYS, retention_cutoff
+from rollups import METRICS, Reading, bucket_end, bucket_start, reading_values
+
+logger = logging.getLogger(__name__)
+
+# Higher keeps more centroids: more accurate tails, bigger rows, slower merges
+SKETCH_COMPRESSION = float(os.getenv("SKETCH_COMPRESSION", "100"))
+# Rows per (metric, bucket); writers for different patients mostly land on different rows
+SKETCH_SHARDS = int(os.getenv("SKETCH_SHARDS", "8"))
+SKETCH_BUCKETS = ("day", "month")
+# Keys per lookup, well under SQLite's bound-parameter limit for long backfills
+SKETCH_QUERY_CHUNK = 500
+# Raw rows fetched at a time while a day is rebuilt; only the digests stay in memory
+SKETCH_REBUILD_BATCH_SIZE = int(os.getenv("SKETCH_REBUILD_BATCH_SIZE", "1000"))
+
+class TDigest:
+    """Merging t-digest (Dunning): approximate quantiles from a small set of weighted centroids.
+
+    Centroids are kept small near the tails and large in the middle, so extreme
+    percentiles stay accurate. Two digests merge by pooling their centroids,
+    which is what lets per-bucket sketches be combined for any range.
+    """
+
+    def __init__(self, compression: float = SKETCH_COMPRESSION):
+        self.compression = compression
+        self.centroids: List[List[float]] = []
+        self.buffer: List[List[float]] = []
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    @property
+    def count(self) -> float:
+        return sum(w for _, w in self.centroids) + sum(w for _, w in self.buffer)
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        self.buffer.append([value, weight])
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.buffer) > 5 * self.compression:
+            self.compress()
+
+    def merge(self, other: "TDigest") -> None:
+        if other.min is None:
+            return
+        self.buffer.extend([m, w] for m, w in other.centroids + other.buffer)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        if len(self.buffer) > 5 * self.compression:
+            self.compress()
+
+    def _k(self, q: float) -> float:
+        # k1 scale function: centroid size limit shrinks towards q=0 and q=1
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def compress(self) -> None:
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        if not points:
+            self.centroids = []
+            return
+        total = sum(w for _, w in points)
+        merged = []
+        mean, weight = points[0]
+        before = 0.0
+        k_low = self._k(0.0)
+        for m, w in points[1:]:
+            if self._k((before + weight + w) / total) - k_low <= 1:
+                weight += w
+                mean += (m - mean) * w / weight
+            else:
+                merged.append([mean, weight])
+                before += weight
+                k_low = self._k(before / total)
+                mean, weight = m, w
+        merged.append([mean, weight])
+        self.centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        self.compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        total = sum(w for _, w in self.centroids)
+        target = q * total
+        # Interpolate between centroid centres; the ends run out to the exact min and max
+        cumulative = 0.0
+        previous_mean, previous_position = self.min, 0.0
+        for mean, weight in self.centroids:
+            position = cumulative + weight / 2
+            if target <= position:
+                span = position - previous_position
+                fraction = (target - previous_position) / span if span else 0.0
+                return previous_mean + (mean - previous_mean) * fraction
+            previous_mean, previous_position = mean, position
+            cumulative += weight
+        span = total - previous_position
+        fraction = (target - previous_position) / span if span else 1.0
+        return previous_mean + (self.max - previous_mean) * fraction
+
+    def to_json(self) -> str:
+        self.compress()
+        return json.dumps({
+            "compression": self.compression, "min": self.min, "max": self.max,
+            "centroids": [[round(m, 4), w] for m, w in self.centroids],
+        })
+
+    @classmethod
+    def from_json(cls, raw: Optional[str]) -> "TDigest":
+        digest = cls()
+        if raw:
+            data = json.loads(raw)
+            digest.compression = data["compression"]
+            digest.min, digest.max = data["min"], data["max"]
+            digest.centroids = data["centroids"]
+        return digest
+
+def _upsert_missing(db: Session, keys: Iterable[Tuple[str, str, datetime, int]]) -> None:
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    rows = [{"metric": m, "bucket": b, "bucket_start": s, "shard": shard, "count": 0} for m, b, s, shard in keys]
+    if rows:
+        db.execute(insert(MetricSketch.__table__).on_conflict_do_nothing(), rows)
+
+def record_values(db: Session, patient_id: int, readings: Sequence[Reading], buckets: Sequence[str] = SKETCH_BUCKETS) -> None:
+    """Adds new readings to the day and month sketches of their metrics; the caller commits.
+
+    Sketches only grow: edits and deletes can't be retracted, so population
+    figures drift slightly from the raw table until the next rebuild (see main).
+    """
+    shard = patient_id % SKETCH_SHARDS
+    values: Dict[tuple, List[float]] = defaultdict(list)
+    for timestamp, reading in readings:
+        for metric in METRICS:
+            if reading.get(metric) is not None:
+                for bucket in buckets:
+                    values[(metric, bucket, bucket_start(timestamp, bucket), shard)].append(reading[metric])
+    if not values:
+        return
+    keys = sorted(values.keys())
+    # Rows must exist before they can be locked; concurrent first writers both succeed
+    _upsert_missing(db, keys)
+    for i in range(0, len(keys), SKETCH_QUERY_CHUNK):
+        chunk = keys[i:i + SKETCH_QUERY_CHUNK]
+        rows = db.query(MetricSketch).filter(
+            MetricSketch.shard == shard,
+            tuple_(MetricSketch.metric, MetricSketch.bucket, MetricSketch.bucket_start).in_([key[:3] for key in chunk]),
+        ).with_for_update().all()
+        for row in rows:
+            added = values[(row.metric, row.bucket, row.bucket_start, row.shard)]
+            digest = TDigest.from_json(row.digest)
+            for value in added:
+                digest.add(value)
+            row.digest = digest.to_json()
+            row.count += len(added)
+
+def covering_buckets(since: datetime, until: datetime) -> List[Tuple[str, datetime]]:
+    """The fewest day and month buckets that exactly cover [since, until) at day granularity."""
+    cursor = bucket_start(since, "day")
+    end = bucket_start(until, "day") + (timedelta(days=1) if until != bucket_start(until, "day") else timedelta(0))
+    buckets = []
+    while cursor < end:
+        month_end = bucket_end(cursor, "month")
+        if cursor.day == 1 and month_end <= end:
+            buckets.append(("month", cursor))
+            cursor = month_end
+        else:
+            buckets.append(("day", cursor))
+            cursor += timedelta(days=1)
+    return buckets
+
+def merged_digest(db: Session, metric: str, since: datetime, until: datetime) -> TDigest:
+    buckets = covering_buckets(since, until)
+    digest = TDigest()
+    if not buckets:
+        return digest
+    rows = db.query(MetricSketch.digest).filter(
+        MetricSketch.metric == metric,
+        tuple_(MetricSketch.bucket, MetricSketch.bucket_start).in_(buckets),
+    )
+    for (raw,) in rows:
+        digest.merge(TDigest.from_json(raw))
+    return digest
+
+def _rebuild_day(db: Session, day: datetime) -> None:
+    # One digest per (metric, shard) across every user's readings, so each row is serialised once
+    digests: Dict[Tuple[str, int], TDigest] = defaultdict(TDigest)
+    counts: Dict[Tuple[str, int], int] = defaultdict(int)
+    rows = db.query(
+        HealthData.patient_id, HealthData.weight, HealthData.systolic, HealthData.diastolic, HealthData.glucose
+    ).filter(HealthData.timestamp >= day, HealthData.timestamp < day + timedelta(days=1))
+    for patient_id, w, s, d, g in rows.yield_per(SKETCH_REBUILD_BATCH_SIZE):
+        for metric, value in reading_values(w, s, d, g).items():
+            if value is not None:
+                key = (metric, patient_id % SKETCH_SHARDS)
+                digests[key].add(value)
+                counts[key] += 1
+    db.query(MetricSketch).filter(MetricSketch.bucket == "day", MetricSketch.bucket_start == day).delete(
+        synchronize_session=False
+    )
+    db.add_all(
+        MetricSketch(metric=metric, bucket="day", bucket_start=day, shard=shard, count=counts[(metric, shard)], digest=digest.to_json())
+        for (metric, shard), digest in digests.items()
+    )
+    db.commit()
+
+def _rebuild_month(db: Session, month: datetime) -> None:
+    # A month's digest is the merge of its days', so it never needs the raw rows
+    in_month = (MetricSketch.bucket_start >= month, MetricSketch.bucket_start < bucket_end(month, "month"))
+    merged: Dict[int, Dict[str, TDigest]] = defaultdict(lambda: defaultdict(TDigest))
+    counts: Dict[Tuple[str, int], int] = defaultdict(int)
+    for row in db.query(MetricSketch).filter(MetricSketch.bucket == "day", *in_month):
+        merged[row.shard][row.metric].merge(TDigest.from_json(row.digest))
+        counts[(row.metric, row.shard)] += row.count
+    db.query(MetricSketch).filter(MetricSketch.bucket == "month", *in_month).delete(synchronize_session=False)
+    db.add_all(
+        MetricSketch(metric=metric, bucket="month", bucket_start=month, shard=shard, count=counts[(metric, shard)], digest=digest.to_json())
+        for shard, metrics in merged.items()
+        for metric, digest in metrics.items()
+    )
+    db.commit()
+
+def rebuild_sketches(db: Session, since: Optional[datetime] = None) -> None:
+    """Recomputes the sketches from the raw table: all of them, or the days from ``since`` on.
+
+    Day sketches before ``since`` are kept as they are; that is where readings
+    moved out by retention live on, since daily summaries don't hold enough to
+    rebuild a distribution. Months are merged back from their days. A full
+    rebuild therefore only belongs on databases retention hasn't touched.
+    Each day, then its month, is replaced and committed on its own.
+    """
+    first_raw, last_raw = db.query(func.min(HealthData.timestamp), func.max(HealthData.timestamp)).one()
+    first_sketch, last_sketch = db.query(
+        func.min(MetricSketch.bucket_start), func.max(MetricSketch.bucket_start)
+    ).filter(MetricSketch.bucket == "day").one()
+    # Days that only have sketches left need clearing too
+    lasts = [value for value in (last_raw, last_sketch) if value is not None]
+    if not lasts:
+        return
+    firsts = [value for value in (first_raw, first_sketch) if value is not None]
+    day = bucket_start(since if since else min(firsts), "day")
+    end = bucket_start(max(lasts), "day") + timedelta(days=1)
+    while day < end:
+        month = bucket_start(day, "month")
+        month_end = min(bucket_end(month, "month"), end)
+        while day < month_end:
+            _rebuild_day(db, day)
+            day += timedelta(days=1)
+        _rebuild_month(db, month)
+
+def rebuild_recent_sketches(db: Session) -> None:
+    # With retention on, everything before the cutoff only survives in the day sketches
+    rebuild_sketches(db, retention_cutoff() if RETENTION_RAW_DAYS > 0 else None)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--since", type=datetime.fromisoformat, help="first day to rebuild (default: the retention cutoff)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    from database import get_engine
+    with Session(bind=get_engine()) as db:
+        if args.since:
+            rebuild_sketches(db, args.since)
+        else:
+            rebuild_recent_sketches(db)
+    logger.info("Rebuilt population sketches")
+
+if __name__ == "__main__":
+    main()
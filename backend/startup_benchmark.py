@@ -0,0 +1,86 @@
+"""Cold-start benchmark: time to import the app and to serve its first request.
+
+    python startup_benchmark.py --runs 10 --output startup.json
+
+Each run is a fresh interpreter, so nothing is cached in sys.modules. The child
+reports how long `import main` took and how long the lifespan startup plus a
+first GET /connection took; the parent adds the wall time of the whole process.
+The database is a migrated SQLite file in a temp directory and the LLM is the
+local stub, so no run touches the network.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmark import git_revision, percentile
+
+CHILD = """
+import asyncio, json, time
+import httpx  # harness only, kept out of the timings
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def first_request():
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/connection")
+            response.raise_for_status()
+
+asyncio.run(first_request())
+done = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "first_request_s": done - imported}))
+"""
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default="startup.json")
+    return parser.parse_args(argv)
+
+def run_once(env: dict) -> dict:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True,
+        cwd=Path(__file__).resolve().parent,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_s"] = time.perf_counter() - started
+    return timings
+
+def summarize(values) -> dict:
+    values = sorted(values)
+    return {
+        "median_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    from database import create_db_engine
+    from migrations import migrate
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{Path(tmp) / 'startup.db'}"
+        engine = create_db_engine(url)
+        migrate(engine)
+        engine.dispose()
+        env = {**os.environ, "DB_URL": url, "LLM_BACKEND": "fake", "DB_MIGRATE_ON_STARTUP": "false"}
+        env.pop("TESTING", None)
+        runs = [run_once(env) for _ in range(args.runs)]
+
+    results = {key: summarize([run[key] for run in runs]) for key in ("import_s", "first_request_s", "process_s")}
+    for key, summary in results.items():
+        print(f"{key:>16}: {json.dumps(summary)}", file=sys.stderr)
+    report = {"meta": {"revision": git_revision(), "runs": args.runs}, "results": results}
+    Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import base64
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import Session
+from database import PeriodicTask
+from models import HealthData, HealthDataTombstone, UserDataVersion
+from retention import load_summary_changes
+
+# Deleted entries stay visible to delta sync for this long
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+TOMBSTONE_COMPACTION_INTERVAL_SECONDS = float(os.getenv("TOMBSTONE_COMPACTION_INTERVAL_SECONDS", "3600"))
+TOMBSTONE_COMPACTION_BATCH_SIZE = int(os.getenv("TOMBSTONE_COMPACTION_BATCH_SIZE", "1000"))
+# Change sets at least this large are gzipped for clients that accept it
+CHANGES_GZIP_MIN_BYTES = int(os.getenv("CHANGES_GZIP_MIN_BYTES", "1024"))
+
+def record_tombstone(db: Session, patient_id: int, entry_id: int, change_seq: int) -> None:
+    db.add(HealthDataTombstone(patient_id=patient_id, entry_id=entry_id, change_seq=change_seq))
+
+# Within one change_seq, summaries sort before entries and entries before deletions
+SUMMARY, ENTRY, DELETED = 0, 1, 2
+# (sync version the snapshot started at, change_seq, SUMMARY/ENTRY/DELETED, id) of the last item sent
+ChangePosition = Tuple[int, int, int, int]
+
+def encode_change_cursor(position: ChangePosition) -> str:
+    raw = "|".join(str(part) for part in position).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_change_cursor(cursor: str) -> ChangePosition:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        as_of, change_seq, kind, item_id = (int(part) for part in base64.urlsafe_b64decode(padded).decode().split("|"))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return as_of, change_seq, kind, item_id
+
+def _after(seq, item_id, kind: int, after: ChangePosition):
+    """Filters one kind of item down to those past ``after`` in (change_seq, kind, id) order."""
+    _, last_seq, last_kind, last_id = after
+    if kind < last_kind:
+        return seq > last_seq
+    if kind > last_kind:
+        return seq >= last_seq
+    return or_(seq > last_seq, and_(seq == last_seq, item_id > last_id))
+
+def load_changes(
+    db: Session, patient_id: int, since: int, columns, fields, limit: int, after: Optional[ChangePosition] = None
+) -> Tuple[dict, Optional[ChangePosition]]:
+    """Rows written and ids deleted after ``since``, one page at a time; ``since=0`` is a full snapshot.
+
+    ``fields`` must be the listing fields followed by updated_at, the shape
+    daily summaries are returned in. Returns the page and the position to
+    continue from, or None on the last page.
+
+    The returned cursor is the highest change_seq covered. Versions are handed
+    out in commit order, so seeing one means every lower one is committed too.
+    Pages are keyed on (change_seq, kind, id), deletions included, so rows
+    written while a client pages move past it and still get sent. A paged
+    response's cursor stays at ``since`` until the last page, which returns the
+    version the first page read; anything newer is sent again with the next delta.
+    """
+    state = db.query(UserDataVersion.version, UserDataVersion.compacted_seq).filter(
+        UserDataVersion.patient_id == patient_id
+    ).first()
+    version, compacted_seq = (state.version, state.compacted_seq or 0) if state else (0, 0)
+    if since and since < compacted_seq:
+        # Deletions after the cursor may have been compacted away
+        raise HTTPException(status_code=410, detail="Sync cursor expired, fetch the full history with since=0")
+
+    # Rows from before change tracking have no change_seq and only appear in full snapshots
+    seq = func.coalesce(HealthData.change_seq, 0)
+    query = select(*columns, seq).where(HealthData.patient_id == patient_id)
+    summaries_after = None
+    if since:
+        query = query.where(HealthData.change_seq > since)
+    if after:
+        _, last_seq, last_kind, last_id = after
+        query = query.where(_after(seq, HealthData.id, ENTRY, after))
+        summaries_after = (last_seq, last_id if last_kind == SUMMARY else None)
+    rows = db.execute(query.order_by(seq, HealthData.id).limit(limit + 1)).all()
+    # Days moved out by retention come back as one summary entry each (negative ids);
+    # their raw rows show up under "deleted"
+    archived = load_summary_changes(db, patient_id, since, summaries_after, limit + 1)
+    tombstones = []
+    if since:
+        # Retention leaves one tombstone per archived row, so deletions are paged too
+        query = select(HealthDataTombstone.change_seq, HealthDataTombstone.entry_id).where(
+            HealthDataTombstone.patient_id == patient_id, HealthDataTombstone.change_seq > since
+        )
+        if after:
+            query = query.where(_after(HealthDataTombstone.change_seq, HealthDataTombstone.entry_id, DELETED, after))
+        tombstones = db.execute(
+            query.order_by(HealthDataTombstone.change_seq, HealthDataTombstone.entry_id).limit(limit + 1)
+        ).all()
+
+    # One extra item from each source tells us whether another page exists
+    items = sorted(
+        [((row[-1], ENTRY, row[0]), row[:-1]) for row in rows]
+        + [((row[-1], SUMMARY, -row[0]), row[:-1]) for row in archived]
+        + [((change_seq, DELETED, entry_id), None) for change_seq, entry_id in tombstones]
+    )
+    page, more = items[:limit], len(items) > limit
+
+    as_of = after[0] if after else version
+    if more:
+        cursor = since
+    elif after:
+        cursor = max(as_of, since)
+    else:
+        cursor = max([version, since] + [key[0] for key, _ in page])
+    return {
+        "cursor": cursor,
+        "changes": [dict(zip(fields, row)) for (_, kind, _), row in page if kind != DELETED],
+        "deleted": [item_id for (_, kind, item_id), _ in page if kind == DELETED],
+    }, (as_of,) + page[-1][0] if more else None
+
+def compact_tombstones(db: Session, now: Optional[datetime] = None, retention_days: float = TOMBSTONE_RETENTION_DAYS) -> int:
+    """Deletes tombstones past the retention window in batches, recording each user's horizon."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    removed = 0
+    while True:
+        batch = db.query(HealthDataTombstone.id, HealthDataTombstone.patient_id, HealthDataTombstone.change_seq).filter(
+            HealthDataTombstone.deleted_at < cutoff
+        ).order_by(HealthDataTombstone.id).limit(TOMBSTONE_COMPACTION_BATCH_SIZE).all()
+        if not batch:
+            return removed
+        horizons: Dict[int, int] = {}
+        for _, patient_id, change_seq in batch:
+            horizons[patient_id] = max(horizons.get(patient_id, 0), change_seq)
+        for patient_id, change_seq in horizons.items():
+            current = func.coalesce(UserDataVersion.compacted_seq, 0)
+            db.query(UserDataVersion).filter(UserDataVersion.patient_id == patient_id).update(
+                {UserDataVersion.compacted_seq: case((current < change_seq, change_seq), else_=current)},
+                synchronize_session=False,
+            )
+        db.query(HealthDataTombstone).filter(HealthDataTombstone.id.in_([row.id for row in batch])).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        removed += len(batch)
+
+tombstone_compaction = PeriodicTask(
+    "Tombstone compaction", compact_tombstones, TOMBSTONE_COMPACTION_INTERVAL_SECONDS, "Compacted %d health data tombstones"
+)
@@ -1,60 +1,52 @@
+import asyncio
+import collections
+import json
+import time
 import pytest
+from contextlib import asynccontextmanager
 from fastapi.testclient import TestClient
 from datetime import datetime
-import openai
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from main import app
-from models import User, HealthData
+from models import Base, User, HealthData, AIInsight
 from database import get_db as real_get_db
+from fake_llm import FakeLLM
 import ai as ai_module  # Import the ai module
+import llm as llm_module
+import security as security_module
+from insights import lookup_insight, store_insight
 
 # Dummy token decoder: always returns a payload with sub=1.
 def dummy_decode_access_token(token: str) -> dict:
     return {"sub": 1}
 
-# Dummy AI response classes.
-class DummyChoice:
-    def __init__(self, content):
-        self.message = {"content": content}
-
-class DummyResponse:
-    def __init__(self, content):
-        self.choices = [DummyChoice(content)]
-
-# Dummy ChatCompletion class to override openai.ChatCompletion.
-class DummyChatCompletion:
-    @staticmethod
-    def create(*args, **kwargs):
-        return DummyResponse(
-            "Aggregated health insights: Overall, the user's metrics have improved with minor fluctuations. "
-            "Continue your current regimen and consider slight adjustments where necessary."
-        )
-
-# Dummy Query and Session to simulate a database response for HealthData.
-class DummyQuery:
-    def __init__(self, entries):
-        self.entries = entries
-    def filter(self, *args, **kwargs):
-        return self
-    def all(self):
-        return self.entries
-
-class DummySession:
-    def query(self, model):
-        if model == HealthData:
-            entry = HealthData(
-                id=1,
-                patient_id=1,
-                weight=150,          # in lbs
-                bp="120/80",         # mmHg
-                glucose=90,          # mg/dL
-                timestamp=datetime(2025, 3, 16, 12, 0, 0)
-            )
-            return DummyQuery([entry])
-        return DummyQuery([])
+DUMMY_INSIGHT = (
+    "Aggregated health insights: Overall, the user's metrics have improved with minor fluctuations. "
+    "Continue your current regimen and consider slight adjustments where necessary."
+)
+
+# In-memory database holding the user's health data.
+engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
 
 def override_get_db():
-    yield DummySession()
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@asynccontextmanager
+async def session_scope_for_tests():
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
 
 # Override the get_current_user dependency so it always returns a dummy user.
 def override_get_current_user_noauth(authorization: str = None, db=None) -> User:
@@ -69,14 +61,33 @@ def override_get_current_user_noauth(authorization: str = None, db=None) -> User
 # Apply dependency overrides.
 app.dependency_overrides[ai_module.get_current_user] = override_get_current_user_noauth
 app.dependency_overrides[real_get_db] = override_get_db
+app.state.session_scope = session_scope_for_tests
 
 # Patch dependencies using monkeypatch.
 @pytest.fixture(autouse=True)
 def patch_dependencies(monkeypatch):
-    # Override openai.ChatCompletion by replacing it with our dummy class.
-    monkeypatch.setattr(openai, "ChatCompletion", DummyChatCompletion)
-    # Patch the token decoder in the ai module.
-    monkeypatch.setattr(ai_module, "decode_access_token", dummy_decode_access_token)
+    fake_llm = FakeLLM(DUMMY_INSIGHT)
+    # Replace the OpenAI client so no request leaves the process.
+    monkeypatch.setattr(llm_module, "_client", fake_llm)
+    # Patch the token decoder used by the shared auth dependency.
+    monkeypatch.setattr(security_module, "decode_access_token", dummy_decode_access_token)
+    session = TestingSessionLocal()
+    session.add(HealthData(
+        id=1,
+        patient_id=1,
+        weight=150,          # in lbs
+        bp="120/80",         # mmHg
+        systolic=120,
+        diastolic=80,
+        glucose=90,          # mg/dL
+        timestamp=datetime(2025, 3, 16, 12, 0, 0)
+    ))
+    session.commit()
+    yield fake_llm
+    session.query(AIInsight).delete()
+    session.query(HealthData).delete()
+    session.commit()
+    session.close()
 
 client = TestClient(app)
 
@@ -88,5 +99,139 @@ def test_ai_insights():
     data = response.json()
     assert "insights" in data
     # Check that the response contains the dummy substring.
-    expected_substring = ""
-    assert expected_substring in data["insights"], f"Expected substring not found. Got: {data['insights']}"
\ No newline at end of file
+    expected_substring = "Aggregated health insights"
+    assert expected_substring in data["insights"], f"Expected substring not found. Got: {data['insights']}"
+
+def test_ai_insights_served_from_cache_until_data_changes(patch_dependencies):
+    headers = {"Authorization": "Bearer dummy"}
+    first = client.post("/ai/", headers=headers, json={})
+    second = client.post("/ai/", headers=headers, json={})
+    assert first.json() == second.json()
+    assert patch_dependencies.calls == 1
+
+    logged = client.post("/healthdata/", headers=headers, json={"weight": 149, "bp": "118/79", "glucose": 88})
+    assert logged.status_code == 200
+    client.post("/ai/", headers=headers, json={})
+    assert patch_dependencies.calls == 2
+
+def read_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_ai_insights_stream_forwards_tokens(patch_dependencies):
+    headers = {"Authorization": "Bearer dummy"}
+    response = client.post("/ai/stream", headers=headers, json={})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = read_events(response)
+    tokens = [data["content"] for event, data in events if event == "token"]
+    assert len(tokens) > 1
+    assert events[-1] == ("done", {"insights": DUMMY_INSIGHT})
+    assert "".join(tokens) == DUMMY_INSIGHT
+    assert patch_dependencies.chat.completions.streams[0].closed
+
+    # The streamed result is stored like a regular one
+    assert client.post("/ai/", headers=headers, json={}).json() == {"insights": DUMMY_INSIGHT}
+    assert patch_dependencies.calls == 1
+
+def test_ai_insights_stream_times_out(monkeypatch):
+    monkeypatch.setattr(llm_module, "_client", FakeLLM(DUMMY_INSIGHT, chunk_delay=0.2))
+    monkeypatch.setattr(llm_module, "AI_STREAM_TIMEOUT_SECONDS", 0.3)
+    response = client.post("/ai/stream", headers={"Authorization": "Bearer dummy"}, json={})
+
+    events = read_events(response)
+    assert events[-1] == ("error", {"detail": "Insight generation timed out"})
+    assert llm_module._client.chat.completions.streams[0].closed
+
+def test_ai_insight_jobs_coalesce_and_long_poll(monkeypatch):
+    fake_llm = FakeLLM(DUMMY_INSIGHT, delay=0.2)
+    monkeypatch.setattr(llm_module, "_client", fake_llm)
+    headers = {"Authorization": "Bearer dummy"}
+    with TestClient(app) as jobs_client:
+        first = jobs_client.post("/ai/jobs", headers=headers, json={})
+        second = jobs_client.post("/ai/jobs", headers=headers, json={})
+        assert first.status_code == 202
+        assert first.json()["job_id"] == second.json()["job_id"]
+        assert first.json()["status"] in ("queued", "running")
+
+        done = jobs_client.get(f"/ai/jobs/{first.json()['job_id']}", headers=headers, params={"wait": 5})
+        assert done.json() == {"job_id": first.json()["job_id"], "status": "succeeded", "result": {"insights": DUMMY_INSIGHT}}
+        assert fake_llm.calls == 1
+
+        # Unchanged data: the stored insight comes straight back, without a job record
+        jobs_before = len(ai_module.insight_jobs.jobs)
+        again = jobs_client.post("/ai/jobs", headers=headers, json={})
+        assert again.status_code == 200
+        assert again.json() == {"status": "succeeded", "result": {"insights": DUMMY_INSIGHT}}
+        assert len(ai_module.insight_jobs.jobs) == jobs_before
+        assert jobs_client.get("/ai/jobs/unknown", headers=headers).status_code == 404
+
+def test_ai_insights_fall_back_to_rules_past_the_budget(monkeypatch, patch_dependencies):
+    monkeypatch.setattr(llm_module, "_client", FakeLLM(DUMMY_INSIGHT, delay=1.0))
+    monkeypatch.setattr(llm_module, "AI_LATENCY_BUDGET_SECONDS", 0.1)
+    headers = {"Authorization": "Bearer dummy"}
+
+    data = client.post("/ai/", headers=headers, json={}).json()
+    assert data["source"] == "rule_based" and data["fallback_reason"] == "timeout"
+    assert data["insights"].startswith("Your recent blood pressure averages 120/80 mmHg, in the stage 1 hypertension range")
+
+    # Fallbacks aren't stored: the next request with a healthy LLM generates a real insight
+    monkeypatch.setattr(llm_module, "_client", patch_dependencies)
+    assert client.post("/ai/", headers=headers, json={}).json() == {"insights": DUMMY_INSIGHT}
+
+def test_ai_insights_errors_never_leak_upstream_text(monkeypatch):
+    monkeypatch.setattr(llm_module, "_client", FakeLLM(DUMMY_INSIGHT, failures=1))
+    response = client.post("/ai/", headers={"Authorization": "Bearer dummy"}, json={})
+    assert response.status_code == 200
+    assert response.json()["fallback_reason"] == "error"
+    assert "Simulated" not in response.text
+
+def test_rule_based_insight_thresholds():
+    from rule_insights import rule_based_insight
+    readings = [
+        (datetime(2025, 3, day), 180 + 2 * day, 145, 92, 130) for day in range(1, 7)
+    ]
+    text = rule_based_insight(readings)
+    assert "stage 2 hypertension" in text
+    assert "diabetes range" in text
+    assert "trending up (about +6.0 lbs)" in text
+    assert rule_based_insight(readings) == text
+
+def test_slow_completion_is_hedged(monkeypatch):
+    class SlowThenFast:
+        def __init__(self):
+            self.delays = [1.0, 0.01]
+            self.chat = self
+            self.completions = self
+
+        async def create(self, **kwargs):
+            await asyncio.sleep(self.delays.pop(0))
+            from types import SimpleNamespace
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="hedged"))], usage=None)
+
+    monkeypatch.setattr(llm_module, "_client", SlowThenFast())
+    monkeypatch.setattr(llm_module, "AI_HEDGE_PERCENTILE", 95)
+    monkeypatch.setattr(llm_module, "_recent_latencies", collections.deque([0.05] * 50))
+
+    started = time.monotonic()
+    assert asyncio.run(llm_module.complete_within("prompt", budget=0.5)) == "hedged"
+    assert time.monotonic() - started < 0.5
+
+def test_blood_pressure_only_edit_invalidates_in_flight_insight():
+    headers = {"Authorization": "Bearer dummy"}
+    session = TestingSessionLocal()
+    try:
+        fingerprint, latest_id, stored = lookup_insight(session, 1)
+        assert stored is None
+        # A BP-only correction lands while the insight for the old data is being generated
+        updated = client.put("/healthdata/1", headers=headers, json={"weight": 150, "bp": "150/95", "glucose": 90})
+        assert updated.status_code == 200
+        store_insight(session, 1, fingerprint, latest_id, DUMMY_INSIGHT)
+        assert lookup_insight(session, 1)[0] != fingerprint
+        assert lookup_insight(session, 1)[2] is None
+    finally:
+        session.close()
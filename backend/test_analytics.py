@@ -0,0 +1,125 @@
+import random
+import numpy as np
+import pytest
+from datetime import datetime
+from fastapi.testclient import TestClient
+from .main import app
+from .models import HealthData, HealthDataAnomaly, HealthMetricStats, MetricSketch
+import security
+from security import get_current_user, Principal
+from sketches import SKETCH_SHARDS, TDigest, covering_buckets, merged_digest, rebuild_sketches
+
+client = TestClient(app)
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(security, "ADMIN_EMAILS", {"test@example.com"})
+
+@pytest.fixture
+def cleanup(db_session):
+    yield
+    for model in (HealthData, HealthDataAnomaly, HealthMetricStats):
+        db_session.query(model).filter(model.patient_id >= 2000).delete()
+    db_session.query(MetricSketch).delete()
+    db_session.commit()
+
+def as_patient(patient_id):
+    app.dependency_overrides[get_current_user] = lambda: Principal(id=patient_id, email=f"p{patient_id}@example.com")
+
+def test_tdigest_quantiles_and_merge():
+    rng = random.Random(3)
+    values = [rng.lognormvariate(4.6, 0.3) for _ in range(20000)]
+    parts = [TDigest() for _ in range(8)]
+    for i, value in enumerate(values):
+        parts[i % 8].add(value)
+    merged = TDigest()
+    for part in parts:
+        merged.merge(TDigest.from_json(part.to_json()))
+
+    assert merged.count == len(values)
+    assert len(merged.centroids) < 200
+    for q in (0.01, 0.5, 0.9, 0.99):
+        exact = np.quantile(values, q)
+        assert abs(merged.quantile(q) - exact) / exact < 0.01
+    assert merged.quantile(0) == min(values) and merged.quantile(1) == max(values)
+
+def test_covering_buckets_prefers_whole_months():
+    buckets = covering_buckets(datetime(2025, 1, 30), datetime(2025, 4, 2, 12))
+    assert buckets == [
+        ("day", datetime(2025, 1, 30)), ("day", datetime(2025, 1, 31)),
+        ("month", datetime(2025, 2, 1)), ("month", datetime(2025, 3, 1)),
+        ("day", datetime(2025, 4, 1)), ("day", datetime(2025, 4, 2)),
+    ]
+
+def test_population_percentiles_and_elevated_bp(admin, cleanup):
+    rng = random.Random(5)
+    glucose = []
+    previous = app.dependency_overrides[get_current_user]
+    try:
+        for patient_id in range(2000, 2010):
+            as_patient(patient_id)
+            high = patient_id % 5 == 0
+            readings = []
+            for day in range(1, 29):
+                value = round(rng.uniform(80, 160), 1)
+                glucose.append(value)
+                bp = f"{rng.randint(140, 150)}/90" if high else f"{rng.randint(110, 118)}/75"
+                readings.append({"weight": 150, "bp": bp, "glucose": value, "timestamp": f"2025-02-{day:02d}T08:00:00"})
+            assert client.post("/healthdata/batch", json=readings).json()["created"] == 28
+    finally:
+        app.dependency_overrides[get_current_user] = previous
+
+    params = {"metric": "glucose", "since": "2025-02-01T00:00:00", "until": "2025-03-01T00:00:00", "q": [0.1, 0.5, 0.9]}
+    result = client.get("/admin/analytics/percentiles", params=params).json()
+    assert result["count"] == len(glucose)
+    for key, q in (("p10", 0.1), ("p50", 0.5), ("p90", 0.9)):
+        assert abs(result["percentiles"][key] - np.quantile(glucose, q)) < 2
+
+    share = client.get("/admin/analytics/blood-pressure").json()
+    assert share["users"] >= 10
+    assert share["elevated"] >= 2
+
+def test_analytics_require_an_admin():
+    assert client.get("/admin/analytics/blood-pressure").status_code == 403
+    assert client.get("/admin/analytics/percentiles", params={"metric": "pulse"}).status_code in (403, 422)
+
+def test_rebuild_drops_edited_and_deleted_values(db_session, cleanup):
+    previous = app.dependency_overrides[get_current_user]
+    try:
+        as_patient(2100)
+        readings = [
+            {"weight": 150, "bp": "120/80", "glucose": 100 + day, "timestamp": f"2025-02-{day:02d}T08:00:00"}
+            for day in range(1, 11)
+        ]
+        ids = [r["data_id"] for r in client.post("/healthdata/batch", json=readings).json()["results"]]
+        client.put(f"/healthdata/{ids[0]}", json={"weight": 150, "bp": "120/80", "glucose": 300})
+        client.delete(f"/healthdata/{ids[1]}")
+    finally:
+        app.dependency_overrides[get_current_user] = previous
+    february = (datetime(2025, 2, 1), datetime(2025, 3, 1))
+
+    # The edit is recorded straight away; the old and deleted values linger until a rebuild
+    digest = merged_digest(db_session, "glucose", *february)
+    assert digest.count == 11 and digest.max == 300
+
+    # Days before ``since`` are kept as they are, and the month is merged back from its days
+    rebuild_sketches(db_session, since=datetime(2025, 2, 5))
+    assert merged_digest(db_session, "glucose", *february).count == 11
+    assert merged_digest(db_session, "glucose", datetime(2025, 2, 5), datetime(2025, 2, 11)).count == 6
+
+    rebuild_sketches(db_session)
+    digest = merged_digest(db_session, "glucose", *february)
+    assert digest.count == 9 and digest.min == 103 and digest.max == 300
+
+def test_rebuild_writes_one_row_per_shard_across_users(db_session, cleanup):
+    # Two users on the same shard share each (metric, day, shard) row
+    for patient_id in (2200, 2200 + SKETCH_SHARDS):
+        db_session.add(HealthData(patient_id=patient_id, weight=150, bp="120/80", systolic=120, diastolic=80, glucose=95,
+                                  timestamp=datetime(2025, 4, 2, 8)))
+    db_session.commit()
+    rebuild_sketches(db_session)
+
+    days = db_session.query(MetricSketch).filter(MetricSketch.bucket == "day", MetricSketch.metric == "glucose").all()
+    assert [(row.bucket_start, row.shard, row.count) for row in days] == [(datetime(2025, 4, 2), 2200 % SKETCH_SHARDS, 2)]
+    month = db_session.query(MetricSketch).filter(MetricSketch.bucket == "month", MetricSketch.metric == "glucose").one()
+    assert month.bucket_start == datetime(2025, 4, 1) and month.count == 2
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from .main import app
+from .models import Base, HealthData
+from database import get_db, stream_partitions, to_async_url
+
+def test_to_async_url():
+    assert to_async_url("sqlite:///./nexus_lite.db") == "sqlite+aiosqlite:///./nexus_lite.db"
+    assert to_async_url("postgresql+psycopg2://u:p@db/nexus") == "postgresql+asyncpg://u:p@db/nexus"
+
+@pytest.fixture
+def async_db(tmp_path):
+    path = tmp_path / "async.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=sync_engine)
+    sync_engine.dispose()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def _override_get_db():
+        async with factory() as session:
+            yield session
+
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = _override_get_db
+    with TestClient(app) as client:
+        yield client
+    app.dependency_overrides[get_db] = previous
+
+def test_routes_run_on_async_session(async_db, patient_id):
+    client = async_db
+    assert client.post("/auth/register", json={"email": "async@example.com", "password": "pass123", "firstName": "A", "lastName": "Sync"}).status_code == 200
+    assert client.post("/auth/login", json={"email": "async@example.com", "password": "pass123"}).status_code == 200
+
+    created = client.post("/healthdata/", json={"weight": 150, "bp": "120/80", "glucose": 90})
+    assert created.status_code == 200, created.text
+    entry_id = created.json()["data_id"]
+
+    updated = client.put(f"/healthdata/{entry_id}", json={"weight": 149, "bp": "118/78", "glucose": 88})
+    assert updated.status_code == 200
+    assert updated.json()["bp"] == "118/78"
+
+    listed = client.get("/healthdata/")
+    assert [item["id"] for item in listed.json()] == [entry_id]
+
+    assert client.delete(f"/healthdata/{entry_id}").status_code == 200
+    assert client.get("/healthdata/").json() == []
+
+def test_stream_partitions_on_async_session(tmp_path):
+    path = tmp_path / "stream.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=sync_engine)
+    with sync_engine.begin() as conn:
+        conn.execute(HealthData.__table__.insert(), [{"patient_id": 1, "weight": 150 + i} for i in range(7)])
+    sync_engine.dispose()
+
+    async def collect():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with async_sessionmaker(engine)() as session:
+            sizes = [len(part) async for part in stream_partitions(session, select(HealthData.id), 3)]
+        await engine.dispose()
+        return sizes
+
+    assert asyncio.run(collect()) == [3, 3, 1]
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+import batch_insights
+import llm
+from batch_insights import Checkpoint, TokenBucket, run_batch
+from fake_llm import FakeLLM
+from insights import data_fingerprint, store_insight
+from migrations import migrate
+from models import AIInsight, HealthData
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'batch.db'}")
+    migrate(engine)
+    with Session(bind=engine) as session:
+        for patient_id in range(1, 7):
+            session.add_all([
+                HealthData(patient_id=patient_id, weight=150 + i, bp="120/80", systolic=120, diastolic=80, glucose=90,
+                           timestamp=datetime(2025, 3, 1) + timedelta(days=i))
+                for i in range(3)
+            ])
+        session.commit()
+        # User 3's insight is current, so the batch leaves them alone
+        fingerprint, latest_id = data_fingerprint(session, 3)
+        store_insight(session, 3, fingerprint, latest_id, "existing")
+    monkeypatch.setattr(batch_insights, "backoff_delay", lambda attempt: 0)
+    yield engine
+    engine.dispose()
+
+def scope_for(engine):
+    @asynccontextmanager
+    async def session_scope(read_only: bool = False):
+        with Session(bind=engine) as session:
+            yield session
+    return session_scope
+
+def stored_insights(engine) -> dict:
+    with Session(bind=engine) as session:
+        return dict(session.query(AIInsight.patient_id, AIInsight.insight).all())
+
+def test_batch_generates_missing_insights_with_retries(engine, monkeypatch):
+    fake = FakeLLM("batched", failures=2)
+    monkeypatch.setattr(llm, "_client", fake)
+
+    result = asyncio.run(run_batch(scope_for(engine), concurrency=3, retries=3))
+
+    assert result == {"generated": 5, "failed": 0, "skipped": 0, "cursor": 6}
+    assert fake.calls == 7
+    assert stored_insights(engine) == {1: "batched", 2: "batched", 3: "existing", 4: "batched", 5: "batched", 6: "batched"}
+    # Nothing left to do on the next night
+    assert asyncio.run(run_batch(scope_for(engine)))["generated"] == 0
+
+def test_batch_resumes_from_checkpoint(engine, monkeypatch, tmp_path):
+    fake = FakeLLM("batched")
+    monkeypatch.setattr(llm, "_client", fake)
+    path = tmp_path / "checkpoint.json"
+
+    first = asyncio.run(run_batch(scope_for(engine), checkpoint=Checkpoint(path), limit=2))
+    assert first["generated"] == 2
+    assert json.loads(path.read_text()) == {"cursor": 2, "failed": []}
+
+    checkpoint = Checkpoint(path)
+    checkpoint.load()
+    second = asyncio.run(run_batch(scope_for(engine), checkpoint=checkpoint))
+    assert second["generated"] == 3
+    assert fake.calls == 5
+    assert set(stored_insights(engine)) == {1, 2, 3, 4, 5, 6}
+
+def test_batch_records_users_that_keep_failing(engine, monkeypatch, tmp_path):
+    monkeypatch.setattr(llm, "_client", FakeLLM("batched", failures=100))
+    path = tmp_path / "checkpoint.json"
+
+    result = asyncio.run(run_batch(scope_for(engine), concurrency=2, retries=1, checkpoint=Checkpoint(path)))
+
+    assert result["failed"] == 5 and result["generated"] == 0
+    assert json.loads(path.read_text()) == {"cursor": 6, "failed": [1, 2, 4, 5, 6]}
+    assert stored_insights(engine) == {3: "existing"}
+
+def test_token_bucket_paces_after_the_burst():
+    bucket = TokenBucket(rate=50, capacity=2)
+
+    async def take(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    start = time.monotonic()
+    asyncio.run(take(4))
+    # Two tokens are available at once, the other two refill at 50/s
+    assert 0.03 <= time.monotonic() - start < 0.5
@@ -0,0 +1,51 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent
+
+def run_benchmark(tmp_path, output, *extra, db_async="false"):
+    env = {**os.environ, "BCRYPT_ROUNDS": "4", "PASSWORD_HASH_EXECUTOR": "thread", "DB_ASYNC": db_async}
+    # The harness has to work with the app's own defaults, not the test suite's
+    for name in ("TESTING", "RATE_LIMIT_ENABLED"):
+        env.pop(name, None)
+    return subprocess.run(
+        [sys.executable, "benchmark.py", "--users", "2", "--readings", "5", "--requests", "2", "--warmup", "0",
+         "--concurrency", "1", "--cache-dir", str(tmp_path), "--output", str(output), *extra],
+        env=env, cwd=BACKEND, capture_output=True, text=True, check=True, timeout=120,
+    )
+
+def test_benchmark_smoke_run(tmp_path):
+    output = tmp_path / "bench.json"
+    run_benchmark(tmp_path, output)
+
+    report = json.loads(output.read_text())
+    results = report["results"]
+    assert set(results) == {"register", "login", "ingest", "list", "stats", "update", "delete", "ai"}
+    assert all(result["requests"] == 2 and result["errors"] == 0 for result in results.values())
+    assert report["meta"]["db_async"] is False and report["meta"]["db_backend"] == "sqlite"
+
+    # The seed looks like a database the app wrote, derived tables included
+    seeded = next(tmp_path.glob("seed-*.db"))
+    with sqlite3.connect(seeded) as conn:
+        def count(sql):
+            return conn.execute(sql).fetchone()[0]
+        assert count("SELECT COUNT(*) FROM health_data WHERE change_seq IS NULL") == 0
+        assert count("SELECT COUNT(*) FROM user_data_versions") == 2
+        assert count("SELECT SUM(count) FROM health_metric_stats WHERE metric = 'weight'") == 10
+        assert count("SELECT SUM(count) FROM health_data_rollups WHERE bucket = 'month'") == 10
+        assert count("SELECT SUM(count) FROM metric_sketches WHERE metric = 'glucose' AND bucket = 'day'") == 10
+
+def test_benchmark_async_run_compares_against_sync(tmp_path):
+    baseline = tmp_path / "sync.json"
+    run_benchmark(tmp_path, baseline, "--scenarios", "update,delete")
+    output = tmp_path / "async.json"
+    compared = run_benchmark(tmp_path, output, "--scenarios", "update,delete", "--compare", str(baseline), db_async="true")
+
+    report = json.loads(output.read_text())
+    assert all(result["errors"] == 0 for result in report["results"].values())
+    assert report["meta"]["db_async"] is True and report["meta"]["db_driver"] == "aiosqlite"
+    assert "sqlite+pysqlite (sync" in compared.stdout and "sqlite+aiosqlite (async" in compared.stdout
@@ -0,0 +1,75 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from .main import app
+import database
+from database import create_db_engine, engine_options, get_db, session_scope
+from migrations import migrate
+from models import HealthData, HealthDataRollup
+
+def test_sqlite_profile_sets_pragmas_on_connect(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'profile.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_BUSY_TIMEOUT_MS
+    engine.dispose()
+
+def test_postgres_profile_configures_pool():
+    options = engine_options("postgresql+psycopg2://u:p@db/nexus")
+    assert options["pool_pre_ping"] is True
+    assert options["pool_size"] == database.DB_POOL_SIZE
+    assert options["max_overflow"] == database.DB_MAX_OVERFLOW
+    assert options["pool_recycle"] == database.DB_POOL_RECYCLE
+    assert engine_options("postgresql://u:p@db/nexus", profile="default") == {}
+
+def test_read_only_scope_uses_replica_sessions(monkeypatch):
+    class ReplicaSession:
+        def close(self):
+            pass
+
+    monkeypatch.setattr(database, "DB_ASYNC", False)
+    monkeypatch.setitem(database._sessionmakers, (False, True), ReplicaSession)
+
+    async def open_scope(read_only):
+        async with session_scope(read_only=read_only) as session:
+            return session
+
+    assert isinstance(asyncio.run(open_scope(True)), ReplicaSession)
+    assert not isinstance(asyncio.run(open_scope(False)), ReplicaSession)
+
+def test_concurrent_writers_on_file_sqlite(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'concurrent.db'}")
+    migrate(engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def _override_get_db():
+        session = Session()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = _override_get_db
+    client = TestClient(app)
+
+    def write(i):
+        return client.post("/healthdata/", json={"weight": 150 + i % 10, "bp": "120/80", "glucose": 90}).status_code
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            statuses = list(pool.map(write, range(80)))
+        listed = client.get("/healthdata/", params={"limit": 1000})
+    finally:
+        app.dependency_overrides[get_db] = previous
+
+    assert statuses == [200] * 80
+    assert len(listed.json()) == 80
+    with Session() as session:
+        assert session.query(HealthData).count() == 80
+        days = session.query(HealthDataRollup).filter_by(bucket="day").all()
+        assert sum(day.count for day in days) == 80
+    engine.dispose()
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+import pytest
+from health_summary import build_prompt_body, estimate_tokens, summarize
+
+START = datetime(2025, 1, 1, 8, 0, 0)
+
+def make_history(days):
+    return [
+        (START + timedelta(days=i), 200 - 0.5 * i, 120 + i % 5, 80 - i % 3, 95.0)
+        for i in range(days)
+    ]
+
+def test_summary_statistics():
+    readings = make_history(28) + [(START + timedelta(days=28), 186.0, 200, 120, 300.0)]
+    metrics = summarize(readings)["metrics"]
+
+    assert metrics["weight"]["slope_per_week"] == pytest.approx(-3.5, abs=0.1)
+    assert metrics["systolic"]["max"] == 200 and metrics["diastolic"]["max"] == 120
+    assert metrics["glucose"]["outliers"] == 1
+    assert metrics["weight"]["count"] == 29
+    assert metrics["weight"]["weekly_means"][0][0] == 0
+
+def test_prompt_body_stays_within_budget_for_any_history():
+    small = build_prompt_body(make_history(3), token_budget=400)
+    large = build_prompt_body(make_history(5000), token_budget=400)
+    assert "Most recent readings" in small
+    assert estimate_tokens(large) <= 400
+    assert "Readings: 5000" in large
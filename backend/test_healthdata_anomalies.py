@@ -0,0 +1,136 @@
+import random
+import statistics
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from .main import app
+from .models import HealthDataAnomaly, HealthMetricStats
+
+client = TestClient(app)
+
+def history(days=6):
+    start = datetime(2025, 3, 1, 8)
+    return [
+        {"weight": 150 + i % 2, "bp": f"{120 + i % 3}/80", "glucose": 95 + i % 4,
+         "timestamp": (start + timedelta(days=i)).isoformat()}
+        for i in range(days)
+    ]
+
+def cleanup(db_session, patient_id):
+    for model in (HealthDataAnomaly, HealthMetricStats):
+        db_session.query(model).filter(model.patient_id == patient_id).delete()
+    db_session.commit()
+
+def test_spike_is_flagged_on_write(db_session, patient_id):
+    batch = client.post("/healthdata/batch", json=history()).json()
+    assert batch["anomalies"] == []
+
+    logged = client.post("/healthdata/", json={"weight": 175, "bp": "121/80", "glucose": 96}).json()
+    weight_flags = {a["kind"]: a for a in logged["anomalies"] if a["metric"] == "weight"}
+    assert weight_flags["zscore"]["score"] > 3 and weight_flags["zscore"]["expected"] == 150.5
+    # The previous reading is days old, outside the default rate window
+    assert "rate_of_change" not in weight_flags
+    assert all(a["metric"] == "weight" for a in logged["anomalies"])
+
+    result = client.get("/healthdata/anomalies").json()
+    assert [(a["entry_id"], a["metric"], a["kind"]) for a in result["anomalies"]] == [(logged["data_id"], "weight", "zscore")]
+    assert result["baselines"]["weight"]["count"] == 7
+    assert result["baselines"]["weight"]["last_value"] == 175
+
+    # Correcting the typo retracts the reading and its flag
+    client.put(f"/healthdata/{logged['data_id']}", json={"weight": 151, "bp": "121/80", "glucose": 96})
+    result = client.get("/healthdata/anomalies").json()
+    assert result["anomalies"] == []
+    assert result["baselines"]["weight"]["count"] == 7 and result["baselines"]["weight"]["last_value"] == 151
+    cleanup(db_session, patient_id)
+
+def test_sudden_change_between_close_readings(db_session, patient_id):
+    client.post("/healthdata/batch", json=[
+        {"weight": 150, "bp": "120/80", "glucose": 95, "timestamp": "2025-03-01T08:00:00"},
+        {"weight": 151, "bp": "158/80", "glucose": 96, "timestamp": "2025-03-01T20:00:00"},
+    ])
+    flags = client.get("/healthdata/anomalies").json()["anomalies"]
+    assert [(a["metric"], a["kind"], a["expected"], a["score"]) for a in flags] == [("systolic", "rate_of_change", 120.0, 1.27)]
+
+    # Deleting the flagged reading drops the flag and makes the earlier one the baseline again
+    client.delete(f"/healthdata/{flags[0]['entry_id']}")
+    result = client.get("/healthdata/anomalies").json()
+    assert result["anomalies"] == []
+    assert result["baselines"]["systolic"] == {
+        "count": 1, "mean": 120.0, "std": None, "ewma": 120.0, "last_value": 120.0, "last_timestamp": "2025-03-01T08:00:00",
+    }
+    cleanup(db_session, patient_id)
+
+def test_running_stats_match_a_full_recompute(db_session, patient_id):
+    rng = random.Random(7)
+    readings = [
+        {"weight": round(rng.uniform(140, 160), 2), "bp": "120/80", "glucose": round(rng.uniform(80, 120), 2),
+         "timestamp": (datetime(2025, 1, 1) + timedelta(hours=rng.randint(0, 2000))).isoformat()}
+        for _ in range(40)
+    ]
+    ids = [r["data_id"] for r in client.post("/healthdata/batch", json=readings).json()["results"]]
+    for data_id in ids[:10]:
+        client.delete(f"/healthdata/{data_id}")
+    for data_id in ids[10:15]:
+        client.put(f"/healthdata/{data_id}", json={"weight": 155, "bp": "120/80", "glucose": 100})
+
+    weights = [r["weight"] for r in readings[15:]] + [155] * 5
+    stats = db_session.query(HealthMetricStats).filter_by(patient_id=patient_id, metric="weight").one()
+    assert stats.count == len(weights)
+    assert abs(stats.mean - statistics.mean(weights)) < 1e-9
+    assert abs(stats.m2 / (stats.count - 1) - statistics.variance(weights)) < 1e-6
+    cleanup(db_session, patient_id)
+
+def test_correcting_into_an_outlier_reports_it(db_session, patient_id):
+    client.post("/healthdata/batch", json=history())
+    logged = client.post("/healthdata/", json={"weight": 151, "bp": "121/80", "glucose": 96}).json()
+    assert logged["anomalies"] == []
+
+    updated = client.put(f"/healthdata/{logged['data_id']}", json={"weight": 175, "bp": "121/80", "glucose": 96}).json()
+    assert updated["weight"] == 175
+    assert [(a["entry_id"], a["metric"], a["kind"]) for a in updated["anomalies"]] == [(logged["data_id"], "weight", "zscore")]
+    cleanup(db_session, patient_id)
+
+def test_edits_take_the_write_lock_before_touching_stats(db_session, patient_id, monkeypatch):
+    import healthdata
+    calls = []
+    for name in ("bump_data_version", "retract", "invalidate_insights"):
+        original = getattr(healthdata, name)
+        monkeypatch.setattr(healthdata, name, lambda *args, _name=name, _original=original: calls.append(_name) or _original(*args))
+
+    data_id = client.post("/healthdata/", json={"weight": 150, "bp": "120/80", "glucose": 95}).json()["data_id"]
+    calls.clear()
+    client.put(f"/healthdata/{data_id}", json={"weight": 151, "bp": "120/80", "glucose": 95})
+    assert calls[0] == "bump_data_version" and "retract" in calls
+    calls.clear()
+    client.delete(f"/healthdata/{data_id}")
+    assert calls[0] == "bump_data_version" and "retract" in calls
+    cleanup(db_session, patient_id)
+
+def test_rebuilds_stream_history_in_batches(db_session, patient_id, monkeypatch):
+    import anomalies
+    import rollups
+    monkeypatch.setattr(anomalies, "REBUILD_BATCH_SIZE", 4)
+    monkeypatch.setattr(rollups, "REBUILD_BATCH_SIZE", 4)
+    client.post("/healthdata/batch", json=history(days=10))
+    baselines = client.get("/healthdata/anomalies").json()["baselines"]
+    days = client.get("/healthdata/stats", params={"bucket": "day"}).json()
+
+    anomalies.rebuild_patient_stats(db_session, patient_id)
+    rollups.rebuild_patient(db_session, patient_id)
+    db_session.commit()
+    assert client.get("/healthdata/anomalies").json()["baselines"] == baselines
+    assert client.get("/healthdata/stats", params={"bucket": "day"}).json() == days
+    cleanup(db_session, patient_id)
+
+def test_repeated_corrections_dont_pile_up_in_the_ewma(db_session, patient_id):
+    client.post("/healthdata/batch", json=history())
+    logged = client.post("/healthdata/", json={"weight": 151, "bp": "121/80", "glucose": 96}).json()
+    for weight in (190, 110, 190, 110):
+        client.put(f"/healthdata/{logged['data_id']}", json={"weight": weight, "bp": "121/80", "glucose": 96})
+    client.put(f"/healthdata/{logged['data_id']}", json={"weight": 151, "bp": "121/80", "glucose": 96})
+
+    stats = db_session.query(HealthMetricStats).filter_by(patient_id=patient_id, metric="weight").one()
+    # Seeded from the previous reading (151 on the 6th day of history), then the corrected 151 folded in
+    assert stats.ewma == 151
+    assert stats.last_value == 151
+    cleanup(db_session, patient_id)
@@ -0,0 +1,48 @@
+import json
+from fastapi.testclient import TestClient
+from .main import app
+from .models import HealthData
+
+client = TestClient(app)
+
+def test_batch_json_array_reports_per_item_results(db_session, patient_id):
+    payload = [
+        {"weight": 150, "bp": "120/80", "glucose": 90, "timestamp": "2025-02-01T07:30:00"},
+        {"weight": -1, "bp": "120/80", "glucose": 90},
+        {"weight": 151, "bp": "118/79", "glucose": 92},
+    ]
+    response = client.post("/healthdata/batch", json=payload)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["created"] == 2 and data["failed"] == 1
+    assert [r["status"] for r in data["results"]] == ["created", "error", "created"]
+    assert data["results"][1]["errors"][0]["field"] == "weight"
+
+    backfilled = db_session.get(HealthData, data["results"][0]["data_id"])
+    assert backfilled.timestamp.isoformat() == "2025-02-01T07:30:00"
+
+def test_batch_ndjson_stream(db_session, patient_id):
+    lines = [
+        json.dumps({"weight": 150, "bp": "120/80", "glucose": 90}),
+        "{not json",
+        json.dumps({"weight": 152, "bp": "121/81", "glucose": 95}),
+    ]
+    response = client.post(
+        "/healthdata/batch",
+        content="\n".join(lines),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["created"] == 2
+    assert data["results"][1]["status"] == "error"
+    assert db_session.query(HealthData).filter(HealthData.patient_id == patient_id).count() == 2
+
+def test_batch_rejects_non_array_body(patient_id):
+    response = client.post("/healthdata/batch", json={"weight": 150})
+    assert response.status_code == 400
+
+def test_batch_rejects_invalid_utf8(patient_id):
+    for content_type in ("application/x-ndjson", "application/json"):
+        response = client.post("/healthdata/batch", content=b'{"weight": 150}\n\xff\xfe', headers={"Content-Type": content_type})
+        assert response.status_code == 400, content_type
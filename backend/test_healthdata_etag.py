@@ -0,0 +1,52 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from .main import app
+from .conftest import engine
+
+client = TestClient(app)
+
+def reading(weight):
+    return {"weight": weight, "bp": "120/80", "glucose": 90}
+
+def test_conditional_get_skips_health_data_query(patient_id):
+    client.post("/healthdata/", json=reading(150))
+    first = client.get("/healthdata/")
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and etag.startswith('"')
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        cached = client.get("/healthdata/", headers={"If-None-Match": etag})
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+    assert not any("health_data" in statement for statement in statements)
+    assert client.get("/healthdata/", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+def test_writes_change_the_etag(patient_id):
+    created = client.post("/healthdata/", json=reading(150)).json()["data_id"]
+    etags = [client.get("/healthdata/").headers["etag"]]
+
+    client.put(f"/healthdata/{created}", json=reading(151))
+    etags.append(client.get("/healthdata/").headers["etag"])
+    client.post("/healthdata/batch", json=[reading(152)])
+    etags.append(client.get("/healthdata/").headers["etag"])
+    client.delete(f"/healthdata/{created}")
+    etags.append(client.get("/healthdata/").headers["etag"])
+
+    assert len(set(etags)) == 4
+    refreshed = client.get("/healthdata/", headers={"If-None-Match": etags[0]})
+    assert refreshed.status_code == 200
+    assert [item["weight"] for item in refreshed.json()] == [152]
+
+def test_etag_differs_per_query_and_route(patient_id):
+    client.post("/healthdata/", json=reading(150))
+    listed = client.get("/healthdata/").headers["etag"]
+    paged = client.get("/healthdata/", params={"limit": 1}).headers["etag"]
+    stats = client.get("/healthdata/stats")
+    assert len({listed, paged, stats.headers["etag"]}) == 3
+    assert client.get("/healthdata/stats", headers={"If-None-Match": stats.headers["etag"]}).status_code == 304
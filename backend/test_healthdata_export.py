@@ -0,0 +1,51 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from .main import app
+from .models import HealthData
+import healthdata
+
+client = TestClient(app)
+
+@pytest.fixture
+def history(db_session, patient_id, monkeypatch):
+    # Several cursor batches even for a short history
+    monkeypatch.setattr(healthdata, "EXPORT_BATCH_SIZE", 3)
+    start = datetime(2025, 1, 1, 8, 0, 0)
+    db_session.add_all([
+        HealthData(patient_id=patient_id, weight=150 + i, bp="120/80", systolic=120, diastolic=80, glucose=90,
+                   timestamp=start + timedelta(days=i))
+        for i in range(10)
+    ])
+    db_session.commit()
+    return start
+
+def test_export_csv_streams_whole_history(history):
+    response = client.get("/healthdata/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "attachment" in response.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [float(row["weight"]) for row in rows] == [150.0 + i for i in range(10)]
+    assert rows[0]["bp"] == "120/80" and rows[0]["timestamp"] == "2025-01-01T08:00:00"
+
+def test_export_ndjson_with_time_range(history):
+    response = client.get("/healthdata/export", params={
+        "format": "ndjson", "since": (history + timedelta(days=2)).isoformat(), "until": (history + timedelta(days=5)).isoformat(),
+    })
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["weight"] for line in lines] == [152.0, 153.0, 154.0]
+    assert set(lines[0]) == {"id", "weight", "bp", "systolic", "diastolic", "glucose", "timestamp"}
+
+def test_export_gzip(history):
+    response = client.get("/healthdata/export", params={"format": "ndjson", "gzip": "true"})
+    assert response.headers["content-type"] == "application/gzip"
+    assert response.headers["content-disposition"].endswith('.ndjson.gz"')
+    assert len(gzip.decompress(response.content).splitlines()) == 10
+
+def test_export_rejects_unknown_format(patient_id):
+    assert client.get("/healthdata/export", params={"format": "xml"}).status_code == 422
@@ -0,0 +1,71 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from .main import app
+from .models import HealthData
+from healthdata import NEXT_CURSOR_HEADER, HealthDataResponse
+
+client = TestClient(app)
+
+@pytest.fixture
+def history(db_session, patient_id):
+    start = datetime(2025, 1, 1, 8, 0, 0)
+    db_session.add_all([
+        HealthData(patient_id=patient_id, weight=150 + i, bp="120/80", glucose=90, timestamp=start + timedelta(days=i))
+        for i in range(7)
+    ])
+    db_session.commit()
+    return start
+
+def test_pages_follow_cursor_newest_first(history):
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 3}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/healthdata/", params=params)
+        assert response.status_code == 200, response.text
+        seen.extend(item["weight"] for item in response.json())
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            break
+    assert seen == [156, 155, 154, 153, 152, 151, 150]
+
+def test_since_until_filter(history):
+    response = client.get("/healthdata/", params={
+        "since": (history + timedelta(days=2)).isoformat(),
+        "until": (history + timedelta(days=4)).isoformat(),
+    })
+    assert response.status_code == 200
+    assert [item["weight"] for item in response.json()] == [153, 152]
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+def test_offset_bounds_are_compared_in_utc(history):
+    # 10:00+02:00 is 08:00 UTC, the stored time of the third reading
+    response = client.get("/healthdata/", params={
+        "since": (history + timedelta(days=2, hours=2)).isoformat() + "+02:00",
+        "until": (history + timedelta(days=4, hours=2)).isoformat() + "+02:00",
+    })
+    assert response.status_code == 200
+    assert [item["weight"] for item in response.json()] == [153, 152]
+
+def test_invalid_cursor_rejected(history):
+    response = client.get("/healthdata/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_list_wire_format_matches_response_model(db_session, patient_id):
+    db_session.add_all([
+        HealthData(patient_id=patient_id, weight=150.25, bp="120/80", systolic=120, diastolic=80, glucose=90,
+                   timestamp=datetime(2025, 1, 1, 8, 0, 0, 123456)),
+        HealthData(patient_id=patient_id, weight=151, bp="121/81", glucose=91.5, timestamp=datetime(2025, 1, 2, 8, 0, 0)),
+    ])
+    db_session.commit()
+    entries = db_session.query(HealthData).filter(HealthData.patient_id == patient_id).order_by(HealthData.timestamp.desc())
+    expected = [HealthDataResponse.model_validate(entry, from_attributes=True).model_dump(mode="json") for entry in entries]
+
+    response = client.get("/healthdata/")
+    assert response.headers["content-type"] == "application/json"
+    # Byte for byte what the validated, stdlib-encoded response used to be
+    assert response.text == json.dumps(expected, ensure_ascii=False, separators=(",", ":"))
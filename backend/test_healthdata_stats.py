@@ -0,0 +1,49 @@
+from fastapi.testclient import TestClient
+from .main import app
+from .models import HealthDataRollup
+
+client = TestClient(app)
+
+def readings():
+    return [
+        {"weight": 150, "bp": "120/80", "glucose": 90, "timestamp": "2025-03-03T08:00:00"},
+        {"weight": 154, "bp": "130/85", "glucose": 110, "timestamp": "2025-03-03T20:00:00"},
+        {"weight": 152, "bp": "125/82", "glucose": 100, "timestamp": "2025-03-05T08:00:00"},
+        {"weight": 149, "bp": "118/78", "glucose": 95, "timestamp": "2025-04-01T08:00:00"},
+    ]
+
+def test_stats_per_bucket_from_rollups(patient_id):
+    assert client.post("/healthdata/batch", json=readings()).json()["created"] == 4
+
+    days = client.get("/healthdata/stats", params={"bucket": "day", "since": "2025-03-01T00:00:00"}).json()
+    assert [d["bucket_start"] for d in days] == ["2025-03-03T00:00:00", "2025-03-05T00:00:00", "2025-04-01T00:00:00"]
+    assert days[0]["count"] == 2
+    assert days[0]["weight"] == {"count": 2, "mean": 152.0, "min": 150.0, "max": 154.0}
+    assert days[0]["systolic"]["max"] == 130 and days[0]["diastolic"]["min"] == 80
+
+    weeks = client.get("/healthdata/stats", params={"bucket": "week"}).json()
+    assert weeks[0]["bucket_start"] == "2025-03-03T00:00:00" and weeks[0]["count"] == 3
+
+    months = client.get("/healthdata/stats", params={"bucket": "month"}).json()
+    assert [m["count"] for m in months] == [3, 1]
+    assert months[0]["glucose"]["mean"] == 100.0
+
+    assert client.get("/healthdata/stats", params={"bucket": "year"}).status_code == 422
+
+def test_updates_and_deletes_keep_rollups_exact(db_session, patient_id):
+    ids = [r["data_id"] for r in client.post("/healthdata/batch", json=readings()).json()["results"]]
+
+    # Lowering the bucket maximum forces that bucket to be recomputed
+    client.put(f"/healthdata/{ids[1]}", json={"weight": 151, "bp": "121/81", "glucose": 91})
+    march = client.get("/healthdata/stats", params={"bucket": "month"}).json()[0]
+    assert march["weight"] == {"count": 3, "mean": 151.0, "min": 150.0, "max": 152.0}
+    assert march["systolic"]["max"] == 125
+
+    client.delete(f"/healthdata/{ids[2]}")
+    march = client.get("/healthdata/stats", params={"bucket": "month"}).json()[0]
+    assert march["count"] == 2 and march["weight"]["max"] == 151
+
+    client.delete(f"/healthdata/{ids[3]}")
+    assert len(client.get("/healthdata/stats", params={"bucket": "month"}).json()) == 1
+    db_session.query(HealthDataRollup).filter(HealthDataRollup.patient_id == patient_id).delete()
+    db_session.commit()
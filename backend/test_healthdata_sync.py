@@ -0,0 +1,116 @@
+import asyncio
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from .main import app
+from database import PeriodicTask
+from sync import compact_tombstones
+
+client = TestClient(app)
+
+def reading(weight):
+    return {"weight": weight, "bp": "120/80", "glucose": 90}
+
+def changes(since, **headers):
+    return client.get("/healthdata/changes", params={"since": since}, headers=headers)
+
+def page(since, cursor=None, limit=2):
+    params = {"since": since, "limit": limit, **({"cursor": cursor} if cursor else {})}
+    return client.get("/healthdata/changes", params=params)
+
+def test_delta_sync_returns_only_changes_after_cursor(patient_id):
+    kept = client.post("/healthdata/", json=reading(150)).json()["data_id"]
+    dropped = client.post("/healthdata/", json=reading(151)).json()["data_id"]
+    full = changes(0).json()
+    assert [entry["id"] for entry in full["changes"]] == [kept, dropped]
+    assert full["deleted"] == []
+
+    client.put(f"/healthdata/{kept}", json=reading(149))
+    client.delete(f"/healthdata/{dropped}")
+    added = client.post("/healthdata/", json=reading(152)).json()["data_id"]
+
+    delta = changes(full["cursor"]).json()
+    assert [(entry["id"], entry["weight"]) for entry in delta["changes"]] == [(kept, 149.0), (added, 152.0)]
+    assert delta["deleted"] == [dropped]
+    assert delta["cursor"] > full["cursor"]
+    assert set(delta["changes"][0]) == {"id", "weight", "bp", "systolic", "diastolic", "glucose", "timestamp", "updated_at"}
+
+    assert changes(delta["cursor"]).json() == {"cursor": delta["cursor"], "changes": [], "deleted": []}
+
+def test_large_deltas_are_gzipped(patient_id):
+    client.post("/healthdata/batch", json=[reading(150 + i) for i in range(40)])
+    large = changes(0, **{"Accept-Encoding": "gzip"})
+    assert large.headers["content-encoding"] == "gzip"
+    assert len(large.json()["changes"]) == 40
+
+    small = changes(large.json()["cursor"], **{"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert changes(0, **{"Accept-Encoding": "identity"}).headers.get("content-encoding") is None
+
+def test_snapshots_are_paged_and_writes_while_paging_come_next(patient_id):
+    ids = [r["data_id"] for r in client.post("/healthdata/batch", json=[reading(150 + i) for i in range(5)]).json()["results"]]
+    first = page(0)
+    assert [entry["id"] for entry in first.json()["changes"]] == ids[:2]
+    # The sync cursor only moves once the last page is in
+    assert first.json()["cursor"] == 0
+
+    # Edit one row that was already sent and delete another before the next page
+    client.put(f"/healthdata/{ids[0]}", json=reading(140))
+    client.delete(f"/healthdata/{ids[1]}")
+    seen, response = [], first
+    while response.headers.get("X-Next-Cursor"):
+        response = page(0, response.headers["X-Next-Cursor"])
+        seen += [(entry["id"], entry["weight"]) for entry in response.json()["changes"]]
+    assert seen == [(ids[2], 152.0), (ids[3], 153.0), (ids[4], 154.0), (ids[0], 140.0)]
+
+    delta = changes(response.json()["cursor"]).json()
+    assert [(entry["id"], entry["weight"]) for entry in delta["changes"]] == [(ids[0], 140.0)]
+    assert delta["deleted"] == [ids[1]]
+
+def test_deletions_are_paged_with_the_changes(patient_id):
+    ids = [r["data_id"] for r in client.post("/healthdata/batch", json=[reading(150 + i) for i in range(5)]).json()["results"]]
+    since = changes(0).json()["cursor"]
+    for data_id in ids[:4]:
+        client.delete(f"/healthdata/{data_id}")
+    added = client.post("/healthdata/", json=reading(160)).json()["data_id"]
+
+    deleted, seen, response = [], [], page(since)
+    while True:
+        body = response.json()
+        assert len(body["deleted"]) + len(body["changes"]) <= 2
+        deleted += body["deleted"]
+        seen += [entry["id"] for entry in body["changes"]]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        response = page(since, response.headers["X-Next-Cursor"])
+    assert deleted == ids[:4] and seen == [added]
+    assert body["cursor"] == changes(since).json()["cursor"]
+
+def test_each_encoding_has_its_own_etag(patient_id):
+    client.post("/healthdata/batch", json=[reading(150 + i) for i in range(40)])
+    gzipped = changes(0, **{"Accept-Encoding": "gzip"})
+    plain = changes(0, **{"Accept-Encoding": "identity"})
+    assert gzipped.headers["content-encoding"] == "gzip" and "content-encoding" not in plain.headers
+    assert gzipped.headers["etag"] != plain.headers["etag"]
+    assert gzipped.headers["vary"] == "Accept-Encoding"
+    # A tag for one encoding never revalidates the other
+    assert changes(0, **{"Accept-Encoding": "identity", "If-None-Match": gzipped.headers["etag"]}).status_code == 200
+    assert changes(0, **{"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["etag"]}).status_code == 304
+
+def test_invalid_change_cursor_rejected(patient_id):
+    assert page(0, "not-a-cursor").status_code == 400
+
+def test_compacted_tombstones_expire_old_cursors(db_session, patient_id):
+    entry_id = client.post("/healthdata/", json=reading(150)).json()["data_id"]
+    cursor = changes(0).json()["cursor"]
+    client.delete(f"/healthdata/{entry_id}")
+    latest = changes(cursor).json()
+    assert latest["deleted"] == [entry_id]
+
+    assert compact_tombstones(db_session, now=datetime.utcnow() + timedelta(days=365)) >= 1
+    assert changes(cursor).status_code == 410
+    assert changes(latest["cursor"]).json()["deleted"] == []
+    assert changes(0).status_code == 200
+
+def test_periodic_tasks_open_sessions_through_app_state(db_session):
+    task = PeriodicTask("Probe", lambda db: db is db_session, interval=3600)
+    assert asyncio.run(task.run_once(app))
@@ -0,0 +1,32 @@
+import asyncio
+import pytest
+from jobs import InMemoryJobQueue, JobQueue, FAILED, SUCCEEDED
+
+def test_in_memory_queue_runs_dedupes_and_reports_failures():
+    async def handler(payload):
+        await asyncio.sleep(0.01)
+        if payload.get("fail"):
+            raise ValueError("boom")
+        return payload["n"] * 2
+
+    async def scenario():
+        queue = InMemoryJobQueue(workers=2, ttl=60)
+        await queue.start(handler)
+        first = await queue.submit("same", owner=1, payload={"n": 21})
+        duplicate = await queue.submit("same", owner=1, payload={"n": 21})
+        failing = await queue.submit("other", owner=1, payload={"fail": True})
+        assert duplicate is first
+
+        assert (await queue.wait(first.id, 1)).result == 42
+        assert (await queue.wait(failing.id, 1)).status == FAILED
+        # Once finished, the same key starts a fresh job
+        rerun = await queue.submit("same", owner=1, payload={"n": 1})
+        assert rerun.id != first.id
+        assert (await queue.wait(rerun.id, 1)).status == SUCCEEDED
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+def test_job_queue_is_an_abstract_interface():
+    with pytest.raises(TypeError):
+        JobQueue()
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from fastapi.testclient import TestClient
+from .main import app
+from fake_llm import FakeLLM
+import llm as llm_module
+import metrics
+
+client = TestClient(app)
+
+def sample(name, **labels):
+    return metrics.registry.get_sample_value(name, labels) or 0
+
+def test_metrics_record_route_latency_and_queries(patient_id):
+    before = sample("http_request_duration_seconds_count", method="GET", route="/healthdata/")
+    client.post("/healthdata/", json={"weight": 150, "bp": "120/80", "glucose": 90})
+    entry_id = client.get("/healthdata/").json()[0]["id"]
+    client.get(f"/healthdata/{entry_id}")  # no such route for GET: recorded as 405 on the template
+
+    assert sample("http_request_duration_seconds_count", method="GET", route="/healthdata/") == before + 1
+    assert sample("http_requests_total", method="POST", route="/healthdata/", status="200") >= 1
+    assert sample("db_queries_per_request_sum", route="/healthdata/") >= 1
+    assert sample("http_requests_in_flight") == 0
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/healthdata/"}' in response.text
+    # Raw paths never become labels
+    assert f"/healthdata/{entry_id}" not in response.text
+
+def test_requests_over_query_threshold_are_flagged(patient_id, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SQL_QUERY_WARN_THRESHOLD", 0)
+    before = sample("db_query_threshold_exceeded_total", route="/healthdata/")
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        client.get("/healthdata/")
+    assert sample("db_query_threshold_exceeded_total", route="/healthdata/") == before + 1
+    assert "GET /healthdata/ ran" in caplog.text
+
+def test_write_routes_stay_under_query_threshold(patient_id, caplog):
+    # Three readings so edits and deletes hit the rollups' min/max and force bucket rebuilds
+    ids = [
+        client.post("/healthdata/", json={"weight": 150 + i, "bp": "120/80", "glucose": 90, "timestamp": f"2024-03-0{i + 1}T08:00:00"}).json()["data_id"]
+        for i in range(3)
+    ]
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        client.put(f"/healthdata/{ids[2]}", json={"weight": 140, "bp": "121/80", "glucose": 91, "timestamp": "2024-05-03T08:00:00"})
+        client.post("/healthdata/batch", json=[{"weight": 150, "bp": "120/80", "glucose": 90}] * 5)
+        client.delete(f"/healthdata/{ids[0]}")
+    assert "SQL queries" not in caplog.text
+
+def test_llm_latency_and_token_usage(monkeypatch):
+    monkeypatch.setattr(llm_module, "_client", FakeLLM())
+    calls = sample("llm_request_duration_seconds_count", operation="complete", outcome="ok")
+    tokens = sample("llm_tokens_total", kind="completion")
+    asyncio.run(llm_module.complete("How am I doing?"))
+    assert sample("llm_request_duration_seconds_count", operation="complete", outcome="ok") == calls + 1
+    assert sample("llm_tokens_total", kind="completion") > tokens
@@ -0,0 +1,47 @@
+from sqlalchemy import create_engine, inspect, text
+from migrations import migrate
+
+def test_migrate_upgrades_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE ai_insights (id INTEGER PRIMARY KEY, health_data_id INTEGER NOT NULL, insight TEXT)"))
+        conn.execute(text("INSERT INTO ai_insights (health_data_id, insight) VALUES (1, 'old')"))
+
+    migrate(engine)
+    migrate(engine)  # idempotent
+
+    inspector = inspect(engine)
+    columns = {column["name"] for column in inspector.get_columns("ai_insights")}
+    assert {"patient_id", "fingerprint", "prompt_version", "created_at"} <= columns
+    assert "ix_health_data_patient_timestamp" in {index["name"] for index in inspector.get_indexes("health_data")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT insight FROM ai_insights")).scalar() == "old"
+
+def test_migrate_backfills_blood_pressure_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE health_data (id INTEGER PRIMARY KEY, patient_id INTEGER NOT NULL, "
+            "weight FLOAT, bp VARCHAR, glucose FLOAT, timestamp DATETIME)"
+        ))
+        conn.execute(text(
+            "INSERT INTO health_data (patient_id, weight, bp, glucose, timestamp) VALUES "
+            "(1, 150, '120/80', 90, '2025-03-03 08:00:00'), (1, 151, '140 / 95', 92, '2025-03-04 08:00:00'), "
+            "(1, 152, 'n/a', 91, '2025-03-05 08:00:00')"
+        ))
+
+    migrate(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT systolic, diastolic FROM health_data ORDER BY id")).all()
+        assert [tuple(row) for row in rows] == [(120, 80), (140, 95), (None, None)]
+        month = conn.execute(text(
+            "SELECT systolic_count, systolic_max, diastolic_min FROM health_data_rollups WHERE bucket = 'month'"
+        )).one()
+        assert tuple(month) == (2, 140, 80)
+        stats = dict(conn.execute(text("SELECT metric, count FROM health_metric_stats")).all())
+        assert stats == {"weight": 3, "glucose": 3, "systolic": 2, "diastolic": 2}
+        sketch = conn.execute(text(
+            "SELECT SUM(count) FROM metric_sketches WHERE metric = 'systolic' AND bucket = 'month'"
+        )).scalar()
+        assert sketch == 2
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from passlib.context import CryptContext
+from .main import app
+from .models import User
+import auth as auth_module
+import metrics
+from hashing import PasswordHasher, HashingPoolFull
+from utils import BCRYPT_ROUNDS
+
+client = TestClient(app)
+
+def test_pool_rejects_when_queue_is_full():
+    hasher = PasswordHasher(workers=1, max_queue=1, executor="thread")
+    release = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(hasher.run(release.wait))
+        second = asyncio.ensure_future(hasher.run(release.wait))
+        await asyncio.sleep(0.05)
+        assert hasher.stats()["queue_depth"] == 1
+        with pytest.raises(HashingPoolFull):
+            await hasher.run(release.wait)
+        release.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(scenario())
+    assert hasher.stats()["rejected"] == 1
+    hasher.shutdown()
+
+def test_login_returns_503_when_hashing_is_saturated(monkeypatch):
+    full = PasswordHasher(workers=1, max_queue=0, executor="thread")
+    full.pending = 1
+    monkeypatch.setattr(auth_module, "password_hasher", full)
+    response = client.post("/auth/register", json={"email": "busy@example.com", "password": "pass123", "firstName": "B", "lastName": "Usy"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+
+def test_login_rehashes_outdated_cost_factor(db_session):
+    previous_cost = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS + 1)
+    user = User(email="rehash@example.com", password=previous_cost.hash("pass123"), first_name="Re", last_name="Hash")
+    db_session.add(user)
+    db_session.commit()
+
+    response = client.post("/auth/login", json={"email": "rehash@example.com", "password": "pass123"})
+    assert response.status_code == 200, response.text
+
+    db_session.refresh(user)
+    assert user.password.startswith(f"$2b${BCRYPT_ROUNDS:02d}$")
+    assert metrics.registry.get_sample_value("password_hash_jobs_total", {"outcome": "completed"}) >= 2
+
+def test_failed_jobs_are_not_counted_as_completed():
+    hasher = PasswordHasher(workers=1, max_queue=0, executor="thread")
+
+    def boom():
+        raise ValueError("bad hash")
+
+    with pytest.raises(ValueError):
+        asyncio.run(hasher.run(boom))
+    assert hasher.stats()["failed"] == 1 and hasher.stats()["completed"] == 0
+    assert hasher.pending == 0
+    hasher.shutdown()
+
+def test_stats_are_scraped_not_served():
+    assert client.get("/auth/hashing/stats").status_code == 404
+    body = client.get("/metrics").text
+    assert "password_hash_in_flight 0.0" in body and "password_hash_workers" in body
@@ -0,0 +1,120 @@
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from ratelimit import (
+    AdmissionGate, AdmissionRejected, InMemoryRateLimitBackend, RateLimitBackend, RateLimitMiddleware, route_group,
+)
+from utils import create_access_token
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def limited_app(clock, limits=None, admission=None):
+    app = FastAPI()
+
+    @app.get("/healthdata/")
+    async def list_entries():
+        return []
+
+    @app.post("/healthdata/")
+    async def log_entry():
+        return {"message": "ok"}
+
+    @app.post("/auth/login")
+    async def login():
+        return {"access_token": "x"}
+
+    app.add_middleware(
+        RateLimitMiddleware,
+        backend=InMemoryRateLimitBackend(clock=clock),
+        limits=limits or {"auth": 2, "write": 3, "read": 60},
+        admission=admission or {},
+    )
+    return TestClient(app)
+
+def bearer(user_id):
+    return {"Authorization": f"Bearer {create_access_token({'sub': str(user_id)})}"}
+
+def test_route_groups():
+    assert route_group("POST", "/auth/login") == "auth"
+    assert route_group("POST", "/ai/") == "ai"
+    assert route_group("GET", "/ai/jobs/abc") == "read"
+    assert route_group("POST", "/healthdata/batch") == "write"
+    assert route_group("GET", "/admin/analytics/percentiles") == "read"
+    assert route_group("GET", "/metrics") is None
+
+def test_backends_must_implement_take():
+    with pytest.raises(TypeError):
+        RateLimitBackend()
+
+def test_bucket_limits_each_user_and_refills():
+    clock = Clock()
+    client = limited_app(clock)
+    responses = [client.post("/healthdata/", headers=bearer(1)) for _ in range(4)]
+    assert [r.status_code for r in responses] == [200, 200, 200, 429]
+    assert responses[0].headers["RateLimit-Limit"] == "3"
+    assert responses[0].headers["RateLimit-Remaining"] == "2"
+    assert responses[0].headers["RateLimit-Policy"] == "3;w=60"
+    # Three per minute: the next token arrives 20 seconds after the burst
+    assert responses[3].headers["Retry-After"] == "20"
+    assert responses[3].json() == {"detail": "Too many requests"}
+
+    # Other users and other route groups have their own buckets
+    assert client.post("/healthdata/", headers=bearer(2)).status_code == 200
+    assert client.get("/healthdata/", headers=bearer(1)).status_code == 200
+
+    clock.now = 20
+    assert client.post("/healthdata/", headers=bearer(1)).status_code == 200
+    assert client.post("/healthdata/", headers=bearer(1)).status_code == 429
+
+def test_auth_routes_are_limited_per_ip():
+    client = limited_app(Clock())
+    # A token doesn't buy a fresh bucket on /auth
+    statuses = [client.post("/auth/login", headers=bearer(i)).status_code for i in range(3)]
+    assert statuses == [200, 200, 429]
+
+def test_invalid_tokens_fall_back_to_the_client_ip():
+    client = limited_app(Clock())
+    headers = {"Authorization": "Bearer not-a-token"}
+    assert [client.post("/healthdata/", headers=headers).status_code for _ in range(4)] == [200, 200, 200, 429]
+
+def test_admission_gate_queues_then_rejects():
+    async def scenario():
+        gate = AdmissionGate(1, max_queue=1, timeout=0.05)
+        await gate.acquire()
+        # One request may wait for the slot; the next is turned away at once
+        waiter = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await gate.acquire()
+        gate.release()
+        await waiter
+        # A queued request that waits past the timeout is turned away too
+        with pytest.raises(AdmissionRejected):
+            await gate.acquire()
+        gate.release()
+        await gate.acquire()
+
+    asyncio.run(scenario())
+
+def test_busy_routes_answer_503():
+    client = limited_app(Clock(), admission={"login": 1})
+    # Starlette builds the middleware stack on the first request
+    client.get("/healthdata/")
+    middleware = client.app.middleware_stack
+    while not isinstance(middleware, RateLimitMiddleware):
+        middleware = middleware.app
+    # Hold the only login slot with no room to queue, so the next login can't wait
+    gate = middleware.gates["login"]
+    gate.max_queue = 0
+    asyncio.run(gate.acquire())
+    response = client.post("/auth/login")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    assert response.headers["RateLimit-Remaining"] == "1"
+    gate.release()
+    assert client.post("/auth/login").status_code == 200
@@ -0,0 +1,165 @@
+import gzip
+import json
+from datetime import datetime
+from fastapi.testclient import TestClient
+from .main import app
+from .models import HealthData, HealthDataDailySummary, HealthMetricStats
+from retention import run_retention
+
+client = TestClient(app)
+
+# A week starting Monday 2024-03-04; retention at noon on the 7th with a one-day window moves the 4th and 5th
+NOW = datetime(2024, 3, 7, 12)
+
+def readings():
+    return [
+        {"weight": 150, "bp": "120/80", "glucose": 90, "timestamp": "2024-03-04T08:00:00"},
+        {"weight": 152, "bp": "130/84", "glucose": 110, "timestamp": "2024-03-04T20:00:00"},
+        {"weight": 151, "bp": "124/82", "glucose": 100, "timestamp": "2024-03-05T08:00:00"},
+        {"weight": 149, "bp": "122/80", "glucose": 95, "timestamp": "2024-03-06T08:00:00"},
+        {"weight": 148, "bp": "118/78", "glucose": 92, "timestamp": "2024-03-07T08:00:00"},
+    ]
+
+def cleanup(db_session, patient_id):
+    for model in (HealthDataDailySummary, HealthMetricStats):
+        db_session.query(model).filter(model.patient_id == patient_id).delete()
+    db_session.commit()
+
+def test_old_readings_become_daily_summaries(db_session, patient_id, tmp_path):
+    ids = [r["data_id"] for r in client.post("/healthdata/batch", json=readings()).json()["results"]]
+    week_before = client.get("/healthdata/stats", params={"bucket": "week"}).json()
+    baselines_before = client.get("/healthdata/anomalies").json()["baselines"]
+
+    assert run_retention(db_session, now=NOW, raw_days=1, archive_dir=str(tmp_path)) == 3
+    assert db_session.query(HealthData).filter(HealthData.patient_id == patient_id).count() == 2
+
+    days = db_session.query(HealthDataDailySummary).filter(
+        HealthDataDailySummary.patient_id == patient_id
+    ).order_by(HealthDataDailySummary.day).all()
+    assert [(d.day, d.count, d.weight_min, d.weight_max, d.glucose_sum) for d in days] == [
+        (datetime(2024, 3, 4), 2, 150, 152, 200),
+        (datetime(2024, 3, 5), 1, 151, 151, 100),
+    ]
+
+    # The raw rows are archived before they go
+    archived = [json.loads(line) for path in (tmp_path / str(patient_id)).iterdir() for line in gzip.open(path)]
+    assert sorted(row["id"] for row in archived) == ids[:3]
+    assert {row["weight"] for row in archived} == {150, 152, 151}
+
+    # Rollups and running stats already counted these readings and stay as they were
+    assert client.get("/healthdata/stats", params={"bucket": "week"}).json() == week_before
+    assert client.get("/healthdata/anomalies").json()["baselines"] == baselines_before
+
+    # Listings continue past the live rows with one entry per day at that day's means
+    listed = client.get("/healthdata/").json()
+    assert [e["id"] for e in listed] == [ids[4], ids[3], -days[1].id, -days[0].id]
+    assert listed[3] == {
+        "id": -days[0].id, "weight": 151.0, "bp": "125/82", "systolic": 125, "diastolic": 82,
+        "glucose": 100.0, "timestamp": "2024-03-04T00:00:00",
+    }
+    cleanup(db_session, patient_id)
+
+def test_pagination_and_export_cover_summaries(db_session, patient_id):
+    client.post("/healthdata/batch", json=readings())
+    run_retention(db_session, now=NOW, raw_days=1, archive_dir=None)
+
+    seen, cursor = [], None
+    while True:
+        response = client.get("/healthdata/", params={"limit": 1, **({"cursor": cursor} if cursor else {})})
+        seen += [e["timestamp"] for e in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ["2024-03-07T08:00:00", "2024-03-06T08:00:00", "2024-03-05T00:00:00", "2024-03-04T00:00:00"]
+
+    lines = client.get("/healthdata/export", params={"format": "ndjson"}).text.splitlines()
+    assert [json.loads(line)["timestamp"] for line in lines] == [
+        "2024-03-04T00:00:00", "2024-03-05T00:00:00", "2024-03-06T08:00:00", "2024-03-07T08:00:00",
+    ]
+    cleanup(db_session, patient_id)
+
+def test_rollups_stay_exact_after_retention(db_session, patient_id):
+    ids = [r["data_id"] for r in client.post("/healthdata/batch", json=readings()).json()["results"]]
+    run_retention(db_session, now=NOW, raw_days=1, archive_dir=None)
+
+    # Deleting the week's minimum forces a rebuild, which has to include the summarised days
+    client.delete(f"/healthdata/{ids[4]}")
+    week = client.get("/healthdata/stats", params={"bucket": "week"}).json()[0]
+    assert week["count"] == 4
+    assert week["weight"] == {"count": 4, "mean": 150.5, "min": 149.0, "max": 152.0}
+    assert week["systolic"]["max"] == 130
+    cleanup(db_session, patient_id)
+
+def test_disabled_by_default(db_session, patient_id):
+    client.post("/healthdata/batch", json=readings())
+    assert run_retention(db_session, now=NOW, raw_days=0) == 0
+    assert db_session.query(HealthData).filter(HealthData.patient_id == patient_id).count() == 5
+
+def test_days_without_a_parsed_bp_list_without_one(db_session, patient_id):
+    from healthdata import HealthDataResponse
+    # A legacy row whose bp never parsed into systolic/diastolic
+    db_session.add(HealthData(patient_id=patient_id, weight=150, bp="high", glucose=90, timestamp=datetime(2024, 3, 4, 8)))
+    db_session.commit()
+    assert run_retention(db_session, now=NOW, raw_days=1, archive_dir=None) == 1
+
+    listed = client.get("/healthdata/").json()
+    assert [(e["weight"], e["bp"], e["systolic"]) for e in listed] == [(150.0, None, None)]
+    assert HealthDataResponse.model_validate(listed[0]).bp is None
+    cleanup(db_session, patient_id)
+
+def test_delta_sync_replaces_archived_rows_with_summaries(db_session, patient_id):
+    ids = [r["data_id"] for r in client.post("/healthdata/batch", json=readings()).json()["results"]]
+    cursor = client.get("/healthdata/changes", params={"since": 0}).json()["cursor"]
+    run_retention(db_session, now=NOW, raw_days=1, archive_dir=None)
+
+    delta = client.get("/healthdata/changes", params={"since": cursor}).json()
+    assert sorted(delta["deleted"]) == ids[:3]
+    assert [(e["id"] < 0, e["timestamp"]) for e in delta["changes"]] == [
+        (True, "2024-03-04T00:00:00"), (True, "2024-03-05T00:00:00"),
+    ]
+    assert delta["cursor"] > cursor
+
+    # A fresh sync sees the live rows and the summaries, and nothing else
+    full = client.get("/healthdata/changes", params={"since": 0}).json()
+    assert sorted(e["timestamp"] for e in full["changes"]) == [
+        "2024-03-04T00:00:00", "2024-03-05T00:00:00", "2024-03-06T08:00:00", "2024-03-07T08:00:00",
+    ]
+
+    # Paging one item at a time walks across the summaries and the live rows alike
+    paged, params = [], {"since": 0, "limit": 1}
+    while True:
+        response = client.get("/healthdata/changes", params=params)
+        paged += response.json()["changes"]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert paged == full["changes"] and response.json()["cursor"] == full["cursor"]
+    cleanup(db_session, patient_id)
+
+def test_fully_archived_users_keep_their_history(db_session, patient_id):
+    from anomalies import rebuild_patient_stats
+    from insights import data_fingerprint
+    from rollups import rebuild_all
+    from rule_insights import load_recent_readings
+
+    client.post("/healthdata/batch", json=readings())
+    weeks = client.get("/healthdata/stats", params={"bucket": "week"}).json()
+    baselines = client.get("/healthdata/anomalies").json()["baselines"]
+    run_retention(db_session, now=datetime(2024, 4, 1), raw_days=1, archive_dir=None)
+    assert db_session.query(HealthData).filter(HealthData.patient_id == patient_id).count() == 0
+
+    fingerprint, latest_id = data_fingerprint(db_session, patient_id)
+    assert fingerprint is not None and latest_id is None
+    assert [reading[1] for reading in load_recent_readings(db_session, patient_id)] == [151.0, 151.0, 149.0, 148.0]
+
+    # Rebuilds read the summaries, so nothing the user logged is lost
+    rebuild_all(db_session)
+    assert client.get("/healthdata/stats", params={"bucket": "week"}).json() == weeks
+    rebuild_patient_stats(db_session, patient_id)
+    db_session.commit()
+    rebuilt = client.get("/healthdata/anomalies").json()["baselines"]
+    for metric in ("weight", "glucose", "systolic", "diastolic"):
+        assert rebuilt[metric]["count"] == baselines[metric]["count"]
+        assert rebuilt[metric]["mean"] == baselines[metric]["mean"]
+        assert rebuilt[metric]["std"] == baselines[metric]["std"]
+    cleanup(db_session, patient_id)
@@ -0,0 +1,36 @@
+import pytest
+from fastapi import HTTPException
+from models import User
+import security
+from security import TTLCache, token_claims, principal_cache
+from utils import create_access_token
+
+def test_ttl_cache_evicts_oldest_and_expired(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(security.time, "monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+    now[0] += 11
+    assert cache.get("a") is None
+
+def test_token_claims_are_cached(monkeypatch):
+    token = create_access_token({"sub": "7"})
+    assert token_claims(f"Bearer {token}")["sub"] == 7
+    monkeypatch.setattr(security, "decode_access_token", lambda t: pytest.fail("decoded twice"))
+    assert token_claims(f"Bearer {token}")["sub"] == 7
+    with pytest.raises(HTTPException):
+        token_claims("Basic abc")
+
+def test_user_changes_invalidate_cached_principal(db_session):
+    user = User(email="cached@example.com", password="hashed", first_name="Old")
+    db_session.add(user)
+    db_session.commit()
+    principal_cache.set(user.id, security.Principal.from_user(user))
+
+    user.first_name = "New"
+    db_session.commit()
+    assert principal_cache.get(user.id) is None
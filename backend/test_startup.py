@@ -0,0 +1,27 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent
+
+CHILD = """
+import json, sys
+import main, database, llm
+print(json.dumps({
+    "engines": len(database._engines),
+    "llm_client": llm._client is not None,
+    "openai_imported": "openai" in sys.modules,
+}))
+"""
+
+def test_importing_the_app_has_no_side_effects(tmp_path):
+    db_path = tmp_path / "untouched.db"
+    env = {**os.environ, "DB_URL": f"sqlite:///{db_path}", "LLM_BACKEND": "openai"}
+    env.pop("TESTING", None)
+    result = subprocess.run([sys.executable, "-c", CHILD], env=env, cwd=BACKEND, capture_output=True, text=True, check=True)
+
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == {"engines": 0, "llm_client": False, "openai_imported": False}
+    # No engine, no migration: the database file was never created
+    assert not db_path.exists()
@@ -13,9 +13,19 @@ export async function logHealthData(token: string, payload: HealthDataPayload):
   return response.data;
 }
 
+// The listing is paged; each response names the next page in this header until the last one
+const NEXT_CURSOR_HEADER = "x-next-cursor";
+
 export async function getHealthData(token: string): Promise<any[]> {
-  const response = await apiClient.get("/healthdata/", {
-    headers: { Authorization: `Bearer ${token}` },
-  });
-  return response.data;
+  const entries: any[] = [];
+  let cursor: string | undefined;
+  do {
+    const response = await apiClient.get("/healthdata/", {
+      headers: { Authorization: `Bearer ${token}` },
+      params: cursor ? { cursor } : undefined,
+    });
+    entries.push(...response.data);
+    cursor = response.headers[NEXT_CURSOR_HEADER];
+  } while (cursor);
+  return entries;
 }
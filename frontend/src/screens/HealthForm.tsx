@@ -12,7 +12,7 @@ import {
 import Slider from "@react-native-community/slider";
 import { NativeStackScreenProps } from "@react-navigation/native-stack";
 import { RootStackParamList } from "../navigation/AppNavigator";
-import { logHealthData } from "../api/healthdata";
+import { getHealthData, logHealthData } from "../api/healthdata";
 import axios from "axios";
 
 type Props = NativeStackScreenProps<RootStackParamList, "HealthForm">;
@@ -35,10 +35,7 @@ const HealthForm = ({ route, navigation }: Props) => {
 
   const fetchEntries = async () => {
     try {
-      const response = await axios.get("http://localhost:8000/healthdata/", {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      setEntries(response.data);
+      setEntries(await getHealthData(token));
     } catch (error) {
       console.error("Fetch error:", error);
     }